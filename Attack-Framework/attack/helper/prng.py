@@ -0,0 +1,221 @@
+import numpy as np
+
+
+class _LinearGenerator:
+    """
+    Base class for generators whose state transition is linear over GF(2) (shifts, rotations and XORs). The state is
+    kept as a list of uint64 words. Jumps are done with powers of the transition matrix, which allows to generate long
+    sequences in many lanes at once: every lane starts at another offset and all lanes are stepped together.
+    """
+
+    # number of bits of every state word
+    word_bits = []
+
+    def __init__(self, state):
+        """
+        :param state: list with the state words
+        """
+        self.state = [np.array(word, dtype=np.uint64).reshape(1) for word in state]
+        # powers T^(2^k) of the transition matrix, computed upon first use
+        self.powers = list()
+
+    def step(self, state):
+        """
+        Advances the states of all lanes by one
+        :param state: list with one array per state word
+        :return: list with the next state words
+        """
+        raise NotImplementedError
+
+    def output(self, state):
+        """
+        Output of the generator for the states of all lanes
+        :param state: list with one array per state word
+        :return: array with the outputs
+        """
+        raise NotImplementedError
+
+    def to_bits(self, state):
+        """
+        :param state: list with one array (lanes) per state word
+        :return: array (state bits x lanes) with the bits of the states
+        """
+        bits = list()
+        for word, nbits in zip(state, self.word_bits):
+            word_bits = np.unpackbits(word.astype("<u8").view(np.uint8).reshape((-1, 8)), axis=1, bitorder="little")
+            bits.append(word_bits[:, :nbits].T)
+        return np.concatenate(bits, axis=0)
+
+    def from_bits(self, bits):
+        """
+        :param bits: array (state bits x lanes) with the bits of the states
+        :return: list with one array (lanes) per state word
+        """
+        state = list()
+        first = 0
+        for nbits in self.word_bits:
+            word_bits = np.zeros((bits.shape[1], 64), dtype=np.uint8)
+            word_bits[:, :nbits] = bits[first : first + nbits].T
+            state.append(np.packbits(word_bits, axis=1, bitorder="little").view("<u8").reshape(-1).astype(np.uint64))
+            first = first + nbits
+        return state
+
+    def get_power(self, distance):
+        """
+        Transition matrix for a jump of 'distance' steps
+        :param distance: number of steps
+        :return: array (state bits x state bits) over GF(2)
+        """
+        nbits = sum(self.word_bits)
+        if len(self.powers) == 0:
+            # columns: successors of the unit vectors
+            self.powers.append(self.to_bits(self.step(self.from_bits(np.eye(nbits, dtype=np.uint8)))).astype(np.int64))
+        matrix = np.eye(nbits, dtype=np.int64)
+        k = 0
+        while distance > 0:
+            if k == len(self.powers):
+                self.powers.append((self.powers[-1] @ self.powers[-1]) & 1)
+            if distance & 1:
+                matrix = (self.powers[k] @ matrix) & 1
+            distance = distance >> 1
+            k = k + 1
+        return matrix
+
+    def jump(self, distance):
+        """
+        Advances the generator by an arbitrary number of steps without generating the outputs
+        :param distance: number of steps
+        :return: self
+        """
+        distance = int(distance)
+        if distance < 0:
+            raise ValueError("Generators can only jump ahead.")
+        if distance > 0:
+            self.state = self.from_bits((self.get_power(distance) @ self.to_bits(self.state)) & 1)
+        return self
+
+    def generate(self, n, lanes=None):
+        """
+        Outputs of the current and the following n-1 states. Afterwards, the generator is advanced by n steps.
+        :param n: number of outputs
+        :param lanes: number of sequences that are generated in parallel (default: about the square root of n)
+        :return: array with the outputs
+        """
+        n = int(n)
+        if lanes is None:
+            lanes = int(np.sqrt(n))
+        lanes = max(1, min(int(lanes), n))
+        steps = -(-n // lanes) if n > 0 else 0
+
+        # start of every lane: jump by 'steps' from the start of the previous lane
+        bits = self.to_bits(self.state).astype(np.int64)
+        if lanes > 1:
+            power = self.get_power(steps)
+            while bits.shape[1] < lanes:
+                bits = np.concatenate([bits, (power @ bits) & 1], axis=1)
+                power = (power @ power) & 1
+        state = self.from_bits(bits[:, :lanes])
+
+        outputs = np.zeros((lanes, steps), dtype=self.output(state).dtype)
+        for step in range(0, steps):
+            outputs[:, step] = self.output(state)
+            state = self.step(state)
+
+        if lanes == 1:
+            self.state = state
+        else:
+            self.jump(n)
+        return outputs.reshape(-1)[:n]
+
+
+class Xoroshiro128Plus(_LinearGenerator):
+    """
+    xoroshiro128+ generator (D. Blackman, S. Vigna), i.e. the input RNG of the TPU design. The output of a state is
+    the sum of both state words, the sequence of a measurement starts with the output of the seed.
+    """
+
+    word_bits = [64, 64]
+
+    def __init__(self, s0, s1, a=24, b=16, c=37):
+        """
+        :param s0: first state word
+        :param s1: second state word
+        :param a: rotation of s0 (55 for the original version of the generator)
+        :param b: shift of s1 (14 for the original version of the generator)
+        :param c: rotation of s1 (36 for the original version of the generator)
+        """
+        self.a, self.b, self.c = np.uint64(a), np.uint64(b), np.uint64(c)
+        super().__init__([s0, s1])
+
+    @property
+    def state_s0(self):
+        return self.state[0][0]
+
+    @property
+    def state_s1(self):
+        return self.state[1][0]
+
+    @staticmethod
+    def rotl(x, k):
+        return (x << k) | (x >> (np.uint64(64) - k))
+
+    def step(self, state):
+        s0, s1 = state
+        s1 = s1 ^ s0
+        return [self.rotl(s0, self.a) ^ s1 ^ (s1 << self.b), self.rotl(s1, self.c)]
+
+    def output(self, state):
+        return state[0] + state[1]
+
+
+class LFSRPlus(_LinearGenerator):
+    """
+    Uniform output of the LFSR based noise generator (entity noise_gen, LFSR_Plus.vhd). The register is shifted to the
+    right, the feedback enters the most significant bit. The output u_noise_out follows the register with a latency of
+    two clock cycles after reset, i.e. the sequence starts with the seed in the third cycle.
+    """
+
+    # taps of the feedback (bits of the register) per width
+    taps = {
+        24: [7, 2, 1, 0],
+        23: [5, 0],
+        22: [1, 0],
+        21: [2, 0],
+        20: [3, 0],
+        19: [15, 13, 0],
+        18: [7, 0],
+        17: [3, 0],
+        16: [5, 3, 2, 0],
+        15: [1, 0],
+        14: [12, 2, 1, 0],
+        13: [5, 2, 1, 0],
+        12: [8, 2, 1, 0],
+        11: [1, 0],
+        10: [3, 0],
+        9: [4, 0],
+        8: [4, 3, 2, 0],
+        7: [1, 0],
+        6: [1, 0],
+        5: [2, 0],
+    }
+
+    def __init__(self, W=16, seed0=6518429):
+        """
+        :param W: width of the register (generic W, 5 to 24)
+        :param seed0: seed (generic seed0, the lower W bits are used)
+        """
+        if W not in self.taps:
+            raise ValueError("LFSR width %i is not supported." % W)
+        self.W = W
+        self.word_bits = [W]
+        super().__init__([seed0 & (2**W - 1)])
+
+    def step(self, state):
+        register = state[0]
+        feedback = np.zeros_like(register)
+        for tap in self.taps[self.W]:
+            feedback = feedback ^ (register >> np.uint64(tap))
+        return [(register >> np.uint64(1)) | ((feedback & np.uint64(1)) << np.uint64(self.W - 1))]
+
+    def output(self, state):
+        return state[0].astype(np.uint32)
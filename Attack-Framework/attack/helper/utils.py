@@ -1,8 +1,11 @@
 import datetime
+import functools
+import itertools
 import h5py
 import logging
 import numpy as np
 from scipy import signal
+from scipy import fft as sp_fft
 import os
 import sys
 import time
@@ -11,6 +14,7 @@ from subprocess import Popen, PIPE
 import subprocess
 import shlex
 import re
+from collections import OrderedDict
 
 _logger = logging.getLogger(__name__)
 
@@ -79,14 +83,14 @@ class DATAutils:
         # check if trace is int16
         if trace.dtype == np.int16:
             # check if downsampling is possible
-            if not np.count_nonzero((trace + 2**15) % 2**8):
+            if not np.count_nonzero((trace.astype(np.int32) + 2**15) % 2**8):
                 # downsample and add the offset (all calculations done as int16)
                 trace = np.uint8((trace // 2**8) + 2**7)
             else:
                 _logger.warning("Conversion from int16 to uint8 not possible!")
         elif trace.dtype == np.int8:
             # add the offset
-            trace = np.uint8((trace + 2**7))
+            trace = np.uint8((trace.astype(np.int16) + 2**7))
         else:
             _logger.debug("Currently supported datatypes for conversion to uint8: int8, int16.")
         return trace
@@ -245,7 +249,7 @@ class HDF5utils:
         return
 
     @staticmethod
-    def hdf5_add_group(h5filehandle, configfile, N_traces, noSamples, group=0, N_repetitions=1, x=None, y=None, z=None):
+    def hdf5_add_group(h5filehandle, configfile, N_traces, noSamples, group=0, N_repetitions=1, x=None, y=None, z=None, chunk_traces=None, compression=None):
         """
         Adds a measurement group (i.e. per measurement position) with respective datasets
         :param h5filehandle
@@ -256,6 +260,9 @@ class HDF5utils:
         :param x: x coordinate in mm (default: None if no table is used)
         :param y: y coordinate in mm (default: None if no table is used)
         :param z: z coordinate in mm (default: None if no table is used)
+        :param chunk_traces: number of traces per chunk, should match the batch size of HDF5writer (default: None, i.e.
+               contiguous datasets)
+        :param compression: compression filter for chunked datasets, e.g. 'gzip' or 'lzf' (default: None)
         :return: h5group
         :return: num_datasets: list with channel and dataset string
         """
@@ -301,7 +308,11 @@ class HDF5utils:
                     add_attributes = False
 
                 # generate dataset with specified name, dimension (iterations x dim) and datatype
-                dset = h5group.create_dataset(datasets, (N_traces, dataset_dim, repetition_dim), dtype=configfile["HDF5"]["datasets"][datasets]["datatype"])
+                if chunk_traces is None or N_traces == 0:
+                    dset = h5group.create_dataset(datasets, (N_traces, dataset_dim, repetition_dim), dtype=configfile["HDF5"]["datasets"][datasets]["datatype"])
+                else:
+                    chunks = HDF5utils.hdf5_get_chunkshape((N_traces, dataset_dim, repetition_dim), dtype=configfile["HDF5"]["datasets"][datasets]["datatype"], chunk_traces=chunk_traces)
+                    dset = h5group.create_dataset(datasets, (N_traces, dataset_dim, repetition_dim), dtype=configfile["HDF5"]["datasets"][datasets]["datatype"], chunks=chunks, compression=compression)
 
                 if add_attributes:
                     # add all channel attributes
@@ -326,6 +337,25 @@ class HDF5utils:
         h5group.attrs["timestamp"] = time.strftime("%s")
         return h5filehandle, diff_datasets
 
+    @staticmethod
+    def hdf5_get_chunkshape(shape, dtype, chunk_traces, max_chunk_bytes=2**22):
+        """
+        Determines the chunk shape of a [traces, samples, repetitions] dataset, such that a chunk contains complete traces
+        and a batch of 'chunk_traces' traces consists of whole chunks. If a batch exceeds 'max_chunk_bytes', the number
+        of traces per chunk is reduced to a divisor of 'chunk_traces'.
+        :param shape: shape of the dataset
+        :param dtype: datatype of the dataset
+        :param chunk_traces: desired number of traces per chunk (i.e. the batch size used for writing)
+        :param max_chunk_bytes: upper limit of the chunk size in bytes (default: 4 MiB)
+        :return: chunks: tuple with the chunk shape
+        """
+        chunk_traces = max(1, min(int(chunk_traces), shape[0]))
+        trace_bytes = max(1, int(np.prod(shape[1:])) * np.dtype(dtype).itemsize)
+        traces = chunk_traces
+        while traces > 1 and (traces * trace_bytes > max_chunk_bytes or chunk_traces % traces != 0):
+            traces = traces - 1
+        return (traces, max(1, shape[1]), max(1, shape[2]))
+
     @staticmethod
     def hdf5_add_data(h5filehandle, dataset_name, data, trace_number, group=0, repetition_number=0):
         """
@@ -535,47 +565,118 @@ class HDF5utils:
             handle_out.attrs[name] = value
 
     @staticmethod
-    def copy_dataset(handle, handle_out, dset_name, trace_select=None, repetititon_select=None, dtype=None, copy_doc=False):
-        """
-        Copies a dataset, where the number of traces (rows of the dataset) can be selected, and the datatype can be
-        adapted. Adaption of the datatype maybe beneficial if raw measurement data (uint8) is processed, e.g., by
-        averaging or filtering and thus converted (e.g. float).
-        WARNING: only repetitions or traces can be selected!
+    def copy_dataset(handle, handle_out, dset_name, trace_select=None, repetititon_select=None, dtype=None, copy_doc=False, sample_select=None, block_size=None):
+        """
+        Copies a dataset, where the traces (rows of the dataset), samples and repetitions can be selected, and the
+        datatype can be adapted. Adaption of the datatype maybe beneficial if raw measurement data (uint8) is processed,
+        e.g., by averaging or filtering and thus converted (e.g. float).
+        Without conversion and selection (or a selection of at least one chunk of consecutive traces starting at a chunk
+        boundary), the stored data is copied without decoding (H5Ocopy or raw chunk copy). Otherwise, the data is
+        streamed in blocks of traces, i.e. the selection does not need to fit into memory.
         :param handle: handle that contains the original dataset
         :param handle_out: handle to which the dataset shall be copied
         :param dset_name: name of the dataset
-        :param trace_select: array with indices of traces that shall be copied
-        :param repetititon_select: array with indices of repetitions that shall be copied
+        :param trace_select: array with indices or slice (e.g. with stride) of traces that shall be copied
+        :param repetititon_select: array with indices or slice of repetitions that shall be copied
         :param dtype: optional: new datatype of the copied dataset
+        :param copy_doc: copy the dataset as a whole (e.g. for the documentation)
+        :param sample_select: optional: array with indices or slice (window) of samples that shall be copied
+        :param block_size: number of traces that are copied at once (default: None, i.e. blocks of 256 MiB)
         :return:
         """
         if copy_doc:
             handle_out.create_dataset(dset_name, data=handle)
-        else:
-            if trace_select is None:
-                trace_select = np.arange(0, handle.shape[0])
-
-            if repetititon_select is None:
-                repetititon_select = np.arange(0, handle.shape[2])
+            return
 
-            # create dataset
-            if dtype is None:
-                handle_out.create_dataset(dset_name, shape=(len(trace_select), handle.shape[1], len(repetititon_select)), dtype=handle.dtype)
+        traces = HDF5utils.hdf5_get_selection(trace_select, handle.shape[0])
+        samples = HDF5utils.hdf5_get_selection(sample_select, handle.shape[1])
+        repetitions = HDF5utils.hdf5_get_selection(repetititon_select, handle.shape[2])
+        shape = (len(traces), len(samples), len(repetitions))
+
+        convert = dtype is not None and np.dtype(dtype) != handle.dtype
+        consecutive = len(traces) > 0 and bool(np.all(np.diff(traces) == 1))
+        # the stored data can only be copied if all samples and repetitions are selected in their original order
+        complete = np.array_equal(samples, np.arange(handle.shape[1])) and np.array_equal(repetitions, np.arange(handle.shape[2]))
+        if not convert and consecutive and complete:
+            if shape[0] == handle.shape[0]:
+                # copy the whole dataset as stored in the file (H5Ocopy)
+                handle_out.copy(handle, dset_name, without_attrs=True)
+                return
+            # the copy keeps the chunk shape, i.e. the selection needs to hold at least one chunk of traces
+            if handle.chunks is not None and traces[0] % handle.chunks[0] == 0 and shape[0] >= handle.chunks[0]:
+                HDF5utils.hdf5_copy_chunks(handle, handle_out, dset_name, first=traces[0], n_traces=shape[0])
+                return
+
+        # create dataset
+        dset = handle_out.create_dataset(dset_name, shape=shape, dtype=handle.dtype if dtype is None else dtype)
+        if block_size is None:
+            block_size = max(1, 2**28 // max(1, shape[1] * shape[2] * handle.dtype.itemsize))
+        # stream the selection block by block, the traces are read in ascending order
+        sample_key = slice(samples[0], samples[-1] + 1) if len(samples) > 0 and np.all(np.diff(samples) == 1) else samples
+        repetition_key = slice(repetitions[0], repetitions[-1] + 1) if len(repetitions) > 0 and np.all(np.diff(repetitions) == 1) else repetitions
+        order = np.argsort(traces, kind="stable")
+        ordered = bool(np.all(np.diff(traces) >= 0))
+        for positions, data in TraceStore(handle).iter_blocks(traces=traces[order], samples=sample_key, repetitions=repetition_key, block_traces=block_size):
+            if ordered:
+                dset[positions] = data
             else:
-                handle_out.create_dataset(dset_name, shape=(len(trace_select), handle.shape[1], len(repetititon_select)), dtype=dtype)
-            # copy dataset (currently only one array can be used for selection: do it one after another)
-            tmp = handle[trace_select, :, :]
-            handle_out[dset_name][:] = tmp[:, :, repetititon_select]
+                # write the traces back to their positions within the selection (ascending for h5py)
+                destination = order[positions]
+                write_order = np.argsort(destination)
+                dset[destination[write_order]] = data[write_order]
+
+    @staticmethod
+    def hdf5_get_selection(select, length):
+        """
+        Converts a selection along one dimension of a dataset into an array of indices
+        :param select: None (everything), slice or array with indices
+        :param length: length of the dimension
+        :return: array with indices
+        """
+        if select is None:
+            return np.arange(0, length)
+        if isinstance(select, slice):
+            return np.arange(0, length)[select]
+        return np.arange(0, length)[np.asarray(select)]
+
+    @staticmethod
+    def hdf5_copy_chunks(handle, handle_out, dset_name, first, n_traces):
+        """
+        Copies consecutive traces of a chunked dataset without decoding the chunks, i.e. the compressed chunks are
+        written as they are stored. The new dataset uses the same chunk shape and filters.
+        :param handle: handle that contains the original dataset
+        :param handle_out: handle to which the dataset shall be copied
+        :param dset_name: name of the dataset
+        :param first: index of the first trace, needs to be a multiple of the traces per chunk
+        :param n_traces: number of traces that are copied, at least the traces per chunk
+        :return:
+        """
+        shape = (n_traces,) + handle.shape[1:]
+        # same datatype and creation properties (chunks, filters, fill value)
+        h5py.h5d.create(handle_out.id, dset_name.encode(), handle.id.get_type(), h5py.h5s.create_simple(shape), dcpl=handle.id.get_create_plist())
+        dset_out = handle_out[dset_name]
+        for idx in range(0, handle.id.get_num_chunks()):
+            chunk = handle.id.get_chunk_info(idx)
+            # only allocated chunks within the selected traces
+            if first <= chunk.chunk_offset[0] < first + n_traces:
+                filter_mask, data = handle.id.read_direct_chunk(chunk.chunk_offset)
+                dset_out.id.write_direct_chunk((chunk.chunk_offset[0] - first,) + tuple(chunk.chunk_offset[1:]), data, filter_mask)
 
     @staticmethod
-    def create_filecopy(handle, handle_out, trace_select=None, repetition_select=None, conversion=[[None, None]]):
+    def create_filecopy(handle, handle_out, trace_select=None, repetition_select=None, conversion=[[None, None]], sample_select=None, sample_datasets=["samples"], block_size=None, create_empty=False):
         """
         Create a copy of an HDF5 file containing
         :param handle: handle of the original HDF5 file
         :param handle_out: handle of the HDF5 file to which shall be copied
-        :param trace_select: array with indices of that shall be copied
-        :param repetition_select: array with indices of that shall be copied
+        :param trace_select: array with indices or slice of traces that shall be copied
+        :param repetition_select: array with indices or slice of repetitions that shall be copied
         :param conversion: list with [<datasetname>,<desired data type>] lists
+        :param sample_select: array with indices or slice (window) of samples that shall be copied from the datasets in
+        'sample_datasets' (default: all samples)
+        :param sample_datasets: names of the datasets with samples as second dimension
+        :param block_size: number of traces that are copied at once (c.f. copy_dataset)
+        :param create_empty: create the datasets in 'conversion' empty (with the selected shape and the desired data
+        type) instead of copying and converting the data, e.g. if they are filled by a subsequent processing step
         :return:
         """
 
@@ -607,8 +708,14 @@ class HDF5utils:
                     # if no datatype is given, the created dataset has the same datatype as the original one.
                     chosen_dtype = None
 
-                # copy data set and attributes
-                HDF5utils.copy_dataset(handle[keys][dsets], handle_out[keys], dset_name=dsets, trace_select=trace_select, dtype=chosen_dtype, repetititon_select=repetition_select, copy_doc=is_doc_group)
+                if create_empty and dsets in conversion_datasets and not is_doc_group:
+                    # create the dataset without data
+                    dset = handle[keys][dsets]
+                    shape = (len(HDF5utils.hdf5_get_selection(trace_select, dset.shape[0])), len(HDF5utils.hdf5_get_selection(sample_select if dsets in sample_datasets else None, dset.shape[1])), len(HDF5utils.hdf5_get_selection(repetition_select, dset.shape[2])))
+                    handle_out[keys].create_dataset(dsets, shape=shape, dtype=dset.dtype if chosen_dtype is None else chosen_dtype)
+                else:
+                    # copy data set
+                    HDF5utils.copy_dataset(handle[keys][dsets], handle_out[keys], dset_name=dsets, trace_select=trace_select, dtype=chosen_dtype, repetititon_select=repetition_select, copy_doc=is_doc_group, sample_select=sample_select if dsets in sample_datasets else None, block_size=block_size)
                 # copy attributes
                 HDF5utils.copy_attributes(handle[keys][dsets], handle_out[keys][dsets])
 
@@ -715,6 +822,390 @@ class HDF5utils:
         return samples, traces, repetitions
 
 
+class HDF5writer:
+    """
+    Buffered writer for the datasets of a measurement group (c.f. HDF5utils.hdf5_add_group). Instead of writing every
+    trace with a separate h5py call (c.f. HDF5utils.hdf5_add_data), the dataset handles are kept open and the data of
+    'batch_size' consecutive traces is collected in a preallocated array that is written as one contiguous block.
+    Data is written to the file upon flush() or as soon as a trace outside of the current batch is added.
+    """
+
+    def __init__(self, h5filehandle, group=0, batch_size=1000):
+        """
+        :param h5filehandle: hdf5 filehandle
+        :param group: acquisition group (more relevant if table is used)
+        :param batch_size: number of traces that are collected before writing
+        """
+        self.h5group = h5filehandle["%.4i" % group]
+        self.batch_size = max(1, int(batch_size))
+        # per dataset: [dataset handle, buffer, index of the first trace of the batch, range of buffered traces]
+        self.buffers = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def get_buffer(self, dataset_name):
+        """
+        Returns the buffer of a dataset, the buffer is allocated upon first access
+        :param dataset_name: name of the dataset
+        :return: list with dataset handle, buffer, index of the first trace of the batch and range of buffered traces
+        """
+        if dataset_name not in self.buffers:
+            dset = self.h5group[dataset_name]
+            buffer = np.zeros((min(self.batch_size, dset.shape[0]),) + dset.shape[1:], dtype=dset.dtype)
+            self.buffers[dataset_name] = [dset, buffer, 0, [0, 0]]
+        return self.buffers[dataset_name]
+
+    def add_data(self, dataset_name, data, trace_number, repetition_number=0):
+        """
+        Adds the data of a single trace to the buffer of the dataset (c.f. HDF5utils.hdf5_add_data)
+        :param dataset_name: name of the dataset to which data shall be added
+        :param data: data
+        :param trace_number: index of the trace
+        :param repetition_number: index of the repeated measurement with same input data
+        :return:
+        """
+        if not isinstance(data, list):
+            if len(data.shape) > 1:
+                if data.shape[1] == 1:
+                    data = data[:, 0]
+
+        entry = self.get_buffer(dataset_name)
+        buffer, first, buffered = entry[1], entry[2], entry[3]
+        if trace_number < first or trace_number >= first + buffer.shape[0]:
+            # trace is not part of the current batch: write the buffer and start a new batch that is aligned with the
+            # chunks of the dataset
+            self.flush(dataset_name)
+            first = trace_number - trace_number % buffer.shape[0]
+            entry[2] = first
+
+        idx = trace_number - first
+        buffer[idx, :, repetition_number] = data
+        if buffered[0] == buffered[1]:
+            buffered[0], buffered[1] = idx, idx + 1
+        else:
+            buffered[0], buffered[1] = min(buffered[0], idx), max(buffered[1], idx + 1)
+
+    def add_data_multitrace(self, dataset_name, data, trace_indices=[0, None], repetition_indices=[0, None]):
+        """
+        Adds data from multiple traces (c.f. HDF5utils.hdf5_add_data_multitrace). As the data already forms a block, it
+        is written directly after the buffer of the dataset has been flushed.
+        :param dataset_name: name of the dataset to which data shall be added
+        :param data: data
+        :param trace_indices: first and last index in the dataset, where data shall be added
+        :param repetition_indices: first and last index in the dataset, where data shall be added
+        :return:
+        """
+        if not isinstance(data, list):
+            if len(data.shape) > 1:
+                if data.shape[1] == 1:
+                    data = data[:, 0]
+
+        self.flush(dataset_name)
+        dset = self.get_buffer(dataset_name)[0]
+        dset[trace_indices[0] : trace_indices[1], :, repetition_indices[0] : repetition_indices[1]] = data
+
+    def flush(self, dataset_name=None):
+        """
+        Writes the buffered traces to the file
+        :param dataset_name: name of the dataset that is flushed (default: None, i.e. all datasets)
+        :return:
+        """
+        if dataset_name is None:
+            dataset_names = list(self.buffers.keys())
+        elif dataset_name in self.buffers:
+            dataset_names = [dataset_name]
+        else:
+            dataset_names = []
+
+        for name in dataset_names:
+            dset, buffer, first, buffered = self.buffers[name]
+            if buffered[1] > buffered[0]:
+                dset[first + buffered[0] : first + buffered[1]] = buffer[buffered[0] : buffered[1]]
+                # reset the buffer, as not all entries are necessarily overwritten by the next batch
+                buffer[buffered[0] : buffered[1]] = 0
+                buffered[0], buffered[1] = 0, 0
+
+
+class TraceStore:
+    """
+    Read access to a dataset of a measurement group with dim [traces, samples, repetitions] (c.f.
+    HDF5utils.hdf5_add_group). Contiguous and uncompressed datasets are memory mapped, such that reads are served by the
+    page cache of the operating system. For chunked (and possibly compressed) datasets, every chunk is read and decoded
+    once and kept in a least recently used (LRU) cache with a limited size in bytes, i.e. small reads of neighbouring
+    traces or samples do not access the file again. The object can be indexed like the dataset handle.
+    """
+
+    def __init__(self, dset, cache_bytes=2**28, memmap=True):
+        """
+        :param dset: h5py dataset handle
+        :param cache_bytes: maximum size of the decoded chunks that are cached (default: 256 MiB)
+        :param memmap: map contiguous and uncompressed datasets into memory (default: True)
+        """
+        self.dset = dset
+        self.shape = dset.shape
+        self.dtype = dset.dtype
+        self.ndim = len(dset.shape)
+        self.attrs = dset.attrs
+        self.name = dset.name
+        self.cache_bytes = int(cache_bytes)
+        # decoded chunks ordered from least to most recently used
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.mmap = self.get_memmap() if memmap else None
+        # contiguous datasets that cannot be mapped are cached trace by trace
+        self.chunks = dset.chunks if dset.chunks is not None else (1,) + tuple(dset.shape[1:])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key, squeeze = self.normalize_key(key)
+        if self.mmap is not None:
+            # slices are views of the memory map, lists of indices select along their dimension (as for h5py)
+            out = self.mmap[tuple(k if isinstance(k, slice) else slice(None) for k in key)]
+            for dim, k in enumerate(key):
+                if not isinstance(k, slice):
+                    out = np.take(out, k, axis=dim)
+        else:
+            out = self.read_chunked(key)
+        return out.squeeze(axis=squeeze) if squeeze else out
+
+    def normalize_key(self, key):
+        """
+        Converts an index into one entry per dimension, which is either a slice or an array of indices
+        :param key: index as used for h5py datasets (integers, slices, lists of indices or Ellipsis)
+        :return: tuple with the index per dimension, tuple with the dimensions that are indexed by integers
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            idx = key.index(Ellipsis)
+            key = key[:idx] + (slice(None),) * (self.ndim - len(key) + 1) + key[idx + 1 :]
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        normalized = []
+        squeeze = []
+        for dim, (k, n) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                normalized.append(k)
+            elif np.ndim(k) == 0:
+                normalized.append(np.arange(n)[[k]])
+                squeeze.append(dim)
+            else:
+                normalized.append(np.arange(n)[np.asarray(k)])
+        return tuple(normalized), tuple(squeeze)
+
+    def get_memmap(self):
+        """
+        Maps the dataset into memory if it is stored in a single contiguous block of the file without filters. Files
+        that are open for writing are not mapped, since the map would bypass the data cached by HDF5.
+        :return: numpy memmap or None if the dataset cannot be mapped
+        """
+        dset = self.dset
+        if dset.chunks is not None or dset.external is not None or dset.is_virtual or self.dtype.kind not in "biufc":
+            return None
+        if dset.file.driver not in ("sec2", "stdio") or dset.file.mode != "r":
+            return None
+        offset = dset.id.get_offset()
+        if offset is None or 0 in self.shape:
+            # no storage allocated, i.e. nothing has been written yet
+            return None
+        try:
+            return np.memmap(dset.file.filename, mode="r", dtype=self.dtype, offset=offset, shape=self.shape)
+        except (OSError, ValueError) as e:
+            _logger.debug("Memory mapping of %s failed: %s" % (self.name, e))
+            return None
+
+    def get_chunk(self, origin):
+        """
+        Returns the decoded chunk starting at the given index, the chunk is read from the file if it is not cached
+        :param origin: tuple with the first index of the chunk in every dimension
+        :return: array with the data of the chunk
+        """
+        chunk = self.cache.get(origin)
+        if chunk is not None:
+            self.cache.move_to_end(origin)
+            return chunk
+
+        chunk = self.dset[tuple(slice(o, min(o + c, n)) for o, c, n in zip(origin, self.chunks, self.shape))]
+        self.cache[origin] = chunk
+        self.cached_bytes += chunk.nbytes
+        # evict the least recently used chunks, the current chunk is kept even if it exceeds the limit on its own
+        while self.cached_bytes > self.cache_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+        return chunk
+
+    def read_chunked(self, key):
+        """
+        Reads a selection from the cached chunks
+        :param key: slice or array of indices per dimension (c.f. normalize_key)
+        :return: array with the selected data
+        """
+        indices = [np.arange(n)[k] if isinstance(k, slice) else k for k, n in zip(key, self.shape)]
+
+        out = np.empty(tuple(len(i) for i in indices), dtype=self.dtype)
+        # positions of the selection within each chunk, per dimension
+        blocks = []
+        for index, chunk in zip(indices, self.chunks):
+            chunk_ids = index // chunk
+            blocks.append([(c * chunk, np.flatnonzero(chunk_ids == c)) for c in np.unique(chunk_ids)])
+
+        for block in itertools.product(*blocks):
+            origin = tuple(o for o, _ in block)
+            positions = tuple(p for _, p in block)
+            local = tuple(index[p] - o for index, (o, p) in zip(indices, block))
+            out[np.ix_(*positions)] = self.get_chunk(origin)[np.ix_(*local)]
+        return out
+
+    def iter_blocks(self, traces=None, samples=slice(None), repetitions=slice(None), block_traces=None):
+        """
+        Iterates over the selected traces in blocks that are aligned with the chunks of the dataset. Every block is read
+        directly from the file (or the memory map) without passing the chunk cache.
+        :param traces: sorted indices of the selected traces (default: None, i.e. all traces)
+        :param samples: slice or indices of the selected samples
+        :param repetitions: slice or indices of the selected repetitions (ignored for datasets with less than three
+        dimensions)
+        :param block_traces: number of traces per block, rounded up to a multiple of the traces per chunk (default:
+        None, i.e. as many traces as fit into the size of the chunk cache)
+        :return: generator of tuples with the slice of the block within the selected traces and the data of the block
+        """
+        if traces is None:
+            traces = np.arange(self.shape[0])
+        traces = np.asarray(traces)
+        if block_traces is None:
+            trace_bytes = max(1, int(np.prod(self.shape[1:], dtype=np.int64)) * self.dtype.itemsize)
+            block_traces = max(1, self.cache_bytes // trace_bytes)
+        block_traces = -(-int(block_traces) // self.chunks[0]) * self.chunks[0]
+        rest = (samples, repetitions)[: self.ndim - 1]
+
+        position = 0
+        while position < len(traces):
+            first = traces[position] - traces[position] % block_traces
+            stop = np.searchsorted(traces, first + block_traces)
+            block = slice(first, min(first + block_traces, self.shape[0]))
+            # slices are applied while reading (i.e. views of the memory map), lists of indices afterwards
+            data = (self.mmap if self.mmap is not None else self.dset)[(block,) + tuple(r if isinstance(r, slice) else slice(None) for r in rest)]
+            data = data[traces[position:stop] - first]
+            for dim, r in enumerate(rest, start=1):
+                if not isinstance(r, slice):
+                    data = data[(slice(None),) * dim + (np.asarray(r),)]
+            yield slice(position, stop), data
+            position = stop
+
+
+class InputSchedule:
+    """
+    Precomputed inputs of a measurement campaign. Inputs, masks and class labels of all traces are generated up front
+    from a seeded generator as arrays with one row per trace. The arrays are written in bulk to the datasets of the same
+    name in the measurement group (c.f. HDF5utils.hdf5_add_group), such that the target control functions only index
+    into the schedule and the measurement loop does not need to store them trace by trace.
+    """
+
+    def __init__(self, N_traces, seed=None):
+        """
+        :param N_traces: number of traces
+        :param seed: seed of the generator (default: None, i.e. fresh entropy). The seed that is used is stored with
+               the schedule, i.e. the schedule can be reproduced.
+        """
+        self.N_traces = int(N_traces)
+        self.seed = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed)
+        # name: array (traces x dim)
+        self.data = OrderedDict()
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def add(self, name, data):
+        """
+        Adds an array with one row per trace to the schedule
+        :param name: name of the entry, data is written to the dataset with this name
+        :param data: array (traces) or (traces x dim)
+        :return: data as (traces x dim) array
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        if data.shape[0] != self.N_traces:
+            raise ValueError("Entry %s of the input schedule has %i instead of %i traces." % (name, data.shape[0], self.N_traces))
+        self.data[name] = data
+        return data
+
+    def integers(self, low, high, dim=1, dtype=np.uint32, endpoint=False):
+        """
+        Uniformly distributed integers for all traces (c.f. numpy.random.Generator.integers)
+        :param low: lowest value
+        :param high: highest value (exclusive unless endpoint is set)
+        :param dim: number of values per trace
+        :param dtype: datatype
+        :param endpoint: include high
+        :return: array (traces x dim)
+        """
+        return self.rng.integers(low, high, (self.N_traces, dim), dtype=dtype, endpoint=endpoint)
+
+    def class_labels(self, classes=2, first=None):
+        """
+        Random class of every trace, e.g. for fixed-vs-random measurements (0: fixed, otherwise: random, as expected by
+        the t-test)
+        :param classes: number of classes
+        :param first: class of the first trace (default: None, i.e. random)
+        :return: array (traces) with the class labels
+        """
+        labels = self.rng.integers(0, classes, self.N_traces, dtype=np.uint8)
+        if first is not None and self.N_traces > 0:
+            labels[0] = first
+        return labels
+
+    @staticmethod
+    def select(labels, choices):
+        """
+        Selects the data of every trace according to its class label
+        :param labels: array (traces) or (traces x 1) with the class labels
+        :param choices: list with one array (traces x dim) or scalar per class
+        :return: array (traces x dim)
+        """
+        choices = [np.asarray(choice) for choice in choices]
+        choices = [choice[:, np.newaxis] if choice.ndim == 1 else choice for choice in choices]
+        return np.choose(np.asarray(labels).reshape((-1, 1)), choices)
+
+    def inputs(self, trace, names):
+        """
+        Data of a single trace, e.g. to be returned by load_data
+        :param trace: index of the trace
+        :param names: list with the names of the entries
+        :return: list with one array per entry
+        """
+        # dummy measurements may exceed the number of traces
+        trace = trace % self.N_traces
+        return [self.data[name][trace] for name in names]
+
+    def write(self, h5group):
+        """
+        Writes all entries for which a dataset exists in the measurement group
+        :param h5group: handle of the measurement group
+        :return: list with the names of the written datasets
+        """
+        written = list()
+        for name, data in self.data.items():
+            if name not in h5group:
+                continue
+            dset = h5group[name]
+            # the same input is used for all repetitions
+            dset[...] = np.broadcast_to(data.reshape(data.shape + (1,)), dset.shape)
+            written.append(name)
+        h5group.attrs["input schedule: seed"] = str(self.seed.entropy)
+        h5group.attrs["input schedule: datasets"] = written
+        return written
+
+
 class MISCutils:
     @staticmethod
     def sendmail(sender, receiver, subject, message):
@@ -782,16 +1273,18 @@ class MISCutils:
 
 class FrequencyUtils:
     @staticmethod
-    def single_sided_fft(x, fs=1, NFFT=None, conv_dec=True, windowing="Hanning", FFT_dim=0):
+    def single_sided_fft(x, fs=1, NFFT=None, conv_dec=True, windowing="Hanning", FFT_dim=0, workers=None):
         """
         Calculates the single-sided FFT for a real valued signal and returns the frequency domain representation as well as
-        the corresponding frequency values of the FFT bins
+        the corresponding frequency values of the FFT bins. All other dimensions of x are transformed in a single call,
+        i.e. a block of traces and repetitions can be passed at once.
         :param x: array with signal, FFT is calculated along dim=1 [dim=0 for legacy]
         :param fs: sampling frequency [Hz]; default: 1
         :param NFFT: number of FFT bins (default: maximum determined by length of measurement)
         :param conv_dec: flag to convert spectrum to decibel straight away
         :param windowing: kind of window that is applied to avoid aliasing issues
         :param FFT_dim: dimension along which the FFT is calculated (default: 0 = time),
+        :param workers: number of threads used by scipy.fft (default: None, i.e. a single thread; -1: all CPUs)
         :return: Y: frequency domain representation of x
         :return freqs: frequency values of the FFT bins
         :return NFFT: returns length of the FFT ()
@@ -805,26 +1298,12 @@ class FrequencyUtils:
             # nextpow_2 = np.ceil(np.log2(x.shape[FFT_dim]))
             # NFFT = int(np.power(2, nextpow_2))
 
-        if windowing == "Hanning":
-            window_array = np.hanning(x.shape[FFT_dim])
-        elif windowing == "Hamming":
-            window_array = np.hamming(x.shape[FFT_dim])
-        elif windowing == "Flattop":
-            window_array = np.ones((x.shape[FFT_dim], 1))
-            window_array[:, 0] = signal.windows.flattop(x.shape[FFT_dim])
-        else:
-            window_array = np.ones((x.shape[FFT_dim], 1))
+        # broadcast the window along all dimensions except the FFT dimension
+        window = FrequencyUtils.get_window(x.shape[FFT_dim], windowing)
+        x = x * window.reshape([-1 if dim == FFT_dim else 1 for dim in range(len(x.shape))])
 
-        if len(x.shape) > 2:
-            window = np.reshape(np.repeat(window_array, x.shape[(FFT_dim + 1) % 2] * x.shape[2], axis=0), [-1, x.shape[(FFT_dim + 1) % 2], x.shape[2]])
-        else:
-            window = np.reshape(np.repeat(window_array, x.shape[(FFT_dim + 1) % 2], axis=0), [-1, x.shape[(FFT_dim + 1) % 2]])
-        if FFT_dim == 1:
-            window = np.swapaxes(window, axis1=0, axis2=1)
-        x = x * window
-
-        # calculate FFT
-        Y = np.fft.rfft(x, NFFT, axis=FFT_dim)
+        # calculate FFT (scipy keeps the plans of recently used lengths)
+        Y = sp_fft.rfft(x, NFFT, axis=FFT_dim, workers=workers)
 
         if conv_dec:
             # convert to decibel (convert 0 input to Floating-point relative accuracy)
@@ -835,6 +1314,27 @@ class FrequencyUtils:
 
         return Y, freqs, NFFT
 
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def get_window(length, windowing="Hanning"):
+        """
+        Returns the window applied before the FFT, windows are cached per length and kind
+        :param length: number of samples
+        :param windowing: kind of window ('Hanning', 'Hamming', 'Flattop', otherwise rectangular)
+        :return: read-only array with the window
+        """
+        if windowing == "Hanning":
+            window = np.hanning(length)
+        elif windowing == "Hamming":
+            window = np.hamming(length)
+        elif windowing == "Flattop":
+            window = signal.windows.flattop(length)
+        else:
+            window = np.ones(length)
+        # the cached window is shared between calls
+        window.setflags(write=False)
+        return window
+
     @staticmethod
     def get_NFFT(data_length):
         """
@@ -9,6 +9,9 @@ _logger = logging.getLogger(__name__)
 
 class Keysight_DSOS_254A:
     instr = None
+    # cached waveform preamble (c.f. get_waveform_preamble), reset whenever the acquisition setup changes
+    preamble = None
+    acquisition_setup = None
 
     def __init__(self, lan_address="TCPIP::WINDOWS-UH2SI2U.sec.ei.tum.de::inst0::INSTR", reset=True):
         """
@@ -251,6 +254,95 @@ class Keysight_DSOS_254A:
 
         return data, n_samples, x_origin, x_increment, y_origin, y_increment
 
+    def get_waveform_preamble(self, refresh=False):
+        """
+        Returns the parameters needed to retrieve and convert the waveform data. The values are queried once and cached
+        until the acquisition setup changes (or refresh is set).
+        :param refresh: flag to query the values again
+        :return: dictionary with waveform format, streaming, number of samples, x/y origin and increment
+        """
+        if self.preamble is None or refresh:
+            preamble = dict()
+            preamble["format"] = self.send_query(":WAVeform:FORMat?", mute=True)
+            preamble["streaming"] = self.send_query(":WAVeform:STReaming?", mute=True) == "1"
+            # These value are needed to convert the int values from BYTE and WORD formats into voltage values
+            preamble["x_origin"] = float(self.send_query(":WAVeform:XORigin?", mute=True))
+            preamble["x_increment"] = float(self.send_query(":WAVeform:XINCrement?", mute=True))
+            preamble["y_origin"] = float(self.send_query(":WAVeform:YORigin?", mute=True))
+            preamble["y_increment"] = float(self.send_query(":WAVeform:YINCrement?", mute=True))
+            # c.f. send_data_query why :ACQuire:POINts:ANALog? is used
+            preamble["n_samples"] = int(self.send_query(":ACQuire:POINts:ANALog?", mute=True))
+
+            # set byte order to least significant byte first (faster data transfer, c.f. programmers guide p.1385)
+            if self.instr.ask(":WAVeform:BYTeorder?") != "LSBF":
+                self.instr.write(":WAVeform:BYTeorder LSBFirst")
+            # configure the DATA query for downloading all segments at once (c.f. send_data_query_segmented)
+            preamble["segmented_all"] = False
+            self.preamble = preamble
+        return self.preamble
+
+    def send_data_query_segmented(self, num_segments, max_block_size=10e6):
+        """
+        Retrieves the data of all segments of a segmented acquisition at once. In contrast to send_data_query, the
+        segments are not placed on the screen one after another, but the :WAVeform:SEGMented:ALL mode is used, where a
+        single DATA query returns the data of all segments. The waveform preamble is cached (c.f.
+        get_waveform_preamble) and the binary block is converted by a single np.frombuffer.
+        :param num_segments: number of segments of the acquisition
+        :param max_block_size: maximum number of samples per segment that are retrieved per DATA query
+        :return: data: numpy array with the data and dimensions [samples x segments]
+        :return: n_samples: number of samples
+        :return: x_origin: value of the x (time) origin
+        :return: x_increment: increment between two points in x-direction
+        :return: y_origin: value of the x (voltage) origin
+        :return: y_increment: increment between two points in y-direction
+        """
+        preamble = self.get_waveform_preamble()
+        waveform_format = preamble["format"]
+        n_samples = preamble["n_samples"]
+
+        if not preamble["segmented_all"]:
+            # The <start> and <size> parameters of the DATA query represent start and size of each segment
+            self.send_command(":WAVeform:SEGMented:ALL ON")
+            preamble["segmented_all"] = True
+
+        if waveform_format == "BYTE":
+            dtype = np.dtype("<i1")
+        elif waveform_format == "WORD":
+            dtype = np.dtype("<i2")
+        else:
+            dtype = None
+
+        block_size = int(min(n_samples, max_block_size))
+        num_blocks = int(max(1, np.ceil(n_samples / block_size)))
+
+        data = None
+        for block in range(0, num_blocks):
+            start_point = block * block_size + 1
+            end_point = min((block + 1) * block_size, n_samples)
+            read_points = end_point - start_point + 1
+
+            self.instr.write(":WAV:DATA? {},{}".format(start_point, read_points))
+            data_raw = self.instr.read_raw(-1)
+
+            if dtype is None:
+                # ASCII format
+                block_data = np.fromstring(data_raw[:-1], sep=",")
+            else:
+                # Streaming Off: #|N|L(N bytes)|B_0|...|END, Streaming On: #|0|B_0|...|END (c.f. send_data_query)
+                offset = 2 if data_raw[1:2] == b"0" else 2 + int(chr(data_raw[1]))
+                block_data = np.frombuffer(data_raw, dtype=dtype, count=read_points * num_segments, offset=offset)
+
+            # the data of the segments is returned one after another
+            block_data = block_data.reshape((num_segments, read_points)).T
+            if num_blocks == 1:
+                data = block_data
+            else:
+                if data is None:
+                    data = np.zeros((n_samples, num_segments), dtype=block_data.dtype)
+                data[start_point - 1 : end_point, :] = block_data
+
+        return data, n_samples, preamble["x_origin"], preamble["x_increment"], preamble["y_origin"], preamble["y_increment"]
+
     def check_instrument_errors(self, command):
         """
         checks for errors in the communication.
@@ -290,6 +382,8 @@ class Keysight_DSOS_254A:
         :param probeAttenuation:
         :return:
         """
+        # the waveform preamble changes
+        self.preamble = None
 
         self.send_command(":CHANnel{}:PROBe {},RAT".format(channel, probeAttenuation))
         self.send_command_and_query(":CHANnel{}:INPut {}".format(channel, coupling))
@@ -315,6 +409,8 @@ class Keysight_DSOS_254A:
         :param preTriggerRelative: percentage of the sampling duration that is used for pretrigger sampling
         :return:
         """
+        # the waveform preamble changes
+        self.preamble = None
 
         if preTriggerSamples is not None:
             # Set the range that is displayed on the screen as sum of sampling duration and pretrigger samples
@@ -340,6 +436,8 @@ class Keysight_DSOS_254A:
         :param sampling_rate:
         :return:
         """
+        # the waveform preamble changes
+        self.preamble = None
         # set sampling rate
         self.send_command_and_query(":ACQuire:SRATe:ANALog {}".format(sampling_rate))
         # set number of points for acquisition to auto mode
@@ -356,6 +454,8 @@ class Keysight_DSOS_254A:
         :param enabled TODO: figure out whether anything else than "True" makes sense for this parameter
         :return:
         """
+        # the waveform preamble changes
+        self.preamble = None
         if direction == "Rising":
             self.send_command_and_query(":TRIGger:MODE EDGE")
             self.send_command_and_query(":TRIGger:EDGE:SLOPe POSitive")
@@ -446,6 +546,8 @@ class Keysight_DSOS_254A:
         :return: max_num_points: returns the maximum number of data points that can be transferred with the selected
                  combination of waveform format and streaming mode.
         """
+        # the waveform preamble changes
+        self.preamble = None
 
         """
         NOTE from Programmers guide (p.1155): Turn headers off when returning values to numeric variables. Headers are
@@ -498,6 +600,11 @@ class Keysight_DSOS_254A:
         :return:
         """
 
+        if self.acquisition_setup != (interpolation, acquisition_mode):
+            # the waveform preamble changes (a different number of segments does not affect it)
+            self.preamble = None
+            self.acquisition_setup = (interpolation, acquisition_mode)
+
         # Adjust sin(x)/x interpolation
         self.send_command_and_query(":ACQuire:INTerpolate {}".format(interpolation))
 
@@ -49,9 +49,20 @@ class PicoSDK6000:
         self.sampleInterval = None
         self.nSamples = None
         self.currentBufferIndex = 0
+        # persistent driver buffers: one or two sets (double buffering) of [max, min] buffers per used channel
         self.buffer = None
-        self.cOverflow = None
+        self.bufferViews = None
+        self.bufferConfig = None
+        self.activeBuffer = 0
+        self.doubleBuffer = False
+        self.dataRead = False
+        self.cOverflow = ctypes.c_int16()
         self.usedChannels = []
+        # rapid block mode (segmented memory)
+        self.nCaptures = 1
+        self.bulkBuffer = None
+        self.bulkOverflow = None
+        self.bulkRead = False
 
     def getTimeBaseNum(self, sampleTimeS):
         """Return sample time in seconds to timebase as int for API calls."""
@@ -282,8 +293,9 @@ class PicoSDK6000:
 
         """
         """
-        self.buffer = None
         self.currentBufferIndex = 0
+        self.dataRead = False
+        self.bulkRead = False
         # Calculate the number of pretrigger samples from the sampling rate and time given
         # At most the number of samples can be used!
         nSamples_pretrig = min(self.nSamples, int(round(pretrig * self.sampleRate)))
@@ -313,6 +325,53 @@ class PicoSDK6000:
         assert_pico_ok(status)
         return np.uint8(ready.value)
 
+    def setDoubleBuffer(self, enabled=True):
+        """
+        Enable/disable double buffering for getDataRaw. The driver buffers alternate between two sets for consecutive
+        acquisitions, i.e. the data returned for an acquisition remains valid while the next acquisition is read.
+        :param enabled: flag
+        :return:
+        """
+        self.doubleBuffer = bool(enabled)
+        # buffers are reallocated upon the next call of getDataRaw
+        self.bufferConfig = None
+
+    def allocateBuffers(self, numSamples, downSampleMode=0):
+        """
+        Allocate the driver buffers for all used channels and register them. Buffers are only allocated and registered
+        once per sampling configuration and exposed as numpy arrays (np.frombuffer), i.e. no copies are made.
+        :param numSamples: number of samples per buffer
+        :param downSampleMode: downsampling mode of the driver
+        :return:
+        """
+        bufferConfig = (numSamples, downSampleMode, tuple(self.usedChannels), self.doubleBuffer)
+        if self.bufferConfig == bufferConfig:
+            return
+
+        self.buffer = []
+        self.bufferViews = []
+        for _ in range(0, 2 if self.doubleBuffer else 1):
+            buffers = [[(ctypes.c_int16 * numSamples)(), (ctypes.c_int16 * numSamples)()] for _ in self.usedChannels]
+            self.buffer.append(buffers)
+            self.bufferViews.append([np.frombuffer(bufferMax, dtype=np.int16) for bufferMax, _ in buffers])
+        self.activeBuffer = 0
+        self.registerBuffers(numSamples, downSampleMode)
+        self.bufferConfig = bufferConfig
+        # buffers of the rapid block mode have to be registered again
+        self.bulkBuffer = None
+
+    def registerBuffers(self, numSamples, downSampleMode=0):
+        """
+        Register the active buffer set with the driver
+        :param numSamples: number of samples per buffer
+        :param downSampleMode: downsampling mode of the driver
+        :return:
+        """
+        for i in range(0, len(self.usedChannels)):
+            bufferMax, bufferMin = self.buffer[self.activeBuffer][i]
+            status = ps.ps6000SetDataBuffers(self.chandle, self.usedChannels[i], ctypes.byref(bufferMax), ctypes.byref(bufferMin), numSamples, downSampleMode)
+            assert_pico_ok(status)
+
     def getDataRaw(self, channel, numSamples, startIndex=0, downSampleRatio=1, downSampleMode=0, segmentIndex=0):
         """Return the data as an array of voltage values.
 
@@ -326,28 +385,26 @@ class PicoSDK6000:
         if returnOverflow is False. This allows you to detect overflows at
         higher layers w/o complicated return trees. You cannot however read the
         'good' data, you only get the exception information then.
+
+        NOTE: dataV is a view on the driver buffer, i.e. it is overwritten by the
+        next acquisition (by the next but one if double buffering is enabled,
+        c.f. setDoubleBuffer). Copy the data if it is needed for longer.
         """
 
-        cNumSamples = ctypes.c_int32(numSamples)
+        cNumSamples = ctypes.c_uint32(numSamples)
 
-        # allocate buffers for data if not allocated and read data from picoscope
-        if self.buffer is None:
-            # allocate buffers
-            self.buffer = []
-            self.cOverflow = ctypes.c_int16()
-            for i in range(0, len(self.usedChannels)):
-                self.buffer.append((ctypes.c_int16 * numSamples)())
-                self.buffer.append((ctypes.c_int16 * numSamples)())
-                status = ps.ps6000SetDataBuffers(self.chandle, self.usedChannels[i], ctypes.byref(self.buffer[i * 2]), ctypes.byref(self.buffer[i * 2 + 1]), numSamples, downSampleMode)
-                assert_pico_ok(status)
-            # read data from picoscope (can only be called once and data of all channels is read)
+        # read data from picoscope once per acquisition (the data of all channels is read)
+        if not self.dataRead:
+            self.allocateBuffers(numSamples, downSampleMode)
+            if self.doubleBuffer:
+                # fill the other buffer set, the data of the previous acquisition remains valid
+                self.activeBuffer = (self.activeBuffer + 1) % 2
+                self.registerBuffers(numSamples, downSampleMode)
             status = ps.ps6000GetValues(self.chandle, startIndex, ctypes.byref(cNumSamples), downSampleRatio, downSampleMode, segmentIndex, ctypes.byref(self.cOverflow))
             assert_pico_ok(status)
-            data = np.array(self.buffer[0], np.int16)
-        else:
-            # if buffers are allocated return data stored in buffers
-            if len(self.usedChannels) > 1:
-                data = np.array(self.buffer[self.currentBufferIndex * 2], np.int16)
+            self.dataRead = True
+
+        data = self.bufferViews[self.activeBuffer][self.usedChannels.index(channel)][: cNumSamples.value]
 
         overflow = self.cOverflow.value
 
@@ -356,6 +413,74 @@ class PicoSDK6000:
         self.currentBufferIndex += 1
         return data, cNumSamples.value, overflow
 
+    def setRapidBlock(self, nCaptures, downSampleMode=0):
+        """
+        Configure the rapid block mode, i.e. the memory is divided into 'nCaptures' segments that are filled by
+        consecutive triggers after a single call of runBlock. For each enabled channel, a (nCaptures, nSamples) int16
+        array is allocated and its rows are registered as driver buffers, such that getDataRawBulk transfers all
+        waveforms at once. Buffers are only reallocated if the number of captures or samples changes.
+        Must have already called setSamplingInterval and setChannel for proper setup.
+        :param nCaptures: number of captures (segments), 1 disables the rapid block mode
+        :param downSampleMode: downsampling mode of the driver
+        :return: maximum number of samples per segment
+        """
+        nCaptures = max(1, int(nCaptures))
+
+        # segments cannot be changed during an acquisition
+        status = ps.ps6000Stop(self.chandle)
+        assert_pico_ok(status)
+
+        cMaxSamples = ctypes.c_uint32()
+        status = ps.ps6000MemorySegments(self.chandle, nCaptures, ctypes.byref(cMaxSamples))
+        assert_pico_ok(status)
+        if self.nSamples > cMaxSamples.value:
+            raise ValueError("%i samples do not fit into a segment, at most %i samples are possible for %i captures." % (self.nSamples, cMaxSamples.value, nCaptures))
+
+        status = ps.ps6000SetNoOfCaptures(self.chandle, nCaptures)
+        assert_pico_ok(status)
+        self.nCaptures = nCaptures
+
+        if nCaptures == 1:
+            # single block mode: buffers are handled by getDataRaw
+            self.bulkBuffer = None
+            self.bufferConfig = None
+            return cMaxSamples.value
+
+        if self.bulkBuffer is None or self.bulkBuffer[0].shape != (nCaptures, self.nSamples) or len(self.bulkBuffer) != len(self.usedChannels):
+            self.bulkBuffer = [np.zeros((nCaptures, self.nSamples), dtype=np.int16) for _ in self.usedChannels]
+            self.bulkOverflow = np.zeros(nCaptures, dtype=np.int16)
+            for i in range(0, len(self.usedChannels)):
+                for segment in range(0, nCaptures):
+                    status = ps.ps6000SetDataBufferBulk(self.chandle, self.usedChannels[i], self.bulkBuffer[i][segment].ctypes.data, self.nSamples, segment, downSampleMode)
+                    assert_pico_ok(status)
+        self.bulkRead = False
+        # buffers of getDataRaw have to be registered again after the rapid block mode
+        self.bufferConfig = None
+        return cMaxSamples.value
+
+    def getDataRawBulk(self, channel, downSampleRatio=1, downSampleMode=0):
+        """
+        Return the data of all captures of the rapid block mode (c.f. setRapidBlock). The waveforms of all channels are
+        transferred in one call upon the first access after runBlock, further channels are returned from the buffers.
+        NOTE: the returned array is the driver buffer, i.e. it is overwritten by the next acquisition.
+        :param channel: channel number
+        :param downSampleRatio: downsampling ratio of the driver
+        :param downSampleMode: downsampling mode of the driver
+        :return: data: int16 array of dim [captures, samples]
+        :return: numSamples: number of samples per capture
+        :return: overflow: bool array with overflow flag per capture
+        """
+        cNumSamples = ctypes.c_uint32(self.nSamples)
+        if not self.bulkRead:
+            status = ps.ps6000GetValuesBulk(self.chandle, ctypes.byref(cNumSamples), 0, self.nCaptures - 1, downSampleRatio, downSampleMode, self.bulkOverflow.ctypes.data)
+            assert_pico_ok(status)
+            self.bulkRead = True
+
+        data = self.bulkBuffer[self.usedChannels.index(channel)]
+        # overflow is a bitwise mask
+        overflow = (self.bulkOverflow & (1 << channel)) != 0
+        return data, cNumSamples.value, overflow
+
     def close(self):
         """
         Close the scope.
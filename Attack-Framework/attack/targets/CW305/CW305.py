@@ -175,6 +175,31 @@ class CW305(TargetTemplate):
         data = self._naeusb.cmdReadMem(addr, readlen)
         return data
 
+    def fpga_write_batch(self, writes):
+        """ Write several (address, data) pairs, consecutive addresses are written with a single transfer """
+
+        for addr, _ in writes:
+            if addr < self._woffset:
+                raise IOError("Write to read-only location: 0x%04x" % addr)
+
+        return self._naeusb.cmdWriteMemBatch(writes)
+
+    def fpga_read_batch(self, reads, max_gap=0):
+        """ Read several (address, length) blocks, consecutive addresses are read with a single transfer """
+
+        if any(addr > self._woffset for addr, _ in reads):
+            _logger.info("Read from write address, confirm this is not an error")
+
+        return self._naeusb.cmdReadMemBatch(reads, max_gap=max_gap)
+
+    def fpga_read_stream(self, addr, readlen, block_size=4096):
+        """ Read a large buffer block by block, the next block is transferred while the current one is processed """
+
+        if addr > self._woffset:
+            _logger.info("Read from write address, confirm this is not an error")
+
+        return self._naeusb.cmdReadMemStream(addr, readlen, block_size=block_size)
+
     def usb_clk_setenabled_action(self, p):
         self.usb_clk_setenabled(p.getValue())
 
@@ -27,6 +27,7 @@ import usb.backend.libusb0 as libusb0
 import usb.core
 import usb.util
 import math
+import queue
 from threading import Condition, Thread
 
 _logger = logging.getLogger(__name__)
@@ -264,6 +265,102 @@ class NAEUSB(object):
 
         return data
 
+    @staticmethod
+    def coalesceMem(requests, max_gap=0):
+        """
+        Merges (address, length) requests into runs of consecutive addresses. Only requests that follow each other
+        are merged, i.e. the order of the transfers is kept.
+
+        Args:
+            requests: List of (address, length) tuples
+            max_gap: Number of unused bytes that may lie between two merged requests
+
+        Returns:
+            List of runs [address, length, [indices of the merged requests]]
+        """
+        runs = []
+        for idx, (addr, dlen) in enumerate(requests):
+            if len(runs) > 0:
+                run = runs[-1]
+                end = run[0] + run[1]
+                if end <= addr <= end + max_gap:
+                    run[1] = addr + dlen - run[0]
+                    run[2].append(idx)
+                    continue
+            runs.append([addr, dlen, [idx]])
+        return runs
+
+    def cmdWriteMemBatch(self, writes):
+        """
+        Writes several (address, data) pairs. Writes to consecutive addresses are merged, such that each run of
+        registers needs a single command (bulk transfer for 48 bytes or more) instead of one command per pair.
+        The order of the writes is kept.
+
+        Args:
+            writes: List of (address, data) tuples
+        """
+        writes = [(addr, list(data)) for addr, data in writes]
+        for addr, dlen, indices in self.coalesceMem([(addr, len(data)) for addr, data in writes]):
+            pload = []
+            for idx in indices:
+                pload.extend(writes[idx][1])
+            self.cmdWriteMem(addr, pload)
+
+    def cmdReadMemBatch(self, reads, max_gap=0):
+        """
+        Reads several (address, length) blocks. Reads of consecutive addresses (or with at most max_gap bytes in
+        between) are merged into a single command.
+
+        Args:
+            reads: List of (address, length) tuples
+            max_gap: Number of bytes in between two reads that may be read as well and are discarded
+
+        Returns:
+            List with the data of every read
+        """
+        result = [None] * len(reads)
+        for addr, dlen, indices in self.coalesceMem(reads, max_gap=max_gap):
+            data = self.cmdReadMem(addr, dlen)
+            for idx in indices:
+                first = reads[idx][0] - addr
+                result[idx] = data[first : first + reads[idx][1]]
+        return result
+
+    def cmdReadMemStream(self, addr, dlen, block_size=4096, queue_depth=4):
+        """
+        Reads a large memory region in blocks of bulk transfers. The blocks are read by a background thread, such
+        that the next block is transferred while the caller processes the current one. The USB device must not be
+        used otherwise until all blocks have been consumed.
+
+        Args:
+            addr: Start address
+            dlen: Number of bytes
+            block_size: Number of bytes per transfer
+            queue_depth: Number of blocks that may be read ahead
+
+        Returns:
+            Generator of (offset, data) tuples
+        """
+        stream = NAEUSB.MemReadStreamThread(self, addr, dlen, block_size, queue_depth)
+        stream.start()
+        try:
+            while True:
+                block = stream.blocks.get()
+                if block is None:
+                    break
+                yield block
+        finally:
+            stream.stop = True
+            # unblock the thread if the generator is closed early
+            while stream.is_alive():
+                try:
+                    stream.blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            stream.join()
+        if stream.error is not None:
+            raise stream.error
+
     def cmdReadStream_getStatus(self):
         """
         Gets the status of the streaming mode capture, tells you samples left to stream out along
@@ -434,6 +531,43 @@ class NAEUSB(object):
             #     self.drx += bsize
 
 
+    class MemReadStreamThread(Thread):
+        def __init__(self, serial, addr, dlen, block_size=4096, queue_depth=4):
+            """
+            Reads a memory region of the FPGA block by block (c.f. StreamModeCaptureThread). The blocks are handed
+            over by a bounded queue, 'None' marks the end of the region.
+
+            Args:
+                addr: Start address
+                dlen: Number of bytes
+                block_size: Number of bytes per transfer
+                queue_depth: Number of blocks that may be read ahead
+            """
+            Thread.__init__(self)
+            self.daemon = True
+            self.serial = serial
+            self.addr = addr
+            self.dlen = dlen
+            self.block_size = max(1, int(block_size))
+            self.blocks = queue.Queue(maxsize=max(1, int(queue_depth)))
+            self.stop = False
+            self.error = None
+
+        def run(self):
+            start = time.time()
+            try:
+                for offset in range(0, self.dlen, self.block_size):
+                    if self.stop:
+                        break
+                    data = self.serial.cmdReadMem(self.addr + offset, min(self.block_size, self.dlen - offset))
+                    self.blocks.put((offset, data))
+            except IOError as e:
+                _logger.warning("Streaming: USB memory read failed")
+                self.error = e
+            self.blocks.put(None)
+            _logger.debug("Streaming: Read %d bytes in %.3f s" % (self.dlen, time.time() - start))
+
+
 if __name__ == "__main__":
     from fpga import FPGA
     from serial import USART
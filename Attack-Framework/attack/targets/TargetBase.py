@@ -1,5 +1,6 @@
 import serial
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 _logger = logging.getLogger(__name__)
 
@@ -62,6 +63,16 @@ class _TargetBase(object):
         info = None
         return info
 
+    def provide_schedule(self, config=[], N_traces=0):
+        """
+        Provide the precomputed inputs of all traces (optional). The entries of the schedule are written in bulk to the
+        datasets of the same name and are not stored from the input_data returned by load_data.
+        :param config: dictionary with the configuration details
+        :param N_traces: number of traces per measurement position
+        :return: attack.helper.utils.InputSchedule (default: None, i.e. inputs are provided by load_data)
+        """
+        return None
+
     def load_data(self, config=[], trace=0):
         """
         Load/modify data on the device before the next execution of the operation under attack.
@@ -97,3 +108,107 @@ class _TargetBase(object):
         """
 
         return []
+
+
+class AsyncTargetAdapter(object):
+    """
+    Asynchronous interface (prepare, commit, trigger) for synchronous targets. load_data is executed in a background
+    thread, all other attributes are forwarded to the wrapped target.
+    As the target only holds a single input, trigger and read_data must not be called while an input is prepared, i.e.
+    the preparation only overlaps with operations that do not access the target (e.g. the scope readout).
+    """
+
+    def __init__(self, target):
+        """
+        :param target: instance of a synchronous target (e.g. TargetControl derived from _TargetBase)
+        :return:
+        """
+        self.target = target
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+
+    def __getattr__(self, name):
+        # only called for attributes that are not defined by the adapter
+        if name == "target":
+            raise AttributeError(name)
+        return getattr(self.target, name)
+
+    def prepare(self, config=[], trace=0):
+        """
+        Load the data of a trace to the target in a background thread
+        :param config: dictionary with the configuration details
+        :param trace: id of the trace that is prepared
+        :return: concurrent.futures.Future with the list of different input_data
+        """
+        if self._future is not None:
+            raise RuntimeError("The previously prepared input has not been committed.")
+        self._future = self._executor.submit(self.target.load_data, config, trace)
+        return self._future
+
+    def commit(self):
+        """
+        Wait until load_data of the prepared trace is finished
+        :return: list of different input_data of the prepared trace
+        """
+        if self._future is None:
+            raise RuntimeError("No input has been prepared.")
+        future = self._future
+        self._future = None
+        return future.result()
+
+    def trigger(self, config=[], trace=0, repetition=0):
+        """
+        Start the execution of the operation under attack (c.f. execute_trigger)
+        :param config: dictionary with the configuration details
+        :param trace: id of the trace that is currently measured
+        :param repetition: the index of the repetition
+        :return: list of different trigger_data
+        """
+        self.check_idle()
+        return self.target.execute_trigger(config=config, trace=trace, repetition=repetition)
+
+    def execute_trigger(self, config=[], trace=0, repetition=0):
+        return self.trigger(config=config, trace=trace, repetition=repetition)
+
+    def load_data(self, config=[], trace=0):
+        self.check_idle()
+        return self.target.load_data(config, trace)
+
+    def read_data(self, config=[], trace=0):
+        self.check_idle()
+        return self.target.read_data(config=config, trace=trace)
+
+    def check_idle(self):
+        """
+        The target may only be accessed if no input is prepared in the background
+        :return:
+        """
+        if self._future is not None:
+            raise RuntimeError("The target is accessed while an input is prepared, call commit first.")
+
+    def close(self):
+        """
+        Wait for a pending preparation and stop the background thread
+        :return:
+        """
+        self._executor.shutdown(wait=True)
+
+
+def is_async_target(target):
+    """
+    Check whether a target provides the asynchronous interface (prepare, commit, trigger)
+    :param target: instance of a target
+    :return: True if the interface is available
+    """
+    return all(callable(getattr(target, name, None)) for name in ["prepare", "commit", "trigger"])
+
+
+def async_target(target):
+    """
+    Provide the asynchronous interface for a target, synchronous targets are wrapped by AsyncTargetAdapter
+    :param target: instance of a target
+    :return: target with the methods prepare, commit and trigger
+    """
+    if is_async_target(target):
+        return target
+    return AsyncTargetAdapter(target)
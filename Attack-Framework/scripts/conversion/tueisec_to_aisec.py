@@ -8,6 +8,8 @@ import sqlite3 as sql
 import time
 import sys
 from attack.helper.utils import HDF5utils as h5utils
+from attack.helper.utils import DATAutils as data_utils
+from concurrent.futures import ThreadPoolExecutor
 
 from Crypto.Cipher import AES
 
@@ -44,39 +46,6 @@ def hdf5_try_access(h5filehandle, h5item="/", attr=None, default=None, load_flag
     return value
 
 
-def add_data(h5handle, trace_nr, repetition_nr=None, load_flag=False, start_sample=0, stop_sample=None):
-    """
-    Extracts the measurement with trace_nr from the HDF5 file specified by h5handle
-    :param h5handle: HDF5 file handle
-    :param trace_nr: number of the measurement
-    :param repetition_nr: select repetition
-    :param load_flag: if true, data is loaded as an numpy array
-    :param start_sample: first sample that is loaded
-    :param stop_sample: last sample that is loaded
-    :return: data as numpy array
-    """
-    if load_flag:
-        try:
-            if repetition_nr is None:
-                data = h5handle[trace_nr, start_sample:stop_sample]
-            else:
-                data = h5handle[trace_nr, start_sample:stop_sample, repetition_nr]
-        except TypeError:
-            # e.g. in case, h5handle = None
-            data = None
-    else:
-        try:
-            if repetition_nr is None:
-                data = np.array(h5handle[trace_nr, start_sample:stop_sample], h5handle.dtype)
-            else:
-                data = np.array(h5handle[trace_nr, start_sample:stop_sample, repetition_nr], h5handle.dtype)
-        except TypeError:
-            # e.g. in case, h5handle = None
-            data = None
-
-    return data
-
-
 def convert_keystring_to_array(keystring):
     """
     converts a string with comma separated integer values into a numpy array
@@ -93,6 +62,92 @@ def convert_keystring_to_array(keystring):
     return key_array
 
 
+def encrypt_plaintexts(keys, plaintexts):
+    """
+    AES-128 encryption of the plaintexts of all traces. The traces are grouped by key and all plaintexts of a key are
+    encrypted with a single ECB call over the concatenated blocks.
+    :param keys: array with one key per trace
+    :param plaintexts: array with one plaintext per trace
+    :return: array (traces x 16) with the ciphertexts
+    """
+    nr_traces = plaintexts.shape[0]
+    keys = np.ascontiguousarray(keys).reshape((nr_traces, -1))
+    plaintexts = np.ascontiguousarray(plaintexts).reshape((nr_traces, -1))
+    ciphertexts = np.empty((nr_traces, 16), dtype=np.uint8)
+
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # traces sorted by key, i.e. the traces of a key are consecutive
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(unique_keys)))[:-1]
+    for key, traces in zip(unique_keys, np.split(order, bounds)):
+        cipher = AES.new(key=key.tobytes(), mode=AES.MODE_ECB)
+        ciphertexts[traces] = np.frombuffer(cipher.encrypt(plaintexts[traces].tobytes()), dtype=np.uint8).reshape((len(traces), 16))
+    return ciphertexts
+
+
+def read_block(handles, first, last, nr_repetitions=1, no_group=False, conversion_to_uint8=True, start_sample=0, stop_sample=None, key_array=None):
+    """
+    Reads the data of consecutive traces with a single (contiguous) read per dataset
+    :param handles: dictionary with the dataset handles (or arrays) of 'k', 'iv', 'ptxt', 'ctxt', 'adata' and 'samples'
+    :param first: first trace of the block
+    :param last: last trace of the block (excluded)
+    :param nr_repetitions: number of repetitions that are read
+    :param no_group: samples have no repetition dimension [legacy]
+    :param conversion_to_uint8: Flag whether conversion to uint8 is carried out
+    :param start_sample: first sample that is loaded
+    :param stop_sample: last sample that is loaded
+    :param key_array: fixed key for all traces (None: key from the HDF5 file)
+    :return: dictionary with C-contiguous arrays (traces x ...), samples with dim [traces, repetitions, samples]
+    """
+    block = {}
+    for label in ["k", "iv", "ptxt", "ctxt", "adata"]:
+        block[label] = None if handles[label] is None else np.ascontiguousarray(handles[label][first:last])
+    if key_array is not None:
+        block["k"] = np.ascontiguousarray(np.broadcast_to(key_array, (last - first,) + key_array.shape))
+
+    if no_group:
+        trace = np.asarray(handles["samples"][first:last, start_sample:stop_sample])[:, np.newaxis, :]
+    else:
+        trace = np.transpose(handles["samples"][first:last, start_sample:stop_sample, 0:nr_repetitions], (0, 2, 1))
+    if conversion_to_uint8 and trace.dtype != np.uint8:
+        trace = data_utils.convert_to_uint8(trace=trace)
+    block["samples"] = np.ascontiguousarray(trace)
+    return block
+
+
+def get_rows(data):
+    """
+    Splits a C-contiguous array into one memoryview per row (without copying the data)
+    :param data: array (rows x ...) or None
+    :return: list with one memoryview per row (or None)
+    """
+    if data is None:
+        return None
+    row_bytes = data.nbytes // data.shape[0] if data.shape[0] > 0 else 0
+    flat = memoryview(data.reshape(-1)).cast("B")
+    return [flat[idx * row_bytes : (idx + 1) * row_bytes] for idx in range(data.shape[0])]
+
+
+def generate_rows(block, first_id, timestamp, tile_x, tile_y):
+    """
+    Generates the rows of the traces table for a block of traces
+    :param block: dictionary returned by read_block
+    :param first_id: trace_id of the first row
+    :param timestamp: timestamp of the measurement position
+    :param tile_x: tile of the measurement position
+    :param tile_y: tile of the measurement position
+    :return: generator of rows
+    """
+    nr_traces, nr_repetitions = block["samples"].shape[0:2]
+    samples = get_rows(block["samples"].reshape((nr_traces * nr_repetitions, -1)))
+    metadata = [get_rows(block[label]) or [None] * nr_traces for label in ["k", "iv", "ptxt", "ctxt", "adata"]]
+    for jdx in range(nr_traces):
+        k, iv, ptxt, ctxt, adata = [rows[jdx] for rows in metadata]
+        for ldx in range(nr_repetitions):
+            yield (first_id + jdx * nr_repetitions + ldx, timestamp, tile_x, tile_y, ldx, 0, 0, k, iv, ptxt, ctxt, adata, samples[jdx * nr_repetitions + ldx])
+
+
 def convert(  # noqa: C901
     input_db_file,
     out_db_filename,
@@ -113,6 +168,8 @@ def convert(  # noqa: C901
     start_sample=0,
     stop_sample=None,
     skip_traces=0,
+    block_size=1000,
+    prefetch=False,
 ):
     """
     Converts a HDF5 file with the structure of the TUEISEC attack framework to a sqllite database in the AISEC data
@@ -121,6 +178,9 @@ def convert(  # noqa: C901
     :param out_db_filename: output file path for the sqlite database
     :param nr_traces: number of traces, only the first nr_traces are converted
     :param conversion_to_uint8: Flag whether conversion to uint8 is carried out
+    :param N_commit: number of traces after which data is committed (rounded up to full blocks, default: at the end)
+    :param block_size: number of traces that are read and inserted at once
+    :param prefetch: read the next block in a separate thread while the current one is inserted
     :return:
     """
 
@@ -195,8 +255,10 @@ def convert(  # noqa: C901
     _logger.info("Start conversion...")
     start_time = time.time()
 
-    # create new db
+    # create new db, no journaling overhead while the database is filled
     c = sql.connect(out_db_filename)
+    c.execute("PRAGMA journal_mode=WAL;")
+    c.execute("PRAGMA synchronous=OFF;")
     c.execute(
         """CREATE TABLE traces (
         trace_id     INTEGER PRIMARY KEY NOT NULL,
@@ -217,9 +279,15 @@ def convert(  # noqa: C901
     c.commit()
     _logger.info("Created database.")
 
+    if no_group:
+        # default: only a single measurement position, i.e. tile (0,0)
+        tile_x = np.array([0], dtype=int)
+        tile_y = np.array([0], dtype=int)
+
     # add traces indo db
     id = 1
     commit_counter = 0
+    block_size = max(1, int(block_size))
     for i in range(nr_positions):
         if no_group:
             group_string = ""
@@ -227,65 +295,57 @@ def convert(  # noqa: C901
             group_string = "%.4i" % i
 
         _logger.info("Processing position %i of %i." % (i + 1, nr_positions))
-        k = hdf5_try_access(h5filehandle, group_string + "/%s" % (k_label), load_flag=load_flag)
-        ptxt = hdf5_try_access(h5filehandle, group_string + "/%s" % (ptxt_label), load_flag=load_flag)
-        ctxt = hdf5_try_access(h5filehandle, group_string + "/%s" % (ctxt_label), load_flag=load_flag)
-        iv = hdf5_try_access(h5filehandle, group_string + "/%s" % (iv_label), load_flag=load_flag)
-        adata = hdf5_try_access(h5filehandle, group_string + "/%s" % (adata_label), load_flag=load_flag)
-        samples = hdf5_try_access(h5filehandle, group_string + "/%s" % (samples_label), load_flag=load_flag)
+        handles = {}
+        handles["k"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (k_label), load_flag=load_flag)
+        handles["ptxt"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (ptxt_label), load_flag=load_flag)
+        handles["ctxt"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (ctxt_label), load_flag=load_flag)
+        handles["iv"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (iv_label), load_flag=load_flag)
+        handles["adata"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (adata_label), load_flag=load_flag)
+        handles["samples"] = hdf5_try_access(h5filehandle, group_string + "/%s" % (samples_label), load_flag=load_flag)
         # Generate timestamp
         timestamp = hdf5_try_access(h5filehandle, "%.4i" % i, attr="timestamp", default=0)
 
-        for j in range(skip_traces, nr_traces):
-            _logger.info("Processing trace %i of %i." % (j + 1 - skip_traces, nr_traces - skip_traces))
-            for ldx in range(nr_repetitions):
-                _logger.debug("Processing repetition %i of %i." % (ldx + 1, nr_repetitions))
-                # Generate data
-                header = {}
-                header["trace_id"] = id
-                header["timestamp"] = timestamp
-                header["tile_x"] = int(tile_x[i])
-                header["tile_y"] = int(tile_y[i])
-                header["seqnr"] = ldx
-                header["start"] = 0
-                header["end"] = 0
-                if key_array is None:
-                    header["k"] = add_data(k, j, load_flag=load_flag)
-                else:
-                    header["k"] = key_array
-                header["iv"] = add_data(iv, j, load_flag=load_flag)
-                header["ptxt"] = add_data(ptxt, j, load_flag=load_flag)
-
-                if encrypt_plaintext:
-                    cipher = AES.new(key=bytes(header["k"]), mode=AES.MODE_ECB)
-                    header["ctxt"] = np.array(list(cipher.encrypt(bytes(header["ptxt"]))), dtype=np.uint8)
-                else:
-                    header["ctxt"] = add_data(ctxt, j, load_flag=load_flag)
-                header["adata"] = add_data(adata, j, load_flag=load_flag)
-                if no_group:
-                    trace = add_data(samples, trace_nr=j, repetition_nr=None, load_flag=load_flag, start_sample=start_sample, stop_sample=stop_sample)
+        if encrypt_plaintext:
+            # calculate the ciphertexts of all converted traces ahead of time, they are shared by all repetitions
+            ptxt = np.asarray(handles["ptxt"][skip_traces:nr_traces])
+            if key_array is None:
+                k = np.asarray(handles["k"][skip_traces:nr_traces])
+            else:
+                k = np.broadcast_to(key_array, (ptxt.shape[0],) + key_array.shape)
+            handles["ctxt"] = np.zeros((nr_traces, 16), dtype=np.uint8)
+            handles["ctxt"][skip_traces:nr_traces] = encrypt_plaintexts(keys=k, plaintexts=ptxt)
+
+        def read(first):
+            return read_block(handles, first, min(first + block_size, nr_traces), nr_repetitions=nr_repetitions, no_group=no_group, conversion_to_uint8=conversion_to_uint8, start_sample=start_sample, stop_sample=stop_sample, key_array=key_array)
+
+        # the next block is read by a background thread while the current one is inserted (if prefetch is set)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            first_traces = range(skip_traces, nr_traces, block_size)
+            next_block = executor.submit(read, first_traces[0]) if prefetch and len(first_traces) > 0 else None
+            for first in first_traces:
+                _logger.info("Processing traces %i to %i of %i." % (first + 1 - skip_traces, min(first + block_size, nr_traces) - skip_traces, nr_traces - skip_traces))
+                if prefetch:
+                    block = next_block.result()
+                    if first + block_size < nr_traces:
+                        next_block = executor.submit(read, first + block_size)
                 else:
-                    trace = add_data(samples, trace_nr=j, repetition_nr=ldx, load_flag=load_flag, start_sample=start_sample, stop_sample=stop_sample)
-                if conversion_to_uint8 and trace.dtype != np.uint8:
-                    trace = h5utils.convert_to_uint8(trace=trace)
+                    block = read(first)
 
-                # Add data set
-                c.execute(
-                    "INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
-                    (header["trace_id"], header["timestamp"], header["tile_x"], header["tile_y"], header["seqnr"], header["start"], header["end"], header["k"], header["iv"], header["ptxt"], header["ctxt"], header["adata"], sql.Binary(bytearray(trace))),
-                )
+                # Add data sets of the block
+                c.executemany("INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);", generate_rows(block, id, timestamp, int(tile_x[i]), int(tile_y[i])))
+                nr_rows = block["samples"].shape[0] * block["samples"].shape[1]
 
-                if commit_counter == N_commit:
+                commit_counter = commit_counter + block["samples"].shape[0]
+                if N_commit is not None and commit_counter >= N_commit:
                     c.commit()
                     commit_counter = 0
-                else:
-                    # increase commit counter
-                    commit_counter = commit_counter + 1
 
                 # increase ID counter
-                id = id + 1
+                id = id + nr_rows
 
     c.commit()
+    # switch back to the default rollback journal, i.e. readers of the database do not need WAL support
+    c.execute("PRAGMA journal_mode=DELETE;")
     c.close()
 
     end_time = time.time()
@@ -332,6 +392,8 @@ def main():
     )
     parser.add_argument("--encrypt_plaintext", dest="encrypt_plaintext", help="Encrypt the AES-128 plaintext to get the ciphertext, e.g., if no ciphtext was stored. " "(default: False)", action="store_true", default=False)
     parser.add_argument("--skip-traces", dest="skip_traces", help="Skip the first traces for conversion (default: 0)", metavar="integer", type=int, default=0)
+    parser.add_argument("--block-size", dest="block_size", help="Number of traces that are read and inserted at once (default: 1000)", metavar="integer", type=int, default=1000)
+    parser.add_argument("--prefetch", dest="prefetch", help="Read the next block of traces in a separate thread while the current one is inserted (default: False)", action="store_true", default=False)
     args = parser.parse_args()
 
     # configure logger
@@ -375,6 +437,8 @@ def main():
         start_sample=args.start_sample,
         stop_sample=args.stop_sample,
         skip_traces=args.skip_traces,
+        block_size=args.block_size,
+        prefetch=args.prefetch,
     )
 
 
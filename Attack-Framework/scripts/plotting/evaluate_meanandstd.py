@@ -3,14 +3,15 @@ import h5py
 import numpy as np
 import argparse
 import matplotlib.pyplot as plt
+from attack.helper.utils import TraceStore
 
 
 def plot_legacy(file_name, group="0000", dataset="samples", trace_start=0, trace_stop=None, trace_step=1, sample_start=0, sample_stop=None, trace_thres=5, y_min=None, y_max=None):
 
     # create HDF5 file object
     h5filehandle = h5py.File(file_name, "r")
-    # create HDF5 dataset object of samples
-    dset = h5filehandle.get(group + "/" + dataset)
+    # create HDF5 dataset object of samples, read from the memory map or the cached chunks of the dataset
+    dset = TraceStore(h5filehandle.get(group + "/" + dataset))
 
     if sample_stop is None:
         sample_stop = dset.shape[1]
@@ -73,8 +74,8 @@ def boxplot_of_samples(file_name, group="0000", dataset="samples", trace_start=0
 
     # create HDF5 file object
     h5filehandle = h5py.File(file_name, "r")
-    # create HDF5 dataset object of samples
-    dset = h5filehandle.get(group + "/" + dataset)
+    # create HDF5 dataset object of samples, read from the memory map or the cached chunks of the dataset
+    dset = TraceStore(h5filehandle.get(group + "/" + dataset))
 
     if sample_stop is None:
         sample_stop = dset.shape[1]
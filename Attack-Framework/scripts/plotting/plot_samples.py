@@ -5,6 +5,7 @@ import argparse
 from matplotlib import pyplot as plt
 from attack.helper import plot_utils
 from attack.helper.utils import HDF5utils as h5utils
+from attack.helper.utils import TraceStore
 import re
 
 
@@ -42,7 +43,7 @@ def main():  # noqa: C901
         # get samples handle
         sample_handle = h5filehandle["/" + group + "/" + args.dataset]
         # get array with selected traces
-        samples, _, _ = h5utils.hdf5_apply_selection(sample_handle=sample_handle, traces=args.traces, repetitions=args.repetitions)
+        samples, _, _ = h5utils.hdf5_apply_selection(sample_handle=TraceStore(sample_handle), traces=args.traces, repetitions=args.repetitions)
 
         # try to get values from HDF5
         try:
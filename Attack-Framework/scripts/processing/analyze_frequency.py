@@ -6,6 +6,7 @@ import argparse
 from attack.helper.utils import FrequencyUtils as freq_utils
 from attack.helper.utils import HDF5utils as h5utils
 from attack.helper.utils import MISCutils as misc_utils
+from attack.helper.utils import TraceStore
 import sys
 import os
 
@@ -30,6 +31,8 @@ def main():  # noqa: C901
     parser.add_argument("--single-mode", dest="single_mode", action="store_true", help="Convert each trace and repetition separately to save RAM (for big datasets and/or constrained resources)")
     parser.add_argument("-v", "--verbose", help="Display debug log messages", action="store_true")
     parser.add_argument("--fs", dest="fs", help="Sampling frequency [S/s] (if not provided by HDF5).", default=None, type=float)
+    parser.add_argument("--block-size", dest="block_size", help="Number of traces that are transformed at once. Default: as many as fit into 256 MiB", default=None, type=int)
+    parser.add_argument("--workers", dest="workers", help="Number of threads for the FFT (-1: all CPUs). Default: 1", default=None, type=int)
 
     args = parser.parse_args()
 
@@ -197,6 +200,8 @@ def main():  # noqa: C901
             _logger.info("Processing dataset %s..." % dataset)
             # get handle
             dset_handle_in = h5filename_in["/" + position + "/" + dataset]
+            # traces are read from the memory map or the cached chunks of the dataset
+            trace_store = TraceStore(dset_handle_in)
             # 2. Generate data in frequency domain and write to file
 
             # create data set for the spectrum
@@ -218,48 +223,52 @@ def main():  # noqa: C901
             else:
                 dset_handle_spec.attrs["Smoothing"] = False
 
-            # iterate over selected traces (for memory reasons)
-            for tdx, trace_id in enumerate(traces_selected):
-                _logger.info("Calculating FFT of trace %i / %i" % (trace_id + 1, len(traces_selected)))
-                # get data
-                samples = np.array(dset_handle_in[trace_id, samples_start:samples_stop, 0 : args.repetitions])
+            # transform blocks of traces x repetitions at once, the block size is limited for memory reasons
+            if args.single_mode:
+                block_size = 1
+            elif args.block_size is not None:
+                block_size = args.block_size
+            else:
+                block_size = max(1, 2**28 // (16 * (samples_stop - samples_start) * args.repetitions))
+
+            for positions, samples in trace_store.iter_blocks(traces=traces_selected, samples=slice(samples_start, samples_stop), repetitions=slice(0, args.repetitions), block_traces=block_size):
+                _logger.info("Calculating FFT of traces %i to %i / %i" % (positions.start + 1, positions.stop, len(traces_selected)))
 
                 _logger.debug("Calculating FFT...")
                 if args.single_mode:
                     # preallocate
-                    Y = np.zeros((num_freq_bins, args.repetitions), dtype=float)
+                    Y = np.zeros((samples.shape[0], num_freq_bins, args.repetitions), dtype=float)
                     for rep_id in range(0, args.repetitions):
                         _logger.debug("Calculating FFT of repetition %i / %i" % (rep_id + 1, args.repetitions))
-                        Y_tmp, freqs, NFFT = freq_utils.single_sided_fft(x=samples[:, [rep_id]], fs=fs, NFFT=None, conv_dec=True, windowing=args.window, FFT_dim=0)
+                        Y_tmp, freqs, NFFT = freq_utils.single_sided_fft(x=samples[:, :, [rep_id]], fs=fs, NFFT=None, conv_dec=True, windowing=args.window, FFT_dim=1, workers=args.workers)
 
                         if args.smooth_spec:
                             _logger.debug("Smoothing in frequency direction.")
-                            Y_tmp = freq_utils.fft_smooth(data=Y_tmp, order=2, filterdim=0)
+                            Y_tmp = freq_utils.fft_smooth(data=Y_tmp, order=2, filterdim=1)
 
                         # limit to selected frequency range
-                        Y[:, [rep_id]] = Y_tmp[freq_min_bin : freq_max_bin + 1, :]
+                        Y[:, :, [rep_id]] = Y_tmp[:, freq_min_bin : freq_max_bin + 1, :]
                 else:
-                    Y, freqs, NFFT = freq_utils.single_sided_fft(x=samples, fs=fs, NFFT=None, conv_dec=True, windowing=args.window, FFT_dim=0)
+                    Y, freqs, NFFT = freq_utils.single_sided_fft(x=samples, fs=fs, NFFT=None, conv_dec=True, windowing=args.window, FFT_dim=1, workers=args.workers)
                     if args.smooth_spec:
                         _logger.debug("Smoothing in frequency direction.")
-                        Y = freq_utils.fft_smooth(data=Y, order=2, filterdim=0)
+                        Y = freq_utils.fft_smooth(data=Y, order=2, filterdim=1)
 
                     # limit to selected frequency range
-                    Y = Y[freq_min_bin : freq_max_bin + 1, :]
+                    Y = Y[:, freq_min_bin : freq_max_bin + 1, :]
 
                 _logger.debug("Finished FFT.")
                 if args.av_over_all or args.av_over_reps:
                     _logger.debug("Averaging spectrum...")
                     # average over repetitions
-                    Y = np.mean(Y, axis=1)
-                    Y = np.atleast_2d(Y)
+                    Y = np.mean(Y, axis=2)
 
                 if args.av_over_all:
-                    spec_tmp[tdx, :] = Y
+                    spec_tmp[positions, :] = Y
                 elif args.av_over_reps:
-                    dset_handle_spec[tdx, ...] = Y.transpose()
+                    dset_handle_spec[positions, :, 0] = Y
                 else:
-                    dset_handle_spec[tdx, ...] = Y
+                    dset_handle_spec[positions, ...] = Y
 
             if args.av_over_all:
                 dset_handle_spec[:] = np.mean(spec_tmp, axis=0)
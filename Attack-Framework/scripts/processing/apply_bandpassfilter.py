@@ -2,39 +2,29 @@
 import numpy as np
 import h5py
 import argparse
+import logging
 import scipy.signal
+from concurrent.futures import ProcessPoolExecutor
+from attack.helper.utils import HDF5utils as h5utils
+from attack.helper.utils import MISCutils as misc_utils
+from attack.helper.utils import TraceStore
 
+_logger = logging.getLogger(__name__)
 
-def copy_attributes(handle, handle_out):
-    for name, value in handle.attrs.items():
-        handle_out.attrs[name] = value
 
-
-def copy_dataset(handle, handle_out, dset_name, trace_select, dtype=None):
-    if dtype is None:
-        handle_out.create_dataset(dset_name, shape=(len(trace_select), handle.shape[1], handle.shape[2]), dtype=handle.dtype)
-        handle_out[dset_name][:] = handle[trace_select, :, :]
-    else:
-        handle_out.create_dataset(dset_name, shape=(len(trace_select), handle.shape[1], handle.shape[2]), dtype=dtype)
-
-
-def create_filecopy(handle, handle_out, trace_select):
-    for keys in handle.keys():
-        # create group
-        handle_out.create_group(keys)
-        # copy attributes of group
-        copy_attributes(handle[keys], handle_out[keys])
-        # loop over datasets
-        for dsets in handle[keys].keys():
-
-            if dsets == "samples":
-                # create dataset of float type
-                copy_dataset(handle[keys][dsets], handle_out[keys], dset_name=dsets, trace_select=trace_select, dtype=np.float)
-            else:
-                # copy data set and attributes
-                copy_dataset(handle[keys][dsets], handle_out[keys], dset_name=dsets, trace_select=trace_select)
-            # copy attributes
-            copy_attributes(handle[keys][dsets], handle_out[keys][dsets])
+def filter_block(sos, data, zero_phase=False):
+    """
+    Filters a block of traces along the sample axis
+    :param sos: second-order sections of the filter
+    :param data: array with dim [traces, samples, repetitions]
+    :param zero_phase: apply the filter forward and backward (no phase shift)
+    :return: filtered block
+    """
+    # convert before filtering, the padding of sosfiltfilt would wrap around for integer samples
+    data = np.asarray(data, dtype=float)
+    if zero_phase:
+        return scipy.signal.sosfiltfilt(sos, data, axis=1)
+    return scipy.signal.sosfilt(sos, data, axis=1)
 
 
 if __name__ == "__main__":
@@ -46,9 +36,16 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--position", dest="group", help="Measurement position for evaluation", default="0000", type=str)
     parser.add_argument("-d", "--dataset", dest="dataset", help="Name of the dataset for evaluation. Default: 'samples'", default="samples", type=str)
     parser.add_argument("--traces", dest="traces", help="Select traces, [min, max, step]. Default: all", metavar=int, type=int, default=[None, None, 1], nargs=3)
+    parser.add_argument("--zero-phase", dest="zero_phase", action="store_true", help="Filter forward and backward (sosfiltfilt), i.e. without phase shift.")
+    parser.add_argument("--processes", dest="processes", help="Number of processes that filter blocks in parallel (default: 1).", type=int, default=1)
+    parser.add_argument("--block-size", dest="block_size", help="Number of traces that are filtered at once (default: as many as fit into 64 MiB).", type=int, default=None)
+    parser.add_argument("-v", "--verbose", help="Display debug log messages", action="store_true")
 
     args = parser.parse_args()
 
+    # configure logger
+    misc_utils.configure_logger(verbose=args.verbose)
+
     # specify file that contains the raw data
     h5filehandle = h5py.File(args.inputfile, "r")
     # create data set handle
@@ -77,8 +74,8 @@ if __name__ == "__main__":
     lowf = args.freqrange[0] / nyq
     # higher freq
     highf = args.freqrange[1] / nyq
-    #  numerator_coefficient_vector and denominator_coefficient_vector
-    ncv, dcv = scipy.signal.butter(args.order, [lowf, highf], btype="band")
+    # second-order sections are numerically stable for higher orders
+    sos = scipy.signal.butter(args.order, [lowf, highf], btype="band", output="sos")
 
     ### Create copy of the file  # noqa: E266
 
@@ -89,26 +86,35 @@ if __name__ == "__main__":
     # open copy
     h5filehandle_out = h5py.File(args.outputfile, "w")
     h5filehandle_out.attrs["Original file before filtering"] = args.inputfile
-    create_filecopy(handle=h5filehandle, handle_out=h5filehandle_out, trace_select=traces_selected)
+    # the filtered dataset is created empty and filled block by block
+    h5utils.create_filecopy(handle=h5filehandle, handle_out=h5filehandle_out, trace_select=traces_selected, conversion=[[args.dataset, float]], create_empty=True)
     # dataset handle
     samples_dset_out = h5filehandle_out["/" + args.group + "/" + args.dataset]
 
     # add attributes for filterung
-    samples_dset_out.attrs["Filtering"] = "order %i butterworth bandpass" % args.order
+    samples_dset_out.attrs["Filtering"] = "order %i butterworth bandpass%s" % (args.order, " (zero-phase)" if args.zero_phase else "")
     samples_dset_out.attrs["Lower frequency [Hz]"] = args.freqrange[0]
     samples_dset_out.attrs["Upper frequency [Hz]"] = args.freqrange[1]
     samples_dset_out.attrs["Selected Traces"] = args.traces
 
     ### Actual filtering  # noqa: E266
 
-    # get dataset
-    trace = np.array(samples_dset[traces_selected, :, :])
-
-    # filter each trace
-    # TODO: could be improved by filtering batches of traces (the current method makes sure not to run into RAM problems)
-    for idx in range(0, trace.shape[0]):
-        print("Trace %i / %i" % (idx, trace.shape[0]))
-        samples_dset_out[idx, :, :] = scipy.signal.lfilter(ncv, dcv, trace[idx, :, :], axis=0)
+    # read bounded blocks of traces, filter them in parallel and write the results in order
+    if args.block_size is None:
+        args.block_size = max(1, 2**26 // (8 * samples_dset.shape[1] * samples_dset.shape[2]))
+    blocks = TraceStore(samples_dset).iter_blocks(traces=traces_selected, block_traces=args.block_size)
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        pending = []
+        for positions, data in blocks:
+            pending.append((positions, executor.submit(filter_block, sos, data, args.zero_phase)))
+            # limit the number of blocks in memory
+            while len(pending) > args.processes or (pending and pending[0][1].done()):
+                positions, future = pending.pop(0)
+                samples_dset_out[positions, :, :] = future.result()
+                _logger.info("Filtered traces %i to %i / %i" % (positions.start + 1, positions.stop, len(traces_selected)))
+        for positions, future in pending:
+            samples_dset_out[positions, :, :] = future.result()
+            _logger.info("Filtered traces %i to %i / %i" % (positions.start + 1, positions.stop, len(traces_selected)))
 
     # close HDF5 files
     h5filehandle.close()
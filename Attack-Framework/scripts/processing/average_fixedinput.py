@@ -3,26 +3,128 @@ import numpy as np
 import h5py
 import argparse
 from attack.helper.utils import HDF5utils as HDF5_utils
+from attack.helper.utils import TraceStore
 import logging
 
 _logger = logging.getLogger(__name__)
 
 
-def cummulative_moving_average(x, cma, n):
+def average_repetitions(samples_store, num_traces, num_repetitions, block_size):
     """
-    Cummulative moving average (CMA), c.f. https://en.wikipedia.org/wiki/Moving_average
-    :param x: current data
-    :param cma: current CMA
-    :param n: number of included data points
-    :return: updated CMA
+    Averages the repetitions of every trace, the traces are streamed block by block
+    :param samples_store: TraceStore of the samples
+    :param num_traces: number of (first) traces that are averaged
+    :param num_repetitions: number of (first) repetitions that are averaged
+    :param block_size: number of traces that are read at once
+    :return: array (traces x samples) with the average of every trace
     """
+    average = np.zeros((num_traces, samples_store.shape[1]))
+    for positions, samples in samples_store.iter_blocks(traces=np.arange(0, num_traces), repetitions=slice(0, num_repetitions), block_traces=block_size):
+        _logger.info("Averaging repetitions of traces %i to %i" % (positions.start + 1, positions.stop))
+        average[positions] = np.sum(samples, axis=2, dtype=np.float64) / samples.shape[2]
+    return average
 
-    cma = cma + (x - cma) / n
-    return cma
+
+def average_fixed(samples_store, reference_store, reference_value, num_traces, block_size, group_by_value=False):
+    """
+    Averages all traces whose reference dataset matches the reference value in a single pass over the file. The
+    reference and sample blocks are read together and the selection is done for the whole block at once.
+    :param samples_store: TraceStore of the samples
+    :param reference_store: TraceStore of the reference dataset (None: the samples are the reference)
+    :param reference_value: list with the reference value (None: all traces are selected)
+    :param num_traces: maximum number of selected traces (None: all)
+    :param block_size: number of traces that are read at once
+    :param group_by_value: average separately for every distinct value of the reference dataset
+    :return: array (values x samples) with the averages, number of averaged traces per value, index of the first trace
+    per value
+    """
+    # per distinct reference value: [sum, number of traces, first trace]
+    sums = dict()
+    N_traces = 0
+    if reference_store is None:
+        # the samples block is its own reference, i.e. every block is read once
+        blocks = ((block, block) for block in samples_store.iter_blocks(repetitions=[0], block_traces=block_size))
+    else:
+        # both datasets have to be split into the same aligned blocks
+        chunk_traces = int(np.lcm(samples_store.chunks[0], reference_store.chunks[0]))
+        block_size = -(-block_size // chunk_traces) * chunk_traces
+        blocks = zip(reference_store.iter_blocks(repetitions=[0], block_traces=block_size), samples_store.iter_blocks(repetitions=[0], block_traces=block_size))
+    for (positions, reference), (_, samples) in blocks:
+        reference = reference.reshape((reference.shape[0], -1))
+        samples = samples[:, :, 0]
+
+        # select the traces of the block that have the reference value
+        if reference_value is None or group_by_value:
+            selected = np.ones(reference.shape[0], dtype=bool)
+        else:
+            selected = np.all(reference == np.asarray(reference_value), axis=1)
+        if num_traces is not None:
+            # stop after desired number of traces
+            selected[selected] = np.arange(N_traces, N_traces + np.count_nonzero(selected)) < num_traces
+        trace_indices = np.arange(positions.start, positions.stop)[selected]
+        N_traces = N_traces + len(trace_indices)
+        _logger.info("Traces %i to %i: %i traces selected" % (positions.start + 1, positions.stop, len(trace_indices)))
+
+        if group_by_value:
+            values, first, inverse = np.unique(reference[selected], axis=0, return_index=True, return_inverse=True)
+            block_sums = np.zeros((len(values), samples.shape[1]))
+            np.add.at(block_sums, inverse.reshape(-1), samples[selected])
+            counts = np.bincount(inverse.reshape(-1), minlength=len(values))
+            for vdx, value in enumerate(values):
+                entry = sums.setdefault(value.tobytes(), [0, 0, trace_indices[first[vdx]]])
+                entry[0] = entry[0] + block_sums[vdx]
+                entry[1] = entry[1] + counts[vdx]
+        elif len(trace_indices) > 0:
+            entry = sums.setdefault(None, [0, 0, trace_indices[0]])
+            entry[0] = entry[0] + np.sum(samples[selected], axis=0, dtype=np.float64)
+            entry[1] = entry[1] + len(trace_indices)
+
+        if num_traces is not None and N_traces == num_traces:
+            break
+
+    # order by the first trace of every value
+    entries = sorted(sums.values(), key=lambda entry: entry[2])
+    average = np.array([entry[0] / entry[1] for entry in entries]).reshape((len(entries), samples_store.shape[1]))
+    counts = np.array([entry[1] for entry in entries], dtype=np.int64)
+    first_indices = np.array([entry[2] for entry in entries], dtype=np.int64)
+    return average, counts, first_indices
+
+
+def write_average(h5filehandle, h5filehandle_out, group, dataset, average, counts, trace_select, repetition_select=None):
+    """
+    Writes the averages to a new file that only contains the metadata of the selected traces of the evaluated group
+    :param h5filehandle: handle of the input file
+    :param h5filehandle_out: handle of the output file
+    :param group: measurement group that was evaluated
+    :param dataset: name of the averaged dataset
+    :param average: array (averages x samples)
+    :param counts: number of averaged traces per average
+    :param trace_select: indices of the traces whose metadata (other datasets) is stored with the averages
+    :param repetition_select: indices of the repetitions of the other datasets that are copied (default: all)
+    :return:
+    """
+    HDF5_utils.copy_attributes(h5filehandle, h5filehandle_out)
+    if "__documentation__" in h5filehandle:
+        h5filehandle.copy(h5filehandle["__documentation__"], h5filehandle_out)
+
+    group_handle = h5filehandle[group]
+    group_handle_out = h5filehandle_out.create_group(group)
+    HDF5_utils.copy_attributes(group_handle, group_handle_out)
+    for dsets in group_handle.keys():
+        if dsets == dataset:
+            # averaged samples as float dataset with a single repetition
+            dset_out = group_handle_out.create_dataset(dsets, data=average[:, :, np.newaxis])
+        else:
+            HDF5_utils.copy_dataset(group_handle[dsets], group_handle_out, dset_name=dsets, trace_select=trace_select, repetititon_select=repetition_select)
+            dset_out = group_handle_out[dsets]
+        HDF5_utils.copy_attributes(group_handle[dsets], dset_out)
+
+    # add attributes with the number of traces used for averaging
+    group_handle_out[dataset].attrs["Number of averaged traces"] = counts[0] if len(counts) == 1 else counts
 
 
 def main():  # noqa: C901
-    parser = argparse.ArgumentParser(description="Script for averaging several traces with a certain fixed input file. A moving average is calculated.")
+    parser = argparse.ArgumentParser(description="Script for averaging several traces with a certain fixed input file. The average is calculated in a single pass over the file.")
     parser.add_argument("-i", "--inputfile", dest="inputfile", metavar="filename", help="Input file name with t-test results. (*.hdf5).", type=str, required=True)
     parser.add_argument("-o", "--outputfile", dest="outputfile", metavar="filename", help="Output file (default: add '_averaged_N<number of traces>' to file name)", type=str, default=None)
     parser.add_argument("-p", "--position", dest="group", help="Measurement position for evaluation", default="0000", type=str)
@@ -30,8 +132,10 @@ def main():  # noqa: C901
     parser.add_argument("--traces", dest="traces", help="Number of traces for averaging. Default: all", metavar=int, type=int, default=None)
     parser.add_argument("--reference_dataset", dest="reference_dataset", type=str, help="Reference dataset according to which the traces are selected", default=None)
     parser.add_argument("--reference_value", dest="reference_value", nargs="*", help="Reference value from which the traces are selected.", type=int, default=None)
+    parser.add_argument("--group-by-value", dest="group_by_value", action="store_true", help="Average separately for every distinct value of the reference dataset (one output trace per value).")
     parser.add_argument("--average-repetitions-only", dest="reps_only", action="store_true", help="Only average across repetitions, independent of data.")
     parser.add_argument("--repetitions", dest="num_repetitions", help="Number of repetitions for averaging. Default: all", metavar=int, type=int, default=None)
+    parser.add_argument("--block-size", dest="block_size", help="Number of traces that are read at once. Default: 10000", type=int, default=10000)
     parser.add_argument("-v", "--verbose", help="Display debug log messages", action="store_true")
 
     args = parser.parse_args()
@@ -47,74 +151,48 @@ def main():  # noqa: C901
     # specify file that contains the raw data
     h5filehandle = h5py.File(args.inputfile, "r")
 
-    # create data set handle
-    samples_dset = h5filehandle["/" + args.group + "/" + args.dataset]
+    # create data set handle, traces are read from the memory map or the cached chunks of the dataset
+    samples_dset = TraceStore(h5filehandle["/" + args.group + "/" + args.dataset])
     if args.reference_dataset is not None:
-        reference_dset = h5filehandle["/" + args.group + "/" + args.reference_dataset]
+        reference_dset = TraceStore(h5filehandle["/" + args.group + "/" + args.reference_dataset])
     else:
-        reference_dset = h5filehandle["/" + args.group + "/" + args.dataset]
+        reference_dset = None
 
-    # loop over all traces that have the correct value (e.g. key, input, etc.) and perform moving average
     if args.reps_only:
-        N_traces = 0
+        # average across the repetitions of every trace
         if args.traces is None:
             num_traces = samples_dset.shape[0]
         else:
             num_traces = args.traces
+        if args.num_repetitions is None:
+            N_traces = samples_dset.shape[2]
+        else:
+            N_traces = min(args.num_repetitions, samples_dset.shape[2])
 
-        cma = np.zeros((num_traces, samples_dset.shape[1]))
+        average = average_repetitions(samples_dset, num_traces=num_traces, num_repetitions=N_traces, block_size=args.block_size)
+        counts = np.array([N_traces])
         trace_select = np.arange(0, num_traces)
-        for repetition_idx in range(0, samples_dset.shape[2]):
-            N_traces = N_traces + 1
-            _logger.info("Repetition %i" % (N_traces))
-            cma = cummulative_moving_average(np.array(samples_dset[0:num_traces, :, repetition_idx]), cma, N_traces)
-            if args.num_repetitions is not None:
-                # stop after desired number of traces
-                if N_traces == args.num_repetitions:
-                    break
+        repetition_select = np.arange(0, 1)
     else:
-        N_traces = 0
-        first_reference_idx = None
-        cma = np.zeros(samples_dset.shape[1])
-        for trace_idx in range(0, reference_dset.shape[0]):
-            # check whether reference dataset has the correct reference value for the trace (if no reference is given, average over all traces)
-            if np.all(np.array(reference_dset[trace_idx, :, 0]) == args.reference_value) or args.reference_value is None:
-                N_traces = N_traces + 1
-
-                _logger.info("Averaging trace %i" % (N_traces))
-                cma = cummulative_moving_average(np.array(samples_dset[trace_idx, :, 0]), cma, N_traces)
-
-                if first_reference_idx is None:
-                    # store the index of the first matching trace
-                    first_reference_idx = trace_idx
-
-            # if desired number of traces is reached, abort
-            if args.traces is not None:
-                # stop after desired number of traces
-                if N_traces == args.traces:
-                    break
+        # average all traces that have the correct value (e.g. key, input, etc.)
+        average, counts, trace_select = average_fixed(samples_dset, reference_dset, args.reference_value, num_traces=args.traces, block_size=args.block_size, group_by_value=args.group_by_value)
+        N_traces = int(np.sum(counts))
+        repetition_select = None
+        if N_traces == 0:
+            _logger.error("No trace matches the reference value.")
+            h5filehandle.close()
+            return
+        if args.group_by_value:
+            _logger.info("%i distinct reference values" % len(counts))
 
     # same file name but adding number of traces
     if args.outputfile is None:
         args.outputfile = ".".join(args.inputfile.split(".")[:-1]) + "_averaged_N%i.hdf5" % (N_traces)
 
-    # open copy
+    # write the averages with the metadata of the first trace (per value)
     h5filehandle_out = h5py.File(args.outputfile, "w")
     h5filehandle_out.attrs["Original file before averaging"] = args.inputfile
-    if args.reps_only:
-        # copy the file, generating a float dataset
-        HDF5_utils.create_filecopy(handle=h5filehandle, handle_out=h5filehandle_out, trace_select=trace_select, repetition_select=np.arange(0, 1), conversion=[["samples", np.float]])
-    else:
-        # copy the file, generating a float dataset
-        HDF5_utils.create_filecopy(handle=h5filehandle, handle_out=h5filehandle_out, trace_select=[first_reference_idx], conversion=[["samples", np.float]])
-    # dataset handle
-    samples_dset_out = h5filehandle_out["/" + args.group + "/" + args.dataset]
-
-    # add attributes with the number of traces used for averaging
-    samples_dset_out.attrs["Number of averaged traces"] = N_traces
-
-    # write cummulative average
-    samples_dset_out[:, :, 0] = cma
+    write_average(h5filehandle, h5filehandle_out, args.group, args.dataset, average, counts, trace_select, repetition_select=repetition_select)
 
     # close HDF5 files
     h5filehandle.close()
@@ -10,15 +10,19 @@ import importlib
 import commentjson as cjson
 import logging
 import numpy as np
+import queue
+import threading
 import time
 import sys
 import os
 
 from attack.helper.utils import HDF5utils as h5utils
+from attack.helper.utils import HDF5writer
 from attack.helper.utils import JSONutils as jsonutils
 from attack.helper.utils import DATAutils as datautils
 from attack.helper.utils import MISCutils as miscutils
 from attack.helper.Meander import Meander as tableutils
+from attack.targets.TargetBase import AsyncTargetAdapter, async_target, is_async_target
 
 import attack.oscilloscope.picosdk6000 as PicoScope6000
 import attack.oscilloscope.Keysight_254A as Keysight_254A
@@ -29,8 +33,14 @@ _logger = logging.getLogger(__name__)
 
 class Measurement(object):
     scope = None
+    h5writer = None
     segment_counter = -1
     num_segs = -2
+    # segmented acquisition, i.e. several traces are retrieved at once (Keysight segmented mode, PicoScope rapid block)
+    segmented = False
+    rapid_block = False
+    # inputs precomputed by the target (c.f. attack.helper.utils.InputSchedule)
+    schedule = None
 
     def __init__(self, config, module_name, no_scope=False):
         # get configuration
@@ -99,6 +109,12 @@ class Measurement(object):
         # configure target
         self.target.configure_device(jsonutils.json_try_access(self.config, ["target", "binary"], default=None), self.config)
 
+        # prepare the input of the next trace while the current trace is retrieved from the scope. Used by default for
+        # targets with the asynchronous interface, synchronous targets are wrapped if it is enabled in the config
+        self.prefetch = jsonutils.json_try_access(self.config, ["msmt", "prefetch"], default=is_async_target(self.target))
+        if self.prefetch:
+            self.target = async_target(self.target)
+
         # retrieve scope type
         self.scope_type = jsonutils.json_try_access(self.config, ["scope", "type"], default="")
 
@@ -150,6 +166,17 @@ class Measurement(object):
         except BaseException:
             _logger.warning("Scope could not be closed.")
 
+        # wait for an input that is still prepared in the background
+        if isinstance(self.target, AsyncTargetAdapter):
+            self.target.close()
+
+        # write the traces that are still buffered (e.g. if the measurement was aborted)
+        if self.h5writer is not None:
+            try:
+                self.h5writer.flush()
+            except BaseException:
+                _logger.warning("Buffered traces could not be written.")
+
         # save performance measures and recorded number of traces
         try:
             end_time = time.time()
@@ -178,6 +205,7 @@ class Measurement(object):
                 capture_trigger = False
                 # execute some additional commands for Keysight
                 self.scope_init_keysight()
+                self.segmented = True
             else:
                 # should never happen as init should capture this already.
                 # However, for debugging without scope this may be helpful
@@ -279,6 +307,15 @@ class Measurement(object):
                 limit_segs = jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "maximum segments"], default=self.max_segments)
                 if limit_segs is not None:
                     self.max_segments = min(self.max_segments, limit_segs)
+            elif "PicoScope 6" in self.scope_type:
+                # alternate between two sets of driver buffers for consecutive acquisitions
+                self.scope.setDoubleBuffer(jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "double buffering"], default=False))
+                # rapid block mode: number of segments that are captured before the data is retrieved at once
+                rapid_block_segs = jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "rapid block segments"], default=None)
+                if rapid_block_segs is not None and int(rapid_block_segs) > 1:
+                    self.max_segments = int(rapid_block_segs)
+                    # activated after the dummy measurements, c.f. get_traces
+                    self.rapid_block = True
             _logger.info("Scope correctly initialized.")
         except BaseException:
             _logger.info("ERROR: Problem initializing scope: ", sys.exc_info()[0])
@@ -305,11 +342,11 @@ class Measurement(object):
         :return:
         """
 
-        if "PicoScope 6" in self.scope_type:
+        if "PicoScope 6" in self.scope_type and not self.segmented:
             # make sure that pretrigger is only used for negative trigger delays
             pretriggerTime = max(0, -self.trigger_delay)
             self.scope.runBlock(pretriggerTime)
-        elif "Keysight 254A" in self.scope_type:
+        elif "Keysight 254A" in self.scope_type or "PicoScope 6" in self.scope_type:
 
             if (self.segment_counter == 0) or (self.segment_counter == self.num_segs):
                 # initialize the acquisition of different segments
@@ -330,10 +367,15 @@ class Measurement(object):
                 self.num_segs = min(N_remaining_ingroup, max_segs)
                 # make sure to measure only multiples of the repetitions
                 self.num_segs = self.num_segs - (self.num_segs % self.N_repetitions)
-                # set acquisition mode to segmented mode and switch off interpolation, chose maximum number of segments
-                self.scope.set_acquisition(interpolation=0, acquisition_mode="SEGM", num_segments=self.num_segs)
-                # clear display and registers and start single (polling) acquisition
-                self.scope.clear_and_start_single()
+                if "PicoScope 6" in self.scope_type:
+                    # rapid block mode: divide the memory into segments and arm the scope for all of them
+                    self.scope.setRapidBlock(self.num_segs)
+                    self.scope.runBlock(max(0, -self.trigger_delay))
+                else:
+                    # set acquisition mode to segmented mode and switch off interpolation, chose maximum number of segments
+                    self.scope.set_acquisition(interpolation=0, acquisition_mode="SEGM", num_segments=self.num_segs)
+                    # clear display and registers and start single (polling) acquisition
+                    self.scope.clear_and_start_single()
 
                 # insert short delay
                 time.sleep(jsonutils.json_try_access(self.config, ["msmt", "delay [s]"], default=0))
@@ -351,9 +393,19 @@ class Measurement(object):
         :param channel:
         :return:
         """
-        if "PicoScope 6" in self.scope_type:
+        if "PicoScope 6" in self.scope_type and not self.segmented:
             self.scope.waitReady()
             data, t_samples, test = self.scope.getDataRaw(self.config["scope"]["channel%i" % channel]["channel"], self.scope.noSamples)
+        elif "PicoScope 6" in self.scope_type:
+            # rapid block mode: retrieve data of all segments after the last segment
+            if self.segment_counter == self.num_segs:
+                self.scope.waitReady()
+                data, t_samples, overflow = self.scope.getDataRawBulk(self.config["scope"]["channel%i" % channel]["channel"])
+                # segments are ordered by trace and repetition: reshape to 1st dim=traces, 2nd=samples, 3rd=repetitions
+                # (copy, as the buffers of the scope are overwritten by the next acquisition)
+                data = np.array(np.reshape(data, (int(self.num_segs / self.N_repetitions), self.N_repetitions, -1)).transpose(0, 2, 1))
+            else:
+                data = None
         elif "Keysight 254A" in self.scope_type:
             # segment mode: retrieve data only after the last segment
             if self.segment_counter == self.num_segs:
@@ -363,7 +415,12 @@ class Measurement(object):
                 if acquisition_done:
                     time.sleep(jsonutils.json_try_access(self.config, ["msmt", "delay [s]"], default=0))
                     # acquire data from scope
-                    data, t_samples, x_origin, x_increment, y_origin, y_increment = self.scope.send_data_query(max_block_size=jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "maximum blocksize"], default=10e6))
+                    max_block_size = jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "maximum blocksize"], default=10e6)
+                    if jsonutils.json_try_access(self.config, ["scope", "data_acquisition", "segmented rapid download"], default=False):
+                        # download all segments at once
+                        data, t_samples, x_origin, x_increment, y_origin, y_increment = self.scope.send_data_query_segmented(num_segments=self.num_segs, max_block_size=max_block_size)
+                    else:
+                        data, t_samples, x_origin, x_increment, y_origin, y_increment = self.scope.send_data_query(max_block_size=max_block_size)
 
                     # reshape the data such that
                     # 1st dim = samples
@@ -440,11 +497,349 @@ class Measurement(object):
             self.table.moveAbsPos(x=xPos, y=yPos, z=zPos)
         return
 
+    def convert_trace(self, data, dataset_name):
+        """
+        Convert the data retrieved from the scope to the datatype of the dataset
+        :param data: array with the samples as returned by scope_get_trace
+        :param dataset_name: name of the dataset to which the data is written
+        :return: converted data
+        """
+        # some scopes (e.g. PicoScope 6000) return int16 because certain timesampling modes need a higher
+        # resolution. However, in normal mode only 8-bit resolution is actually achieved. Hence, data space
+        # can be saved by storing only 8-bit values.
+        if data is None:
+            pass
+        elif self.config["HDF5"]["datasets"][dataset_name]["datatype"] == "int8" and data.dtype == np.int16:
+            # convert int16 to int8
+            data = datautils.convert_int16toint8(data)
+        elif self.config["HDF5"]["datasets"][dataset_name]["datatype"] == "uint8" and data.dtype != np.uint8:
+            # directly convert to uint8
+            data = datautils.convert_to_uint8(data)
+        return data
+
+    def segment_trace_indices(self, trace):
+        """
+        Indices of the traces that are contained in a segmented acquisition which is finished by 'trace'
+        :param trace: index of the last trace of the segmented acquisition
+        :return: first and last index in the dataset
+        """
+        return [int(trace - self.num_segs / self.N_repetitions + 1), trace + 1]
+
+    def store_trace(self, data, dataset_name, trace, position, repetition, trace_indices=None):
+        """
+        Write the data of a channel to the HDF5 file
+        :param data: converted data of the channel (single trace or several traces for segmented acquisition)
+        :param dataset_name: name of the dataset to which the data is written
+        :param trace: index of the trace
+        :param position: index of the measurement position (i.e. group of the HDF5 file)
+        :param repetition: index of the repetition
+        :param trace_indices: first and last index for data of several traces (default: derived from segment counter)
+        :return:
+        """
+        if data is None:
+            # do nothing
+            pass
+        elif len(data.shape) == 1:
+            # for PicoScope only a single dimension is returned
+            self.h5writer.add_data(dataset_name=dataset_name, data=data, trace_number=trace, repetition_number=repetition)
+        elif len(data.shape) > 1:
+            # if more than one trace (i.e. dimension) is returned, write it to the respective place in
+            # the dataset
+            # TODO: check whether correct indices are addressed.
+            if trace_indices is None:
+                trace_indices = self.segment_trace_indices(trace)
+            self.h5writer.add_data_multitrace(dataset_name=dataset_name, data=data, trace_indices=trace_indices, repetition_indices=[0, None])
+
+    def store_target_data(self, input_data, trigger_data, output_data, trace, position, repetition):
+        """
+        Write the data returned by the target control functions to the datasets specified in the config
+        :param input_data: list returned by load_data
+        :param trigger_data: list returned by execute_trigger
+        :param output_data: list returned by read_data
+        :param trace: index of the trace
+        :param position: index of the measurement position (i.e. group of the HDF5 file)
+        :param repetition: index of the repetition
+        :return:
+        """
+        if repetition == 0 or jsonutils.json_try_access(self.config, ["HDF5", "store_for_all_repetitions"], default=False):
+            # store data only for the first repetition
+
+            # add the different input datasets
+            for input_datasets in self.config["HDF5"]["saving"]["input_data"]:
+                if self.schedule is not None and self.config["HDF5"]["saving"]["input_data"][input_datasets] in self.schedule:
+                    # already written with the input schedule
+                    continue
+                self.h5writer.add_data(dataset_name=self.config["HDF5"]["saving"]["input_data"][input_datasets], data=input_data[int(input_datasets)], trace_number=trace, repetition_number=repetition)
+            # add the different trigger datasets
+            for trigger_datasets in self.config["HDF5"]["saving"]["trigger_data"]:
+                self.h5writer.add_data(dataset_name=self.config["HDF5"]["saving"]["trigger_data"][trigger_datasets], data=trigger_data[int(trigger_datasets)], trace_number=trace, repetition_number=repetition)
+
+            # add the different output datasets
+            for output_datasets in self.config["HDF5"]["saving"]["output_data"]:
+                self.h5writer.add_data(dataset_name=self.config["HDF5"]["saving"]["output_data"][output_datasets], data=output_data[int(output_datasets)], trace_number=trace, repetition_number=repetition)
+
+    def acquire_position(self, position, diff_datasets):
+        """
+        Acquire all traces for a single measurement position, one step after another. If prefetching is enabled, the
+        input of the next trace is prepared on the target while the waveform of the last repetition is retrieved.
+        :param position: index of the measurement position (i.e. group of the HDF5 file)
+        :param diff_datasets: list with channel and dataset string (c.f. HDF5utils.hdf5_add_group)
+        :return:
+        """
+        if self.prefetch:
+            trigger = self.target.trigger
+            self.target.prepare(config=self.config, trace=0)
+        else:
+            trigger = self.target.execute_trigger
+
+        for trace in range(0, self.N_traces):
+            _logger.info("Measurement: %i / %i" % (trace + 1, self.N_traces))
+
+            if self.prefetch:
+                # the input was prepared during the readout of the previous trace
+                input_data = self.target.commit()
+            else:
+                # load data to the target
+                input_data = self.target.load_data(self.config, trace)
+            # whether the input of the next trace is being prepared
+            prepared = False
+
+            for repetition in range(0, self.N_repetitions):
+                _logger.debug("Repetition: %i / %i" % (repetition + 1, self.N_repetitions))
+                # activate the scope and add short delay, s.t. the trigger is armed
+                self.scope_run()
+                time.sleep(self.config["msmt"]["delay [s]"])
+
+                # set the key on the target
+                trigger_data = trigger(config=self.config, trace=trace, repetition=repetition)
+                # get measurements
+
+                # read back data from device
+                output_data = self.target.read_data(config=self.config, trace=trace)
+
+                if self.prefetch and repetition == self.N_repetitions - 1 and trace + 1 < self.N_traces:
+                    # prepare the next trace while the waveforms are retrieved
+                    self.target.prepare(config=self.config, trace=trace + 1)
+                    prepared = True
+
+                # update number of measurements done
+                self.N_done = self.N_done + 1
+
+                # add the measurements from different channels
+                for channel in diff_datasets:
+                    # check if trigger is exceeded or not and repeat measurement if necessary
+                    trigger_exceeded = True
+                    while trigger_exceeded:
+                        # measure time until measurement is finished
+                        t_start = time.time()
+                        data = self.scope_get_trace(channel=channel[0])
+                        t_end = time.time()
+                        trigger_time = int(np.around(t_end - t_start))
+                        # check if measured time is near the defined trigger timeout
+                        if trigger_time >= jsonutils.json_try_access(self.config, ["scope", "trigger", "timeout [s]"]):
+                            _logger.warning("Trigger exceeded and not recognized! Try to repeat measurement %i with repetition %i" % (trace + 1, repetition + 1))
+                            if prepared:
+                                # the input of the next trace is already loaded, restore the input of the current trace
+                                self.target.commit()
+                                input_data = self.target.load_data(self.config, trace)
+                            self.scope_run()
+                            # reset the key on the target
+                            trigger_data = trigger(config=self.config, trace=trace, repetition=repetition)
+                            # read back data from device
+                            output_data = self.target.read_data(config=self.config, trace=trace)
+                            if prepared:
+                                self.target.prepare(config=self.config, trace=trace + 1)
+                        else:
+                            trigger_exceeded = False
+
+                    data = self.convert_trace(data=data, dataset_name=channel[1])
+                    self.store_trace(data=data, dataset_name=channel[1], trace=trace, position=position, repetition=repetition)
+
+                # add the input, output and trigger data
+                self.store_target_data(input_data=input_data, trigger_data=trigger_data, output_data=output_data, trace=trace, position=position, repetition=repetition)
+
+    def acquire_position_pipelined(self, position, diff_datasets):
+        """
+        Acquire all traces for a single measurement position in a pipelined fashion. The target communication is done
+        in the calling thread, while the scope readout and the storing to the HDF5 file are done in separate threads
+        connected by bounded queues. I.e., the input of the next trace is loaded to the target while the waveform of the
+        previous trace is downloaded, and the HDF5 file is written in the background.
+        The scope is only re-armed after the readout of the previous capture is finished. If a trigger is lost, the
+        capture is repeated. In case the input of the next trace has already been loaded, load_data is called again for
+        the repeated trace (i.e. targets that draw random inputs in load_data provide a new input).
+        :param position: index of the measurement position (i.e. group of the HDF5 file)
+        :param diff_datasets: list with channel and dataset string (c.f. HDF5utils.hdf5_add_group)
+        :return:
+        """
+        # a single capture can be pending at the scope, the writer may lag behind by the specified queue depth
+        readout_queue = queue.Queue(maxsize=1)
+        result_queue = queue.Queue(maxsize=1)
+        write_queue = queue.Queue(maxsize=max(1, int(jsonutils.json_try_access(self.config, ["msmt", "pipeline queue depth"], default=16))))
+        # exceptions raised in the threads are handed over to the calling thread
+        errors = list()
+
+        readout_thread = threading.Thread(target=self.pipeline_readout, args=(readout_queue, result_queue, write_queue, diff_datasets, errors), daemon=True)
+        writer_thread = threading.Thread(target=self.pipeline_writer, args=(write_queue, position, errors), daemon=True)
+        readout_thread.start()
+        writer_thread.start()
+
+        try:
+            # capture whose readout has not been confirmed yet
+            pending = None
+            for trace in range(0, self.N_traces):
+                _logger.info("Measurement: %i / %i" % (trace + 1, self.N_traces))
+
+                # load data to the target (overlaps with the readout of the previous trace)
+                input_data = self.target.load_data(self.config, trace)
+
+                for repetition in range(0, self.N_repetitions):
+                    _logger.debug("Repetition: %i / %i" % (repetition + 1, self.N_repetitions))
+                    # the scope can only be armed again after the previous capture has been read out
+                    if self.pipeline_sync(readout_queue, result_queue, pending, trace, errors):
+                        # the target was reloaded in order to repeat the previous trace, restore the current input
+                        input_data = self.target.load_data(self.config, trace)
+
+                    pending = self.pipeline_capture(readout_queue, trace, repetition, input_data)
+
+                    # update number of measurements done
+                    self.N_done = self.N_done + 1
+
+            # wait for the last capture
+            if pending is not None:
+                self.pipeline_sync(readout_queue, result_queue, pending, pending[0], errors)
+        finally:
+            # stop the readout and, after all remaining data is written, the writer
+            readout_queue.put(None)
+            readout_thread.join()
+            write_queue.put(None)
+            writer_thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def pipeline_capture(self, readout_queue, trace, repetition, input_data):
+        """
+        Arm the scope, execute the operation on the target and hand over the capture to the readout thread
+        :param readout_queue: queue to the readout thread
+        :param trace: index of the trace
+        :param repetition: index of the repetition
+        :param input_data: list returned by load_data
+        :return: capture, i.e. [trace, repetition, input_data, trigger_data, output_data]
+        """
+        # activate the scope and add short delay, s.t. the trigger is armed
+        self.scope_run()
+        time.sleep(self.config["msmt"]["delay [s]"])
+
+        # set the key on the target
+        trigger_data = self.target.execute_trigger(config=self.config, trace=trace, repetition=repetition)
+
+        # read back data from device
+        output_data = self.target.read_data(config=self.config, trace=trace)
+
+        capture = [trace, repetition, input_data, trigger_data, output_data]
+        readout_queue.put(capture)
+        return capture
+
+    def pipeline_sync(self, readout_queue, result_queue, pending, trace, errors):
+        """
+        Wait until the readout of the pending capture is finished. Captures with a lost trigger are repeated.
+        :param readout_queue: queue to the readout thread
+        :param result_queue: queue from the readout thread, reports whether the readout was successful
+        :param pending: capture that is currently read out (None if no capture is pending)
+        :param trace: index of the trace whose input is currently loaded to the target
+        :param errors: list with exceptions raised in the readout and writer thread
+        :return: reloaded: flag, whether load_data was called in order to repeat a previous trace
+        """
+        reloaded = False
+        while pending is not None:
+            success = result_queue.get()
+            if len(errors) > 0:
+                raise errors[0]
+            if success:
+                break
+
+            _logger.warning("Trigger exceeded and not recognized! Try to repeat measurement %i with repetition %i" % (pending[0] + 1, pending[1] + 1))
+            input_data = pending[2]
+            if pending[0] != trace:
+                # the input of the next trace is already loaded to the target
+                input_data = self.target.load_data(self.config, pending[0])
+                reloaded = True
+            pending = self.pipeline_capture(readout_queue, pending[0], pending[1], input_data)
+        return reloaded
+
+    def pipeline_readout(self, readout_queue, result_queue, write_queue, diff_datasets, errors):
+        """
+        Readout thread: retrieves the data of all channels for each capture and hands it over to the writer thread
+        :param readout_queue: queue with the captures, 'None' stops the thread
+        :param result_queue: queue to report whether the readout was successful (False if the trigger was lost)
+        :param write_queue: queue to the writer thread
+        :param diff_datasets: list with channel and dataset string (c.f. HDF5utils.hdf5_add_group)
+        :param errors: list to hand over exceptions to the calling thread
+        :return:
+        """
+        timeout = jsonutils.json_try_access(self.config, ["scope", "trigger", "timeout [s]"])
+        while True:
+            capture = readout_queue.get()
+            if capture is None:
+                break
+            try:
+                channel_data = list()
+                success = True
+                for channel in diff_datasets:
+                    # measure time until measurement is finished
+                    t_start = time.time()
+                    data = self.scope_get_trace(channel=channel[0])
+                    t_end = time.time()
+                    # check if measured time is near the defined trigger timeout
+                    if int(np.around(t_end - t_start)) >= timeout:
+                        success = False
+                        break
+                    data = self.convert_trace(data=data, dataset_name=channel[1])
+                    if data is not None and data.base is not None:
+                        # views on the buffers of the scope are overwritten by the next acquisition
+                        data = data.copy()
+                    trace_indices = None
+                    if data is not None and len(data.shape) > 1:
+                        # the segment counter is updated with the next capture, i.e. the indices are determined here
+                        trace_indices = self.segment_trace_indices(capture[0])
+                    channel_data.append([channel[1], data, trace_indices])
+                if success:
+                    write_queue.put([capture, channel_data])
+            except BaseException as e:
+                errors.append(e)
+                success = False
+            result_queue.put(success)
+
+    def pipeline_writer(self, write_queue, position, errors):
+        """
+        Writer thread: stores the channel data and the data of the target control functions to the HDF5 file
+        :param write_queue: queue with captures and channel data, 'None' stops the thread
+        :param position: index of the measurement position (i.e. group of the HDF5 file)
+        :param errors: list to hand over exceptions to the calling thread
+        :return:
+        """
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            if len(errors) > 0:
+                # keep on emptying the queue such that the readout thread is not blocked
+                continue
+            try:
+                capture, channel_data = item
+                trace, repetition, input_data, trigger_data, output_data = capture
+                for dataset_name, data, trace_indices in channel_data:
+                    self.store_trace(data=data, dataset_name=dataset_name, trace=trace, position=position, repetition=repetition, trace_indices=trace_indices)
+                self.store_target_data(input_data=input_data, trigger_data=trigger_data, output_data=output_data, trace=trace, position=position, repetition=repetition)
+            except BaseException as e:
+                errors.append(e)
+
     def get_traces(self):  # noqa: C901
         self.N_traces = int(jsonutils.json_try_access(self.config, ["msmt", "number of traces"], default=0))
         self.N_dummy = int(jsonutils.json_try_access(self.config, ["msmt", "number of dummy traces"], default=0))
         self.N_repetitions = int(jsonutils.json_try_access(self.config, ["msmt", "repetitions"], default=1))
         self.dummytime = int(jsonutils.json_try_access(self.config, ["msmt", "dummy time [s]"], default=0))
+        self.pipelined = jsonutils.json_try_access(self.config, ["msmt", "pipelined"], default=False)
 
         # Determine number of different positions
         self.N_positions = len(self.x)
@@ -455,6 +850,9 @@ class Measurement(object):
         # counter of the traces that have been acquired so far
         self.N_done = 0
 
+        # inputs that are precomputed by the target are written in bulk for each position
+        self.schedule = self.target.provide_schedule(config=self.config, N_traces=self.N_traces)
+
         # Setup scope and wait
         # Done here since the first trigger is often lost with PicoScopes. Could be avoided if someone has a smart idea.
         self.scope_run()
@@ -493,98 +891,44 @@ class Measurement(object):
 
                 _logger.info("Dummy measurements finished...")
 
+            if self.rapid_block:
+                # switch to the rapid block mode after the dummy measurements, the first scope_run arms all segments
+                _logger.info("Using rapid block mode with up to %i segments." % self.max_segments)
+                self.segmented = True
+                self.segment_counter = 0
+
+        # number of traces that are written at once, a value of 1 corresponds to writing each trace separately
+        write_batch_size = int(jsonutils.json_try_access(self.config, ["HDF5", "write batch size"], default=1))
+        compression = jsonutils.json_try_access(self.config, ["HDF5", "compression"], default=None)
+        if write_batch_size > 1 or compression is not None:
+            # use chunks that match the batches
+            chunk_traces = write_batch_size
+        else:
+            chunk_traces = None
+
         self.start_time = time.time()
         for position in range(0, self.N_positions):
             if self.N_positions > 1:
                 _logger.info("Position %i / %i: (x,y) = (%.2f,%.2f)" % (position + 1, self.N_positions, self.x[position], self.y[position]))
 
             # add group for meaurements
-            self.h5filehandle, diff_datasets = h5utils.hdf5_add_group(h5filehandle=self.h5filehandle, configfile=self.config, N_traces=self.N_traces, noSamples=self.scope.noSamples, group=position, N_repetitions=self.N_repetitions, x=self.x[position], y=self.y[position], z=self.z)
+            self.h5filehandle, diff_datasets = h5utils.hdf5_add_group(h5filehandle=self.h5filehandle, configfile=self.config, N_traces=self.N_traces, noSamples=self.scope.noSamples, group=position, N_repetitions=self.N_repetitions, x=self.x[position], y=self.y[position], z=self.z, chunk_traces=chunk_traces, compression=compression)
+            if self.schedule is not None:
+                self.schedule.write(self.h5filehandle["%.4i" % position])
+            # collect the traces and write them in batches
+            self.h5writer = HDF5writer(h5filehandle=self.h5filehandle, group=position, batch_size=write_batch_size)
 
             # move the table
             self.table_move(position=position)
 
-            for trace in range(0, self.N_traces):
-                _logger.info("Measurement: %i / %i" % (trace + 1, self.N_traces))
-
-                # load data to the target
-                input_data = self.target.load_data(self.config, trace)
-
-                for repetition in range(0, self.N_repetitions):
-                    _logger.debug("Repetition: %i / %i" % (repetition + 1, self.N_repetitions))
-                    # activate the scope and add short delay, s.t. the trigger is armed
-                    self.scope_run()
-                    time.sleep(self.config["msmt"]["delay [s]"])
-
-                    # set the key on the target
-                    trigger_data = self.target.execute_trigger(config=self.config, trace=trace, repetition=repetition)
-                    # get measurements
-
-                    # read back data from device
-                    output_data = self.target.read_data(config=self.config, trace=trace)
-
-                    # update number of measurements done
-                    self.N_done = self.N_done + 1
+            if self.pipelined:
+                # overlap target communication, scope readout and storing of the data
+                self.acquire_position_pipelined(position=position, diff_datasets=diff_datasets)
+            else:
+                self.acquire_position(position=position, diff_datasets=diff_datasets)
 
-                    # add the measurements from different channels
-                    for channel in diff_datasets:
-                        # check if trigger is exceeded or not and repeat measurement if necessary
-                        trigger_exceeded = True
-                        while trigger_exceeded:
-                            # measure time until measurement is finished
-                            t_start = time.time()
-                            data = self.scope_get_trace(channel=channel[0])
-                            t_end = time.time()
-                            trigger_time = int(np.around(t_end - t_start))
-                            # check if measured time is near the defined trigger timeout
-                            if trigger_time >= jsonutils.json_try_access(self.config, ["scope", "trigger", "timeout [s]"]):
-                                _logger.warning("Trigger exceeded and not recognized! Try to repeat measurement %i with repetition %i" % (trace + 1, repetition + 1))
-                                self.scope_run()
-                                # reset the key on the target
-                                trigger_data = self.target.execute_trigger(config=self.config, trace=trace, repetition=repetition)
-                                # read back data from device
-                                output_data = self.target.read_data(config=self.config, trace=trace)
-                            else:
-                                trigger_exceeded = False
-
-                        # some scopes (e.g. PicoScope 6000) return int16 because certain timesampling modes need a higher
-                        # resolution. However, in normal mode only 8-bit resolution is actually achieved. Hence, data space
-                        # can be saved by storing only 8-bit values.
-                        if data is None:
-                            pass
-                        elif self.config["HDF5"]["datasets"][channel[1]]["datatype"] == "int8" and data.dtype == np.int16:
-                            # convert int16 to int8
-                            data = datautils.convert_int16toint8(data)
-                        elif self.config["HDF5"]["datasets"][channel[1]]["datatype"] == "uint8" and data.dtype != np.uint8:
-                            # directly convert to uint8
-                            data = datautils.convert_to_uint8(data)
-
-                        if data is None:
-                            # do nothing
-                            pass
-                        elif len(data.shape) == 1:
-                            # for PicoScope only a single dimension is returned
-                            self.h5filehandle = h5utils.hdf5_add_data(self.h5filehandle, channel[1], data, trace, position, repetition)
-                        elif len(data.shape) > 1:
-                            # if more than one trace (i.e. dimension) is returned, write it to the respective place in
-                            # the dataset
-                            # TODO: check whether correct indices are addressed.
-                            self.h5filehandle = h5utils.hdf5_add_data_multitrace(h5filehandle=self.h5filehandle, dataset_name=channel[1], data=data, trace_indices=[int(trace - self.num_segs / self.N_repetitions + 1), trace + 1], group=position, repetition_indices=[0, None])
-
-                    # add the input, output and trigger data
-                    if repetition == 0 or jsonutils.json_try_access(self.config, ["HDF5", "store_for_all_repetitions"], default=False):
-                        # store data only for the first repetition
-
-                        # add the different input datasets
-                        for input_datasets in self.config["HDF5"]["saving"]["input_data"]:
-                            self.h5filehandle = h5utils.hdf5_add_data(h5filehandle=self.h5filehandle, dataset_name=self.config["HDF5"]["saving"]["input_data"][input_datasets], data=input_data[int(input_datasets)], trace_number=trace, group=position, repetition_number=repetition)
-                        # add the different trigger datasets
-                        for trigger_datasets in self.config["HDF5"]["saving"]["trigger_data"]:
-                            self.h5filehandle = h5utils.hdf5_add_data(h5filehandle=self.h5filehandle, dataset_name=self.config["HDF5"]["saving"]["trigger_data"][trigger_datasets], data=trigger_data[int(trigger_datasets)], trace_number=trace, group=position, repetition_number=repetition)
-
-                        # add the different output datasets
-                        for output_datasets in self.config["HDF5"]["saving"]["output_data"]:
-                            self.h5filehandle = h5utils.hdf5_add_data(h5filehandle=self.h5filehandle, dataset_name=self.config["HDF5"]["saving"]["output_data"][output_datasets], data=output_data[int(output_datasets)], trace_number=trace, group=position, repetition_number=repetition)
+            # write the remaining traces of the position
+            self.h5writer.flush()
 
         end_time = time.time()
 
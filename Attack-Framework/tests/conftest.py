@@ -0,0 +1,5 @@
+import os
+import sys
+
+# make the attack package importable without installing the framework
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+import sys
+import h5py
+import numpy as np
+import pytest
+from scripts.processing import average_fixedinput
+
+
+@pytest.fixture
+def inputfile(tmp_path):
+    rng = np.random.default_rng(0)
+    plaintext = rng.integers(0, 2, (24, 16, 1)).astype(np.uint8)
+    plaintext[::3] = 7
+    with h5py.File(tmp_path / "input.hdf5", "w") as handle:
+        group = handle.create_group("0000")
+        group.create_dataset("samples", data=rng.integers(0, 255, (24, 50, 1)).astype(np.uint8), chunks=(4, 50, 1))
+        group.create_dataset("plaintext", data=plaintext, chunks=(4, 16, 1))
+        group.create_dataset("key", data=np.tile(np.arange(16, dtype=np.uint8), (24, 1))[:, :, np.newaxis], chunks=(8, 16, 1))
+    return tmp_path / "input.hdf5"
+
+
+def run(monkeypatch, inputfile, outputfile, *args):
+    monkeypatch.setattr(sys, "argv", ["average_fixedinput.py", "-i", str(inputfile), "-o", str(outputfile), "--block-size", "6"] + list(args))
+    average_fixedinput.main()
+    with h5py.File(inputfile, "r") as handle, h5py.File(outputfile, "r") as handle_out:
+        return {name: handle["0000"][name][()] for name in handle["0000"]}, {name: handle_out["0000"][name][()] for name in handle_out["0000"]}
+
+
+def test_average_all(monkeypatch, tmp_path, inputfile):
+    data, averaged = run(monkeypatch, inputfile, tmp_path / "all.hdf5")
+    assert np.allclose(averaged["samples"], np.mean(data["samples"], axis=0, keepdims=True))
+    assert np.array_equal(averaged["plaintext"], data["plaintext"][[0]])
+    assert np.array_equal(averaged["key"], data["key"][[0]])
+
+
+def test_average_reference(monkeypatch, tmp_path, inputfile):
+    data, averaged = run(monkeypatch, inputfile, tmp_path / "fixed.hdf5", "--reference_dataset", "plaintext", "--reference_value", *(["7"] * 16))
+    assert np.allclose(averaged["samples"], np.mean(data["samples"][::3], axis=0, keepdims=True))
+    assert np.array_equal(averaged["plaintext"], data["plaintext"][[0]])
@@ -0,0 +1,54 @@
+import h5py
+import numpy as np
+import pytest
+from attack.helper.utils import HDF5utils, TraceStore
+
+
+@pytest.fixture
+def source(tmp_path):
+    data = np.random.default_rng(0).integers(0, 255, (20, 30, 3)).astype(np.uint8)
+    with h5py.File(tmp_path / "source.h5", "w") as handle:
+        handle.create_dataset("chunked", data=data, chunks=(4, 30, 3), compression="gzip")
+        handle.create_dataset("contiguous", data=data)
+    with h5py.File(tmp_path / "source.h5", "r") as handle:
+        yield handle, data
+
+
+@pytest.mark.parametrize("dset_name", ["chunked", "contiguous"])
+@pytest.mark.parametrize(
+    "selection",
+    [
+        dict(),
+        dict(trace_select=slice(4, 12)),
+        dict(trace_select=[4]),
+        dict(trace_select=slice(0, 3)),
+        dict(trace_select=[0, 0, 2, 3]),
+        dict(trace_select=[0, 2, 1, 3] + list(range(4, 20))),
+        dict(trace_select=[19, 3, 7, 0], block_size=1),
+        dict(sample_select=[3, 5, 4, 6]),
+        dict(repetititon_select=[2, 1, 0]),
+        dict(trace_select=[4, 5, 6, 7], sample_select=slice(2, 9), repetititon_select=[0, 2]),
+    ],
+)
+def test_copy_dataset(tmp_path, source, dset_name, selection):
+    handle, data = source
+    with h5py.File(tmp_path / "copy.h5", "w") as handle_out:
+        HDF5utils.copy_dataset(handle[dset_name], handle_out, dset_name, **selection)
+        copied = handle_out[dset_name][()]
+    traces = HDF5utils.hdf5_get_selection(selection.get("trace_select"), data.shape[0])
+    samples = HDF5utils.hdf5_get_selection(selection.get("sample_select"), data.shape[1])
+    repetitions = HDF5utils.hdf5_get_selection(selection.get("repetititon_select"), data.shape[2])
+    assert np.array_equal(copied, data[traces][:, samples][:, :, repetitions])
+
+
+def test_tracestore_writable(tmp_path):
+    data = np.arange(60, dtype=np.int16).reshape((4, 15, 1))
+    with h5py.File(tmp_path / "writable.h5", "w") as handle:
+        dset = handle.create_dataset("samples", data=data)
+        handle.flush()
+        dset[0] = -7
+        assert np.all(TraceStore(dset)[0] == -7)
+    with h5py.File(tmp_path / "writable.h5", "r") as handle:
+        store = TraceStore(handle["samples"])
+        assert store.mmap is not None
+        assert np.all(store[0] == -7) and np.array_equal(store[1:], data[1:])
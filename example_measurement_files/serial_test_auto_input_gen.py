@@ -8,82 +8,102 @@ warnings.filterwarnings("ignore", message="overflow encountered ")
 byteorder="little"
 
 class wishbone:
-	def __init__(self, port="/dev/ttyUSB1", baudrate=9216):
-		self.uart = serial.Serial(port, baudrate, timeout=1, parity="E")
+	# the length field of the multiple commands is a single byte
+	MAX_BURST = 255
+	CMD_READ = 0x0
+	CMD_WRITE = 0x1
+	CMD_READ_MULTIPLE = 0x2
+	CMD_WRITE_MULTIPLE = 0x3
+
+	# bits per byte on the line: start, 8 data, parity and stop bit
+	BITS_PER_BYTE = 11
+
+	def __init__(self, port="/dev/ttyUSB1", baudrate=9216, timeout=1):
+		# the read timeout of a transfer is extended by the time the request and the response need on the line
+		self.timeout = timeout
+		self.uart = serial.Serial(port, baudrate, timeout=timeout, parity="E")
 		self.uart.reset_input_buffer()
 		self.uart.reset_output_buffer()
+		# frames of posted writes that are sent with the next request, and their expected acks
+		self.pending = bytearray()
+		self.pending_acks = bytearray()
 		print("The UART on " + self.uart.name + " is open.")
 		print("The wishbone bus is ready.\n")
 
-	def read(self,addr):
-		cmd = 0x0
-		cmd = cmd.to_bytes(1,byteorder)
-		self.uart.write(cmd)
-		addr = addr.to_bytes(4,byteorder)
-		self.uart.write(addr)
-		rbytes=self.uart.read(1)
-		rbytes=self.uart.read(4)
-		drd=int.from_bytes(rbytes,byteorder)
+	def frame(self, cmd, addr, length=None, data=None):
+		# command, address (and length) in the byte order of the bridge, followed by the payload words
+		frame = cmd.to_bytes(1, byteorder) + int(addr).to_bytes(4, byteorder)
+		if length is not None:
+			frame += int(length).to_bytes(1, byteorder)
+		if data is not None:
+			frame += data.astype("<u4" if byteorder == "little" else ">u4").tobytes()
+		return frame
+
+	def post(self, cmd, frame):
+		self.pending += frame
+		self.pending_acks += cmd.to_bytes(1, byteorder)
+
+	def transfer(self, frame=b"", response_length=0):
+		# the posted writes and the request are sent with one write, their acks are read together with the response.
+		# the bridge sends the ack of a write in the background, i.e. write frames can follow each other directly.
+		request = bytes(self.pending) + frame
+		acks = bytes(self.pending_acks)
+		self.pending = bytearray()
+		self.pending_acks = bytearray()
+		self.uart.write(request)
+		self.uart.timeout = self.timeout + self.BITS_PER_BYTE * (len(request) + len(acks) + response_length) / self.uart.baudrate
+		rbytes = self.uart.read(len(acks) + response_length)
+		if len(rbytes) != len(acks) + response_length:
+			raise IOError("Timeout of the wishbone bridge: received %i of %i bytes." % (len(rbytes), len(acks) + response_length))
+		if rbytes[: len(acks)] != acks:
+			warnings.warn("Invalid acknowledge from the wishbone bridge.")
+		# the response starts with the command of the request
+		if response_length > 0 and rbytes[len(acks)] != frame[0]:
+			raise IOError("Invalid response of the wishbone bridge: status 0x%02x for command 0x%02x." % (rbytes[len(acks)], frame[0]))
+		return rbytes[len(acks) :]
+
+	def flush(self):
+		# send the posted writes and wait for their acks
+		if len(self.pending) > 0:
+			self.transfer()
+
+	def read(self, addr):
+		rbytes = self.transfer(self.frame(self.CMD_READ, addr), 5)
+		drd = int.from_bytes(rbytes[1:5], byteorder)
 		return drd
 
-	def write(self, addr, data):
-		cmd = 0x1
-		cmd = cmd.to_bytes(1,byteorder)
-		self.uart.write(cmd)
-		addr = addr.to_bytes(4,byteorder)
-		self.uart.write(addr)
-		data = data.to_bytes(4,byteorder)
-		self.uart.write(data)
-		rbytes=self.uart.read(1)
+	def write(self, addr, data, posted=False):
+		self.post(self.CMD_WRITE, self.frame(self.CMD_WRITE, addr, data=np.array([data], dtype=np.uint32)))
+		if not posted:
+			self.flush()
+
+	def read_words(self, addr, lenwords, dtype):
+		# one request (and response) per burst, the bridge does not receive while it sends the read data
+		drd = np.zeros(lenwords, dtype=np.uint32)
+		for first in range(0, lenwords, self.MAX_BURST):
+			n = min(self.MAX_BURST, lenwords - first)
+			rbytes = self.transfer(self.frame(self.CMD_READ_MULTIPLE, addr + first, length=n), 1 + 4 * n)
+			words = np.frombuffer(rbytes[1:], dtype=dtype)
+			drd[first : first + len(words)] = words
+		return drd
 
 	def read_multiple_big(self, addr, lenwords):
-		cmd = 0x2
-		cmd = cmd.to_bytes(1, byteorder)
-		self.uart.write(cmd)
-		addr = addr.to_bytes(4, byteorder)
-		self.uart.write(addr)
-		l = lenwords.to_bytes(1, byteorder)
-		self.uart.write(l)
-		rbytes = self.uart.read(1)
-		drd = []
-		byteorder1="big"
-		for i in range(lenwords):
-			rbytes = self.uart.read(4)
-			drd.append(int.from_bytes(rbytes, byteorder1))
+		return self.read_words(addr, lenwords, ">u4").tolist()
 
-		return drd
-	
 	def read_multiple(self, addr, lenwords):
-		cmd = 0x2
-		cmd = cmd.to_bytes(1, byteorder)
-		self.uart.write(cmd)
-		addr = addr.to_bytes(4, byteorder)
-		self.uart.write(addr)
-		l = lenwords.to_bytes(1, byteorder)
-		self.uart.write(l)
-		rbytes = self.uart.read(1)
-		drd = []
-		for i in range(lenwords):
-			rbytes = self.uart.read(4)
-			drd.append(int.from_bytes(rbytes, byteorder))
-
-		return drd
-
-	def write_multiple(self, addr, data):
-		cmd = 0x3
-		cmd = cmd.to_bytes(1, byteorder)
-		self.uart.write(cmd)
-		addr = addr.to_bytes(4, byteorder)
-		self.uart.write(addr)
-		l = len(data).to_bytes(1, byteorder)
-		self.uart.write(l)
-		for d in data:
-			d = d.to_bytes(4, byteorder)
-			self.uart.write(d)
+		return self.read_words(addr, lenwords, "<u4" if byteorder == "little" else ">u4").tolist()
 
-		rbytes=self.uart.read(1)
+	def write_multiple(self, addr, data, posted=False):
+		# vectorized payload, bursts longer than the length field are split into several frames of one write
+		data = np.asarray(data, dtype=np.uint32).reshape(-1)
+		for first in range(0, len(data), self.MAX_BURST):
+			burst = data[first : first + self.MAX_BURST]
+			self.post(self.CMD_WRITE_MULTIPLE, self.frame(self.CMD_WRITE_MULTIPLE, addr + first, length=len(burst), data=burst))
+		if not posted:
+			self.flush()
 
 	def close(self):
+		self.flush()
 		self.uart.close()
 
 
@@ -97,20 +117,13 @@ if __name__ == '__main__':
 	for i in range(0, n_tests):
 		data = rng.integers(0, 2**32-1, n_data, dtype=np.uint32)
 
-		write_data = []
-		dr = []
-		for i in range(0, len(data)):
-			write_data.append(data[i].item())
-			wb.write_multiple(0x50000000 + i, [write_data[i]])
+		wb.write_multiple(0x50000000, data)
 
 		data = rng.integers(0, 2**32-1, n_data, dtype=np.uint32)
 
-		write_data = []
-		dr = []
-		for i in range(0, len(data)):
-			write_data.append(data[i].item())
-			wb.write_multiple(0x60000000 + i, [write_data[i]])
-			dr.append(wb.read_multiple_big(0x60000000 + i, 1)[0])
+		write_data = data.tolist()
+		wb.write_multiple(0x60000000, data, posted=True)
+		dr = wb.read_multiple_big(0x60000000, n_data)
 
 		if not np.allclose(write_data, dr):
 			err += 1
@@ -139,9 +152,7 @@ if __name__ == '__main__':
 		
 		wb.write(0x20000000, 1)
 
-		dr = []
-		for i in range(0, n_data):
-			dr.append(wb.read_multiple_big(0x60000000 + i, 1)[0])
+		dr = wb.read_multiple_big(0x60000000, n_data)
 		for i in dr:
 			print(i & 0x000000ff)
 			print((i >> 8) & 0x000000ff)
@@ -152,9 +163,7 @@ if __name__ == '__main__':
 		wb.write(0x20000000, 1)
 
 
-		dr = []
-		for i in range(0, n_data):
-			dr.append(wb.read_multiple_big(0x60000000 + i, 1)[0])
+		dr = wb.read_multiple_big(0x60000000, n_data)
 		for i in dr:
 			print(i & 0x000000ff)
 			print((i >> 8) & 0x000000ff)
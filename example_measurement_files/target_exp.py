@@ -3,11 +3,11 @@ import serial
 import sys
 import numpy as np
 import time
-import random
 
 from attack.targets.CW305 import CW305
 from attack.targets.TargetBase import _TargetBase
 from attack.helper.utils import JSONutils as jsonutils
+from attack.helper.utils import InputSchedule
 from serial_test_auto_input_gen import wishbone
 
 
@@ -59,6 +59,7 @@ class TargetControl(_TargetBase):
             self.rng = np.random.default_rng()
 
         self.byteorder = "little"
+        self.schedule = None
         self.lut_size = 8
         return
 
@@ -206,6 +207,29 @@ class TargetControl(_TargetBase):
         info = ""
         return info
 
+    def provide_schedule(self, config=[], N_traces=0):
+        """
+        Precompute the inputs of all traces. The first trace and about half of the other traces (class 0) use the fixed
+        input, the other traces (class 1) a random input. The input is masked with a random value.
+        :param config: dictionary with the configuration details
+        :param N_traces: number of traces per measurement position
+        :return: InputSchedule
+        """
+        self.schedule = InputSchedule(
+            N_traces, seed=jsonutils.json_try_access(config, ["experiment", "prng seed"], default=None)
+        )
+        labels = self.schedule.add("class", self.schedule.class_labels(first=0))
+        random_input = self.schedule.integers(0, self.lut_size, endpoint=True)
+        input = self.schedule.add("input", self.schedule.select(labels, [7, random_input]))
+        rnd = self.schedule.add("rnd", self.schedule.integers(0, self.lut_size, endpoint=True))
+        # masked input that is written to the device
+        self.schedule.add("x1", (input - rnd) & (2**8 - 1))
+        # additional randomness of the masked implementation
+        self.schedule.add("r0", self.schedule.integers(0, 16, endpoint=True))
+        self.schedule.add("r1", self.schedule.integers(0, 32, endpoint=True))
+        self.schedule.add("r2", self.schedule.integers(0, 32, endpoint=True))
+        return self.schedule
+
     # to modify  load data to fpga before measurement happens.  in my case, load input of lut. 1st trace should be with fixed input
     def load_data(self, config=[], trace=0):
         """
@@ -217,41 +241,20 @@ class TargetControl(_TargetBase):
         :return: list of different input_data
         """
 
-        if trace == 0:
-            input = 7
-            rnd = random.randint(0, self.lut_size)
-            x1 = input - rnd
-            x1 = x1 & (2**8 - 1)
-            r0 = random.randint(0, 16)
-            r1 = random.randint(0, 32)
-            r2 = random.randint(0, 32)
-            self.wb.write_multiple(0x40000000, [x1, rnd, r0, r1, r2])  # changed interface
-            
-            d = self.wb.read_multiple(0x40000000, 2)
-            if not np.allclose([x1, rnd], d):
-                logging.warning("Error loading input and rnd!")
-            else:
-                logging.info("Input and rnd loaded successfully!")
-            
+        if self.schedule is None:
+            # the measurement script did not request the schedule
+            self.provide_schedule(
+                config, int(jsonutils.json_try_access(config, ["msmt", "number of traces"], default=1))
+            )
+        input, rnd, x1, r0, r1, r2 = self.schedule.inputs(trace, ["input", "rnd", "x1", "r0", "r1", "r2"])
+        self.wb.write_multiple(0x40000000, np.concatenate([x1, rnd, r0, r1, r2]), posted=True)  # changed interface
+
+        d = self.wb.read_multiple(0x40000000, 2)
+        if not np.allclose([x1[0], rnd[0]], d):
+            logging.warning("Error loading input and rnd!")
         else:
-            random_input = random.randint(0, self.lut_size)
-            input = random.choice([7, random_input])
-            rnd = random.randint(0, self.lut_size)
-            x1 = input - rnd
-            x1 = x1 & (2**8 - 1)
-            r0 = random.randint(0, 16)
-            r1 = random.randint(0, 32)
-            r2 = random.randint(0, 32)
-            self.wb.write_multiple(0x40000000, [x1, rnd, r0, r1, r2])  # changed interface
-
-            d = self.wb.read_multiple(0x40000000, 2)
-            if not np.allclose([x1, rnd], d):
-                logging.warning("Error loading input and rnd!")
-            else:
-                logging.info("Input and rnd loaded successfully!")
-
-        input = np.array([input])
-        rnd = np.array([rnd])
+            logging.info("Input and rnd loaded successfully!")
+
         return [input, rnd]
 
     def execute_trigger(self, config=[], trace=0, repetition=0):
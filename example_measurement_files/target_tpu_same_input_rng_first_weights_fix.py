@@ -7,8 +7,9 @@ import time
 from attack.targets.CW305 import CW305
 from attack.targets.TargetBase import _TargetBase
 from attack.helper.utils import JSONutils as jsonutils
+from attack.helper.utils import InputSchedule
 from serial_test_auto_input_gen import wishbone
-from xoroshiro128plus import xoroshiro128plus
+from attack.helper.prng import Xoroshiro128Plus
 
 
 class TargetControl(_TargetBase):
@@ -61,14 +62,15 @@ class TargetControl(_TargetBase):
         self.byteorder = "little"
         self.n_data = jsonutils.json_try_access(config, ["experiment", "n_data"], default=1)
         self.weights = np.zeros(self.n_data, dtype=np.uint32)
-        r = self.rng.integers(0, 2**8, 1, dtype=np.uint32)
+        r = self.rng.integers(0, 2**8, 1, dtype=np.uint32)[0]
         for i in range(0, 4):
             self.weights[0] = self.weights[0] | (r << (i * 8))
 
         self.rng_input_seed = self.rng.integers(0, 2**64, 2, dtype=np.uint64)
         self.rng_weight_seed = np.zeros(2, dtype=np.uint64)
 
-        self.xoro_input = xoroshiro128plus(self.rng_input_seed[0], self.rng_input_seed[1])
+        self.xoro_input = Xoroshiro128Plus(self.rng_input_seed[0], self.rng_input_seed[1])
+        self.schedule = None
 
         return
 
@@ -215,6 +217,35 @@ class TargetControl(_TargetBase):
         info = ""
         return info
 
+    def provide_schedule(self, config=[], N_traces=0):
+        """
+        Precompute the inputs of all traces. The weights are fixed, the input of the first trace is loaded to the
+        device and the inputs of all further traces are generated by the input RNG of the FPGA, which is mirrored here.
+        :param config: dictionary with the configuration details
+        :param N_traces: number of traces per measurement position
+        :return: InputSchedule
+        """
+        self.schedule = InputSchedule(
+            N_traces, seed=jsonutils.json_try_access(config, ["experiment", "prng seed"], default=None)
+        )
+        self.schedule.add("weights", np.broadcast_to(self.weights, (N_traces, self.n_data)))
+
+        data = np.zeros((N_traces, self.n_data), dtype=np.uint64)
+        if N_traces > 0:
+            first = self.rng.integers(0, 2**8, self.n_data, dtype=np.uint32)
+            for i in range(1, 4):
+                first = first | (first << (i * 8))
+            data[0] = first
+        # every further trace uses the next n_data outputs of the input RNG
+        data[1:] = self.xoro_input.generate(self.n_data * max(0, N_traces - 1)).reshape((-1, self.n_data))
+        # the upper byte of the upper word is used for all bytes of an input
+        rng_data = np.right_shift(data[1:], np.uint64(32)) & 0xff000000
+        for i in range(0, 4):
+            rng_data = rng_data | (rng_data >> np.uint64(i * 8))
+        data[1:] = rng_data
+        self.schedule.add("input", data.astype(np.uint32))
+        return self.schedule
+
     def load_data(self, config=[], trace=0):
         """
         Load/modify data on the device before the next execution of the operation under attack.
@@ -225,39 +256,28 @@ class TargetControl(_TargetBase):
         :return: list of different input_data
         """
 
+        if self.schedule is None:
+            # the measurement script did not request the schedule
+            self.provide_schedule(
+                config, int(jsonutils.json_try_access(config, ["msmt", "number of traces"], default=1))
+            )
+        weights, data = self.schedule.inputs(trace, ["weights", "input"])
+
         if trace == 0:
             self.init_rngs(self.rng_input_seed, self.rng_weight_seed)
             self.load_lengths(self.n_data, self.n_data)
             self.load_weights()
-            data = self.rng.integers(0, 2**8, self.n_data, dtype=np.uint32)
-            for i in range(1, 4):
-                data = data | (data << (i * 8))
             self.load_input(data)
-            
-        else:
-            data = np.zeros(self.n_data, dtype=np.uint64)
-            data[0] = self.xoro_input.state_s0 + self.xoro_input.state_s1
-            data[1:] = self.xoro_input.random(self.n_data - 1)
-            self.xoro_input.random(1)
-            data = np.right_shift(data, np.uint64(32))
-            data.astype(np.uint32)
-            data = data & 0xff000000
-            for i in range(0, 4):
-                data = data | (data >> (i * 8))
-
-            if (trace % 100) == 0:
-                dr = []
-                for i in range(0, self.n_data):
-                    dr.append(self.wb.read_multiple_big(0x60000000 + i, 1)[0])
-                if not np.allclose(dr, data):
-                    logging.warning("Missmatch between expected data and received data.")
-                    print(data)
-                    print(dr)
-                else:
-                    logging.info("FPGA and PC data synchronous.")
-
-        weights = self.weights
-            
+
+        elif (trace % 100) == 0:
+            dr = self.wb.read_multiple_big(0x60000000, self.n_data)
+            if not np.allclose(dr, data):
+                logging.warning("Missmatch between expected data and received data.")
+                print(data)
+                print(dr)
+            else:
+                logging.info("FPGA and PC data synchronous.")
+
         return [weights, data]
 
     def execute_trigger(self, config=[], trace=0, repetition=0):
@@ -288,8 +308,9 @@ class TargetControl(_TargetBase):
     
     
     def load_lengths(self, weight_length, input_length):
-        self.wb.write(0x40000000, weight_length)
-        self.wb.write(0x40000001, input_length)
+        # both writes are sent together with the read back
+        self.wb.write(0x40000000, weight_length, posted=True)
+        self.wb.write(0x40000001, input_length, posted=True)
         d = self.wb.read_multiple(0x40000000, 2)
         
         if not np.allclose([weight_length, input_length], d):
@@ -300,21 +321,17 @@ class TargetControl(_TargetBase):
         return
     
     def load_weights(self):
-        write_data = []
-        for i in range(0, len(self.weights)):
-            write_data.append(self.weights[i].item())
-            self.wb.write_multiple(0x50000000 + i, [write_data[i]])
-        
+        # all weights in one burst
+        self.wb.write_multiple(0x50000000, self.weights)
+
         return
 
     def load_input(self, data):
-        write_data = []
-        dr = []
-        for i in range(0, len(data)):
-            write_data.append(data[i].item())
-            self.wb.write_multiple(0x60000000 + i, [write_data[i]])
-            dr.append(self.wb.read_multiple_big(0x60000000 + i, 1)[0])
-        
+        # the burst is sent together with the read back, i.e. a single round trip
+        write_data = np.asarray(data, dtype=np.uint32)
+        self.wb.write_multiple(0x60000000, write_data, posted=True)
+        dr = self.wb.read_multiple_big(0x60000000, len(write_data))
+
         if not np.allclose(write_data, dr):
             logging.warning("Error loading input data!")
         
@@ -331,11 +348,9 @@ class TargetControl(_TargetBase):
         data[5] = np.uint32((seed_weight[0] >> np.uint64(32)) & np.uint64(2**32 - 1))
         data[6] = np.uint32(seed_weight[1] & np.uint64(2**32 - 1))
         data[7] = np.uint32((seed_weight[1] >> np.uint64(32)) & np.uint64(2**32 - 1))
-        write_data = []
-        for i in range(0, len(data)):
-            write_data.append(data[i].item())
-        
-        self.wb.write_multiple(0x40000002, write_data)
+        write_data = data.tolist()
+
+        self.wb.write_multiple(0x40000002, data, posted=True)
         d = self.wb.read_multiple(0x40000002, 8)
         if not np.allclose(d, write_data):
             logging.warning("Error loading seed data!")
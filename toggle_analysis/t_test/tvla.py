@@ -0,0 +1,435 @@
+import numpy as np
+from math import comb
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Accumulator:
+    """
+    Base class of the running per-class statistics. Keeps the number of traces per class and the number of
+    traces (counted from the start of the dataset) that are already accumulated, so new traces can be folded
+    in at any time without revisiting the ones that were already processed.
+    Derived classes list their statistics in arrays and their parameters in attributes for save and load.
+    """
+
+    kind = None
+    arrays = []
+    attributes = []
+
+    def __init__(self, n_samples, n_classes=2):
+        """
+        :param n_samples: number of samples per trace
+        :param n_classes: number of classes the traces are partitioned into
+        """
+        self.n_samples = n_samples
+        self.n_classes = n_classes
+        self.n_traces = 0
+        self.count = np.zeros(n_classes, dtype=np.int64)
+
+    def column_blocks(self, n_workers=1, block_size=None):
+        """
+        Column blocks of a chunk that can be updated concurrently.
+        :param n_workers: number of workers
+        :param block_size: number of samples per block
+        :return: list of (first sample, last sample + 1)
+        """
+        return column_blocks(self.n_samples, n_workers, block_size)
+
+    def update_counts(self, labels):
+        """
+        Accumulates the number of traces per class of a chunk. Has to be called once per chunk after all blocks are updated.
+        :param labels: class label of every trace in the chunk
+        """
+        self.count += np.bincount(labels, minlength=self.n_classes)[:self.n_classes]
+        self.n_traces += len(labels)
+
+    def update_block(self, data, labels, first_sample):
+        raise NotImplementedError()
+
+    def t_values(self, class0=0, class1=1):
+        raise NotImplementedError()
+
+    def welch(self, mean, var, class0=0, class1=1):
+        """
+        Welch t-statistic between two classes.
+        :param mean: per-class mean of the compared quantity
+        :param var: per-class variance of the compared quantity
+        :return: t-values
+        """
+        bottom = np.sqrt(np.maximum(var[class0], 0) / self.count[class0] + np.maximum(var[class1], 0) / self.count[class1])
+        # replace values that are zero otherwise there will be an error during devision
+        bottom[bottom == 0] = 0.001
+
+        return np.nan_to_num((mean[class0] - mean[class1]) / bottom)
+
+    def save(self, group):
+        """
+        Stores the accumulated statistics in a HDF5 group so the t-test can be continued later on.
+        :param group: h5py group (or file) to write to
+        """
+        for name in ['count'] + self.arrays:
+            if name in group:
+                del group[name]
+            group[name] = getattr(self, name)
+        group.attrs['kind'] = self.kind
+        group.attrs['n_samples'] = self.n_samples
+        group.attrs['n_traces'] = self.n_traces
+        for name in self.attributes:
+            group.attrs[name] = getattr(self, name)
+
+    def matches(self, other):
+        """
+        :param other: accumulator
+        :return: True if other accumulates the same statistics
+        """
+        return type(self) is type(other) and self.n_samples == other.n_samples and self.n_classes == other.n_classes and all(np.all(getattr(self, name) == getattr(other, name)) for name in self.attributes)
+
+
+class WelchAccumulator(Accumulator):
+    """
+    Per-class sums and sums of squares for a first-order Welch t-test.
+    """
+
+    kind = 'welch'
+    arrays = ['sum', 'sum_sq']
+
+    def __init__(self, n_samples, n_classes=2):
+        super().__init__(n_samples, n_classes)
+        self.sum = np.zeros((n_classes, n_samples), dtype=np.float64)
+        self.sum_sq = np.zeros((n_classes, n_samples), dtype=np.float64)
+
+    def update_block(self, data, labels, first_sample):
+        """
+        Accumulates sum and sum of squares of a column block of a chunk.
+        :param data: samples of the block, shape (traces, block samples)
+        :param labels: class label of every trace in the chunk
+        :param first_sample: index of the first sample of the block
+        """
+        columns = slice(first_sample, first_sample + data.shape[1])
+        for c in range(self.n_classes):
+            q = data[labels == c].astype(np.float64)
+            self.sum[c, columns] += q.sum(axis=0)
+            self.sum_sq[c, columns] += np.einsum('ij,ij->j', q, q)
+
+    def t_values(self, class0=0, class1=1):
+        """
+        :return: t-values, shape (n_samples,)
+        """
+        n = self.count[:, None]
+        mean = self.sum / n
+        return self.welch(mean, self.sum_sq / n - mean ** 2, class0, class1)
+
+
+def merge_moments(n_a, m_a, n_b, m_b, delta_a, delta_b, order):
+    """
+    Pebay's pairwise update of central moment sums M_p = sum (x - mean) ** p.
+    Both partitions are re-centered on the combined mean, M_0 = n and M_1 = 0 by definition.
+    :param n_a: number of traces of partition a
+    :param m_a: dictionary p -> M_p of partition a for 2 <= p <= order
+    :param n_b: number of traces of partition b
+    :param m_b: dictionary p -> M_p of partition b for 2 <= p <= order
+    :param delta_a: combined mean minus mean of partition a
+    :param delta_b: combined mean minus mean of partition b
+    :param order: highest moment
+    :return: dictionary p -> M_p of the combined partition
+    """
+    m_a = {0: n_a, 1: 0, **m_a}
+    m_b = {0: n_b, 1: 0, **m_b}
+    merged = {}
+    for p in range(2, order + 1):
+        merged[p] = m_a[p] + m_b[p]
+        for k in range(1, p + 1):
+            if p - k == 1:
+                continue
+            merged[p] = merged[p] + comb(p, k) * ((-delta_a) ** k * m_a[p - k] + (-delta_b) ** k * m_b[p - k])
+    return merged
+
+
+class MomentAccumulator(Accumulator):
+    """
+    Per-class mean and central moment sums for a univariate t-test of order 1 to 5.
+    Chunks are merged with Pebay's one-pass update which stays numerically stable for high orders.
+    """
+
+    kind = 'moments'
+    arrays = ['mean', 'moments']
+    attributes = ['order']
+
+    def __init__(self, n_samples, order=2, n_classes=2):
+        """
+        :param n_samples: number of samples per trace
+        :param order: order of the t-test (the variance needs moments up to twice the order)
+        :param n_classes: number of classes the traces are partitioned into
+        """
+        super().__init__(n_samples, n_classes)
+        if not 1 <= order <= 5:
+            raise ValueError('Order %d is not supported, use 1 to 5.' % order)
+        self.order = order
+        self.mean = np.zeros((n_classes, n_samples), dtype=np.float64)
+        # moments[c, p - 2] = sum (x - mean) ** p
+        self.moments = np.zeros((n_classes, 2 * order - 1, n_samples), dtype=np.float64)
+
+    def update_block(self, data, labels, first_sample):
+        """
+        Merges the central moments of a column block of a chunk.
+        :param data: samples of the block, shape (traces, block samples)
+        :param labels: class label of every trace in the chunk
+        :param first_sample: index of the first sample of the block
+        """
+        columns = slice(first_sample, first_sample + data.shape[1])
+        highest = 2 * self.order
+        for c in range(self.n_classes):
+            q = data[labels == c].astype(np.float64)
+            n_b = q.shape[0]
+            if n_b == 0:
+                continue
+            mean_b = q.mean(axis=0)
+            q -= mean_b
+            power = q * q
+            m_b = {2: power.sum(axis=0)}
+            for p in range(3, highest + 1):
+                power *= q
+                m_b[p] = power.sum(axis=0)
+
+            n_a = self.count[c]
+            if n_a == 0:
+                merged = m_b
+                mean = mean_b
+            else:
+                mean_a = self.mean[c, columns]
+                n = n_a + n_b
+                mean = mean_a + (mean_b - mean_a) * (n_b / n)
+                m_a = {p: self.moments[c, p - 2, columns] for p in range(2, highest + 1)}
+                merged = merge_moments(n_a, m_a, n_b, m_b, mean - mean_a, mean - mean_b, highest)
+
+            self.mean[c, columns] = mean
+            for p in range(2, highest + 1):
+                self.moments[c, p - 2, columns] = merged[p]
+
+    def central_moment(self, p):
+        """
+        :param p: moment
+        :return: per-class central moment p, shape (n_classes, n_samples)
+        """
+        return self.moments[:, p - 2] / self.count[:, None]
+
+    def t_values(self, class0=0, class1=1):
+        """
+        The compared quantity is the mean for order 1, the variance for order 2 and the standardized moment for higher orders.
+        :return: t-values, shape (n_samples,)
+        """
+        d = self.order
+        cm2 = self.central_moment(2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if d == 1:
+                mean, var = self.mean, cm2
+            elif d == 2:
+                mean, var = cm2, self.central_moment(4) - cm2 ** 2
+            else:
+                cmd = self.central_moment(d)
+                mean = cmd / cm2 ** (d / 2)
+                var = (self.central_moment(2 * d) - cmd ** 2) / cm2 ** d
+            return self.welch(mean, var, class0, class1)
+
+
+class BivariateAccumulator(Accumulator):
+    """
+    Per-class central co-moment sums C_ab[i, j] = sum (x_i - mean_i) ** a * (x_j - mean_j) ** b of all sample pairs
+    inside a window for a bivariate second-order t-test on the centered product.
+    Memory grows with the square of the window length.
+    """
+
+    kind = 'bivariate'
+    arrays = ['mean', 'm2', 'c11', 'c21', 'c12', 'c22']
+    attributes = ['window']
+
+    def __init__(self, n_samples, window=None, n_classes=2):
+        """
+        :param n_samples: number of samples per trace
+        :param window: (first sample, last sample + 1) of the combined samples, None for the whole trace
+        :param n_classes: number of classes the traces are partitioned into
+        """
+        super().__init__(n_samples, n_classes)
+        if window is None:
+            window = (0, n_samples)
+        self.window = np.array(window, dtype=np.int64)
+        w = int(self.window[1] - self.window[0])
+        if w <= 0 or self.window[0] < 0 or self.window[1] > n_samples:
+            raise ValueError('Invalid window %d:%d for %d samples.' % (self.window[0], self.window[1], n_samples))
+        self.mean = np.zeros((n_classes, w), dtype=np.float64)
+        self.m2 = np.zeros((n_classes, w), dtype=np.float64)
+        for name in ['c11', 'c21', 'c12', 'c22']:
+            setattr(self, name, np.zeros((n_classes, w, w), dtype=np.float64))
+
+    def column_blocks(self, n_workers=1, block_size=None):
+        # the co-moments need all samples of the window at once, the matrix products are parallelized by BLAS
+        return [(int(self.window[0]), int(self.window[1]))]
+
+    @staticmethod
+    def co_moment(c, n, m2, a, b):
+        """
+        Co-moment C_ab of one partition broadcastable to the shape of the window pairs.
+        """
+        if a == 0 and b == 0:
+            return n
+        if a + b == 1:
+            return 0
+        if b == 0:
+            return m2[:, None]
+        if a == 0:
+            return m2[None, :]
+        return c['c%d%d' % (a, b)]
+
+    def update_block(self, data, labels, first_sample):
+        """
+        Merges the co-moments of the window of a chunk.
+        :param data: samples of the window, shape (traces, window samples)
+        :param labels: class label of every trace in the chunk
+        :param first_sample: index of the first sample of the window
+        """
+        for c in range(self.n_classes):
+            q = data[labels == c].astype(np.float64)
+            n_b = q.shape[0]
+            if n_b == 0:
+                continue
+            mean_b = q.mean(axis=0)
+            q -= mean_b
+            q2 = q * q
+            c_b = {'c11': q.T @ q, 'c21': q2.T @ q, 'c12': q.T @ q2, 'c22': q2.T @ q2}
+            m2_b = q2.sum(axis=0)
+
+            n_a = self.count[c]
+            if n_a == 0:
+                self.mean[c] = mean_b
+                self.m2[c] = m2_b
+                for name in c_b:
+                    getattr(self, name)[c] = c_b[name]
+                continue
+
+            n = n_a + n_b
+            mean_a = self.mean[c]
+            mean = mean_a + (mean_b - mean_a) * (n_b / n)
+            c_a = {name: getattr(self, name)[c] for name in c_b}
+            m2_a = self.m2[c]
+
+            # Pebay's update for co-moments, both partitions re-centered on the combined mean
+            partitions = [(c_a, n_a, m2_a, mean_a - mean), (c_b, n_b, m2_b, mean_b - mean)]
+            merged = {}
+            for a, b in [(1, 1), (2, 1), (1, 2), (2, 2)]:
+                merged[(a, b)] = 0
+                for part, n_p, m2_p, delta in partitions:
+                    for k in range(a + 1):
+                        for j in range(b + 1):
+                            term = self.co_moment(part, n_p, m2_p, a - k, b - j)
+                            if np.isscalar(term) and term == 0:
+                                continue
+                            merged[(a, b)] = merged[(a, b)] + comb(a, k) * comb(b, j) * term * (delta[:, None] ** k) * (delta[None, :] ** j)
+            m2 = m2_a + m2_b + (mean_a - mean) ** 2 * n_a + (mean_b - mean) ** 2 * n_b
+
+            self.mean[c] = mean
+            self.m2[c] = m2
+            for (a, b), value in merged.items():
+                getattr(self, 'c%d%d' % (a, b))[c] = value
+
+    def t_values(self, class0=0, class1=1):
+        """
+        :return: t-values of all sample pairs of the window, shape (window samples, window samples)
+        """
+        n = self.count[:, None, None]
+        mean = self.c11 / n
+        return self.welch(mean, self.c22 / n - mean ** 2, class0, class1)
+
+
+def load_accumulator(group):
+    """
+    Restores accumulated statistics written by Accumulator.save.
+    :param group: h5py group (or file) to read from
+    :return: accumulator
+    """
+    kinds = {cls.kind: cls for cls in [WelchAccumulator, MomentAccumulator, BivariateAccumulator]}
+    cls = kinds[group.attrs.get('kind', 'welch')]
+    count = group['count'][:]
+    kwargs = {name: group.attrs[name] for name in cls.attributes}
+    acc = cls(int(group.attrs.get('n_samples', group[cls.arrays[0]].shape[-1])), n_classes=len(count), **kwargs)
+    acc.count = count
+    for name in cls.arrays:
+        setattr(acc, name, group[name][:])
+    acc.n_traces = int(group.attrs['n_traces'])
+    return acc
+
+
+def get_class_labels(file, n_traces, dist=None, mask=None):
+    """
+    Partitions the traces into the fixed (0) and the random (1) set.
+    :param file: opened h5py file holding the traces
+    :param n_traces: number of traces
+    :param dist: name of a dataset in file with one entry per trace, zero entries belong to set 0, all others to set 1
+    :param mask: path to a *.npy file with one entry per trace, zero entries belong to set 0, all others to set 1
+    :return: labels, shape (n_traces,)
+    """
+    if mask is not None:
+        labels = np.load(mask)
+    elif dist is not None:
+        labels = file[dist][:n_traces]
+    else:
+        # first half is the fixed set, second half the random set
+        labels = np.arange(n_traces) >= int(n_traces / 2)
+
+    labels = np.asarray(labels).reshape(len(labels), -1)
+    if labels.shape[0] < n_traces:
+        raise ValueError('Class labels cover only %d of %d traces.' % (labels.shape[0], n_traces))
+    if labels.shape[1] != 1:
+        raise ValueError('Class labels need a single entry per trace.')
+
+    return (labels[:n_traces, 0] != 0).astype(np.uint8)
+
+
+def column_blocks(n_samples, n_workers=1, block_size=None):
+    """
+    Splits the sample columns into blocks that are processed by the workers.
+    :param n_samples: number of samples per trace
+    :param n_workers: number of workers
+    :param block_size: number of samples per block, if None the columns are split evenly among the workers
+    :return: list of (first sample, last sample + 1)
+    """
+    if block_size is None:
+        block_size = int(np.ceil(n_samples / n_workers))
+    block_size = max(1, block_size)
+    return [(i, min(i + block_size, n_samples)) for i in range(0, n_samples, block_size)]
+
+
+def stream_t_test(samples, labels, accumulator, chunk_size=10000, n_workers=1, block_size=None, verbose=True):
+    """
+    Streams the traces chunk by chunk from the dataset and accumulates them.
+    Every trace is read only once. Traces the accumulator already holds are skipped, which allows to continue
+    a t-test after new traces have been appended to the dataset.
+    :param samples: h5py dataset (or array) with shape (traces, samples)
+    :param labels: class label of every trace
+    :param accumulator: accumulator that is updated, e.g. WelchAccumulator
+    :param chunk_size: number of traces read at once
+    :param n_workers: number of threads working on the column blocks of a chunk
+    :param block_size: number of samples per column block
+    :param verbose: print the progress
+    :return: accumulator
+    """
+    n_traces = samples.shape[0]
+    blocks = accumulator.column_blocks(n_workers, block_size)
+    # only read the columns the accumulator needs
+    lo = min(b[0] for b in blocks)
+    hi = max(b[1] for b in blocks)
+
+    # numpy releases the GIL during the reductions so threads scale without copying chunks between processes
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for first in range(accumulator.n_traces, n_traces, chunk_size):
+            last = min(first + chunk_size, n_traces)
+            data = samples[first:last, lo:hi]
+            chunk_labels = labels[first:last]
+
+            jobs = [pool.submit(accumulator.update_block, data[:, b0 - lo:b1 - lo], chunk_labels, b0) for b0, b1 in blocks]
+            for job in jobs:
+                job.result()
+            accumulator.update_counts(chunk_labels)
+
+            if verbose:
+                print('Processed traces: %d/%d (%.2f%%)' % (last, n_traces, 100 * last / n_traces))
+
+    return accumulator
@@ -22,6 +22,8 @@
 #include <glob.h>
 #include <sys/mman.h>
 
+#include <algorithm>
+#include <atomic>
 #include <string>
 #include <iostream>
 #include <thread>
@@ -135,6 +137,10 @@ extern "C" void SetupParser(bool hamming_weight, const char *inspected_signals_f
             values_to_extract_.push_back(ve);
         }
         CHECK(munmap(const_cast<void *>(static_cast<const void *>(file_start)), file_length) != -1);
+
+        // sort value_extract by time (<) once, the parsers only read it
+        std::sort(values_to_extract_.begin(), values_to_extract_.end(), [](auto a, auto b) -> bool
+                  { return a->time < b->time; });
     }
 }
 
@@ -174,7 +180,7 @@ extern "C" void ParseFiles(const char *path, size_t *num_files, int64_t ***leaka
     last_extracted_values_ = *extracted_values;
     last_extracted_values_count_ = *extracted_values_count;
 
-    // Parse files (TODO: parallelize?)
+    // Parse files (use `ParseFilesBatch` to parse in parallel)
     for (size_t i = 0; i < *num_files; ++i)
     {
         Parser parser(vcd_files[i].c_str(), &inspected_signals_, leakage_model_, align_, downsample_,
@@ -194,6 +200,57 @@ extern "C" void ParseFiles(const char *path, size_t *num_files, int64_t ***leaka
     }
 }
 
+// Parses the `num_files` files given by `file_names` on `num_threads` threads. The parser must be setup using `SetupParser`
+// beforehand. The first file ever parsed defines the variable definitions, if no file was parsed yet the first file of the
+// batch is parsed before the threads are started.
+//
+// The caller provides the contiguous buffers for the return values:
+// - `leakages` with `num_files` x `samples` entries, row i holds the leakage of file i (truncated or filled with 0)
+// - `leakages_count` with `num_files` entries, the actual length of the leakage of every file
+// - `extracted_values` with `num_files` x `extracted_values_count` entries, must be freed with `FreeExtractedValues`
+// Does not call into Python so ctypes can release the GIL for the whole batch.
+extern "C" void ParseFilesBatch(const char **file_names, size_t num_files, int64_t *leakages, size_t samples,
+                                size_t *leakages_count, char **extracted_values, size_t num_threads)
+{
+    const size_t extracted_values_count = values_to_extract_.size();
+
+    auto parse_file = [&](size_t i)
+    {
+        Parser parser(file_names[i], &inspected_signals_, leakage_model_, align_, downsample_,
+                      &var_definitions_, &values_to_extract_);
+        leakages_count[i] = parser.CopyLeakage(leakages + i * samples, samples);
+        char **values = parser.GetExtractedValues();
+        std::copy(values, values + extracted_values_count, extracted_values + i * extracted_values_count);
+        free(values);
+    };
+
+    // var_definitions_ is only written by the first file, afterwards it is read concurrently
+    std::atomic<size_t> next_file(0);
+    if (var_definitions_.empty() && num_files > 0)
+        parse_file(next_file++);
+
+    auto worker = [&]()
+    {
+        for (size_t i = next_file++; i < num_files; i = next_file++)
+            parse_file(i);
+    };
+
+    num_threads = std::max<size_t>(1, std::min(num_threads, num_files));
+    std::vector<std::thread> threads;
+    for (size_t t = 1; t < num_threads; ++t)
+        threads.emplace_back(worker);
+    worker();
+    for (auto &thread : threads)
+        thread.join();
+}
+
+// Frees the extracted values returned by `ParseFilesBatch`.
+extern "C" void FreeExtractedValues(char **extracted_values, size_t count)
+{
+    for (size_t i = 0; i < count; ++i)
+        free(extracted_values[i]);
+}
+
 /// This section is only used in the standalone executable
 #ifdef DEBUG
 
@@ -68,6 +68,14 @@ int64_t *Parser::GetLeakage(size_t *length)
     return ret;
 }
 
+size_t Parser::CopyLeakage(int64_t *buffer, size_t length)
+{
+    const size_t copy_length = std::min(length, leakage_.size());
+    memcpy(buffer, leakage_.data(), copy_length * sizeof(int64_t));
+    std::fill(buffer + copy_length, buffer + length, 0);
+    return leakage_.size();
+}
+
 char **Parser::GetExtractedValues()
 {
     // deep copy extracted values
@@ -229,9 +237,9 @@ void Parser::ParseValueChangeSection(LeakageModel leakage_model, bool align, uin
         }
     }
 
-    // sort value_extract by time (<)
-    std::sort(values_to_extract->begin(), values_to_extract->end(), [](auto a, auto b) -> bool
-              { return a->time < b->time; });
+    // value_extract is sorted by time (<) in SetupParser, it is shared between parsers running in parallel
+    DCHECK(std::is_sorted(values_to_extract->begin(), values_to_extract->end(), [](auto a, auto b) -> bool
+                          { return a->time < b->time; }));
 
     auto maybe_add_extracted_values = [&]()
     {
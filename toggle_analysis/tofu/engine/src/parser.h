@@ -85,6 +85,10 @@ class Parser {
         // The caller is responsible for freeing the returned leakage memory.
         int64_t* GetLeakage(size_t* length);
 
+        // Copies at most `length` entries of the leakage information into `buffer` and fills the remaining entries with 0.
+        // Returns the length of the leakage information.
+        size_t CopyLeakage(int64_t* buffer, size_t length);
+
         // Returns a copy of the extracted values.
         // The caller must free the returned memory.
         char** GetExtractedValues();
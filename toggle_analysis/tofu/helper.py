@@ -27,8 +27,15 @@ import re
 import time
 import sys
 import h5py
+import pickle
 import logging
 import importlib.util
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+# file suffix of the columnar state updates written by the parse step
+UPDATES_SUFFIX = ".updates.npy"
 
 
 def loadSettings(settingsFile):
@@ -101,7 +108,15 @@ def prepareSettings(settingsFile, settings, mode="tofu"):
         settings["signalsFileNameLiterals"] = None
 
     if mode == "tofu":
+        # state updates are stored in the columnar format unless pickle is requested
+        settings["updatesFormat"] = settings.get("updatesFormat", "npy")
+        if settings["updatesFormat"] not in ["npy", "pickle"]:
+            raise Exception("updatesFormat %s not supported use either npy or pickle" % settings["updatesFormat"])
+        if settings["updatesFormat"] == "npy":
+            settings["pickleGlob"] = re.sub(r"\.pickle$", UPDATES_SUFFIX, settings["pickleGlob"])
         settings["pickleGlob"] = settingsFilePath + settings["pickleGlob"]
+        # number of processes parsing vcd files in parallel
+        settings["parseProcesses"] = int(settings.get("parseProcesses", 1))
         settings["signalPropertiesFile"] = settingsFilePath + settings["signalPropertiesFile"]
         settings["signalsFileName"] = settingsFilePath + settings["signalsFileName"]
 
@@ -125,13 +140,165 @@ def prepareSettings(settingsFile, settings, mode="tofu"):
     elif mode == "ntofu":
         if "valueExtractFile" in settings.keys():
             settings["valueExtractFile"] = settingsFilePath + settings["valueExtractFile"]
+        # number of vcd files parsed per call of the engine and number of engine threads
+        settings["ntofuBatchSize"] = int(settings.get("ntofuBatchSize", 64))
+        settings["ntofuThreads"] = int(settings.get("ntofuThreads", os.cpu_count()))
 
     else:
         raise Exception(f"mode {mode} not supported us either tofu or ntofu")
 
+    # optional compression filter of the trace datasets e.g. gzip or lzf
+    settings["writeTracesCompression"] = settings.get("writeTracesCompression", None)
+
     return settings
 
 
+def updatesDtype(value_words=1):
+    """
+    :param value_words: number of uint64 words per value
+    :return: numpy dtype of the columnar state updates
+    """
+    return np.dtype([("time", np.uint64), ("id", np.uint32), ("value", np.uint64, (value_words,))])
+
+
+def updatesToArray(updates, value_words=1):
+    """
+    Converts state updates into a structured array with the fields time, id and value.
+    Values wider than 64 bit are split into uint64 words (least significant word first).
+    :param updates: list of (simulation time, numeric id, value) tuples
+    :param value_words: number of uint64 words per value
+    :return: structured numpy array
+    """
+    n_updates = len(updates)
+    array = np.empty(n_updates, dtype=updatesDtype(value_words))
+    array["time"] = np.fromiter((update[0] for update in updates), dtype=np.uint64, count=n_updates)
+    array["id"] = np.fromiter((update[1] for update in updates), dtype=np.uint32, count=n_updates)
+    if value_words == 1:
+        array["value"][:, 0] = np.fromiter((update[2] for update in updates), dtype=np.uint64, count=n_updates)
+    else:
+        for word in range(value_words):
+            array["value"][:, word] = np.fromiter(((update[2] >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for update in updates), dtype=np.uint64, count=n_updates)
+    return array
+
+
+# number of set bits of every byte
+POPCOUNT_LUT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """
+    Counts the set bits of every row of a word array.
+    :param words: numpy array of uint64 with shape (updates, words)
+    :return: numpy array of int64 with shape (updates,)
+    """
+    words = np.ascontiguousarray(words)
+    return POPCOUNT_LUT[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+def leakageFromUpdates(updates, indices, samples, inspected_ids, leakage):
+    """
+    Derives the leakage of a trace from its state updates.
+    :param updates: structured array of state updates as returned by updatesToArray
+    :param indices: sample of every update
+    :param samples: number of samples of the trace
+    :param inspected_ids: numeric ids of the signals under inspection
+    :param leakage: leakage model, "HammingWeight" or "HammingDistance"
+    :return: leakage, numpy array of uint32
+    """
+    if leakage not in ("HammingWeight", "HammingDistance"):
+        raise Exception("undefined leakage model: %s" % leakage)
+
+    # only keep signals which are inspected
+    inspected = np.isin(updates["id"], np.fromiter(inspected_ids, dtype=np.int64))
+    if not np.any(inspected):
+        # no signal under inspection is updated, i.e. there is no leakage
+        if leakage == "HammingWeight":
+            return np.zeros((samples,), dtype=np.uint32)
+        # ignore first point
+        return np.zeros((samples,), dtype=np.uint32)[1:]
+
+    # samples after the last update of any signal are not driven
+    last_index = int(indices[-1])
+    indices = indices[inspected]
+    updates = updates[inspected]
+
+    # previous value of the same signal, all signals start from zero
+    order = np.argsort(updates["id"], kind="stable")
+    ids = updates["id"][order]
+    values = updates["value"][order]
+    indices = indices[order]
+    previous = np.zeros_like(values)
+    previous[1:] = values[:-1]
+    previous[np.concatenate(([True], ids[1:] != ids[:-1]))] = 0
+
+    if leakage == "HammingWeight":
+        # accumulate the changes of the hamming weight of the state
+        change = popcount(values) - popcount(previous)
+        result = np.cumsum(np.bincount(indices, weights=change, minlength=samples))
+        result[last_index + 1 :] = 0
+        result = result.astype(np.uint32)
+    else:
+        # sum up the hamming distances of all updates within a sample
+        result = np.bincount(indices, weights=popcount(values ^ previous), minlength=samples).astype(np.uint32)
+        # ignore first point
+        result = result[1:]
+
+    return result
+
+
+def saveUpdates(updatesFile, updates):
+    """
+    Stores state updates in the columnar format i.e. a structured npy file.
+    :param updatesFile: file name ending with UPDATES_SUFFIX
+    :param updates: structured numpy array as returned by updatesToArray
+    """
+    with open(updatesFile, "wb") as f:
+        np.save(f, updates)
+
+
+def loadUpdates(updatesFile, value_words=1):
+    """
+    Loads state updates of a trace. Columnar files are memory-mapped, pickle files are converted.
+    :param updatesFile: file name of the state updates
+    :param value_words: number of uint64 words per value for pickle files
+    :return: structured numpy array as returned by updatesToArray
+    """
+    if updatesFile.endswith(".npy"):
+        return np.load(updatesFile, mmap_mode="r")
+    with open(updatesFile, "rb") as f:
+        return updatesToArray(pickle.load(f), value_words)
+
+
+class UpdateSequence:
+    """
+    Read-only view on a structured update array which yields (simulation time, numeric id, value) tuples
+    like the lists of the pickle format, so value extract functions work with both formats.
+    """
+
+    def __init__(self, updates):
+        self.updates = updates
+
+    @staticmethod
+    def toInt(words):
+        value = 0
+        for word, part in enumerate(words):
+            value |= int(part) << (64 * word)
+        return value
+
+    def __len__(self):
+        return len(self.updates)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return UpdateSequence(self.updates[key])
+        update = self.updates[key]
+        return (int(update["time"]), int(update["id"]), self.toInt(update["value"]))
+
+    def __iter__(self):
+        for time_, numeric_id, words in zip(self.updates["time"].tolist(), self.updates["id"].tolist(), self.updates["value"].tolist()):
+            yield (time_, numeric_id, self.toInt(words))
+
+
 def natural_sort_key(s):
     # sort naturally not in aphabetic order
     natural_sort_regex = re.compile("([0-9]+)")
@@ -170,7 +337,7 @@ def progressbar(iterable, prefix="", size=100, logger=None):
         sys.stdout.flush()
 
 
-def lascarHDF5Export(aqc, traceFileName, writeTracesBatchSize=None, logger=None):
+def lascarHDF5Export(aqc, traceFileName, writeTracesBatchSize=None, logger=None, compression=None):
     if os.path.isfile(traceFileName):
         if logger is None:
             print("file %s already exists, overwriting..." % (traceFileName))
@@ -182,16 +349,47 @@ def lascarHDF5Export(aqc, traceFileName, writeTracesBatchSize=None, logger=None)
     FHvalues = None
 
     n_traces = len(aqc)
+    batch_size = max(1, int(writeTracesBatchSize)) if writeTracesBatchSize is not None else 1
+
+    def produceBatch(first):
+        return [aqc[i] for i in range(first, min(first + batch_size, n_traces))]
 
-    # implement batched trace write here
+    # the next batch is generated by a background worker while the current one is written
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        nextBatch = executor.submit(produceBatch, 0)
+        for _, first in progressbar(range(0, n_traces, batch_size), logger=logger):
+            batch = nextBatch.result()
+            if first + batch_size < n_traces:
+                nextBatch = executor.submit(produceBatch, first + batch_size)
 
-    for i, _ in progressbar(range(n_traces), logger=logger):
-        leakage, value = aqc[i]
-        if i == 0:
-            FHleakages = filehandle.create_dataset("leakages", (n_traces, leakage.shape[0]), dtype=leakage.dtype)
-            FHvalues = filehandle.create_dataset("values", (n_traces, value.shape[0]), dtype=value.dtype)
+            leakages = np.stack([leakage for leakage, _ in batch])
+            values = np.stack([value for _, value in batch]).reshape(len(batch), -1)
+            if FHleakages is None:
+                FHleakages = filehandle.create_dataset("leakages", (n_traces, leakages.shape[1]), dtype=leakages.dtype, chunks=chunkShape(n_traces, leakages.shape[1], leakages.dtype, batch_size), compression=compression)
+                FHvalues = filehandle.create_dataset("values", (n_traces, values.shape[1]), dtype=values.dtype, chunks=chunkShape(n_traces, values.shape[1], values.dtype, batch_size), compression=compression)
 
-        FHleakages[i, :] = leakage
-        FHvalues[i, :] = value
+            FHleakages[first : first + len(batch), :] = leakages
+            FHvalues[first : first + len(batch), :] = values
 
     filehandle.close()
+
+
+def chunkShape(n_traces, n_samples, dtype, batch_size, maxChunkBytes=2**22):
+    """
+    Chunk shape of a trace dataset, a chunk holds complete traces and a batch of traces consists of whole chunks. If a
+    batch exceeds maxChunkBytes, the number of traces per chunk is reduced to a divisor of the batch size.
+    Mirrors HDF5utils.hdf5_get_chunkshape of the Attack-Framework (same cap and rounding), such that files of both
+    pipelines are chunked alike.
+    :param n_traces: number of traces of the dataset
+    :param n_samples: number of samples per trace
+    :param dtype: data type of the dataset
+    :param batch_size: number of traces written at once
+    :param maxChunkBytes: upper limit of the chunk size in bytes (default: 4 MiB)
+    :return: tuple (traces, samples)
+    """
+    batch_size = max(1, min(int(batch_size), n_traces))
+    traceBytes = max(1, int(n_samples) * np.dtype(dtype).itemsize)
+    traces = batch_size
+    while traces > 1 and (traces * traceBytes > maxChunkBytes or batch_size % traces != 0):
+        traces = traces - 1
+    return (traces, max(1, n_samples))
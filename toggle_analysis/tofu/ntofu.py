@@ -23,6 +23,7 @@
 
 import ctypes
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import argparse
 import glob
@@ -94,6 +95,8 @@ use_value_extract = valueExtractFile is not None
 write_trace_format = settings["format"]
 align = settings["align"]
 downsample = ctypes.c_uint64(int(settings["downsample"]))
+batch_size = settings["ntofuBatchSize"]
+num_threads = settings["ntofuThreads"]
 
 lib = ctypes.CDLL(fdir + "/engine/build/library.so")
 lib.SetupParser(use_hamming_weight, inspected_signals_file_name, align, downsample, valueExtractFile)
@@ -113,14 +116,81 @@ def parse_file(name):
     return leakage, extracted_values, extracted_values_count.value
 
 
+lib.ParseFilesBatch.argtypes = [ctypes.POINTER(ctypes.c_char_p), ctypes.c_size_t, np.ctypeslib.ndpointer(dtype=np.int64, ndim=2, flags="C_CONTIGUOUS"), ctypes.c_size_t, np.ctypeslib.ndpointer(dtype=np.uintp, ndim=1, flags="C_CONTIGUOUS"), ctypes.POINTER(ctypes.c_void_p), ctypes.c_size_t]
+lib.ParseFilesBatch.restype = None
+lib.FreeExtractedValues.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_size_t]
+lib.FreeExtractedValues.restype = None
+
+
+def parse_files(names, samples, extracted_values_count, num_threads):
+    """
+    Parses several vcd files on the native thread pool of the engine. ctypes releases the GIL during the call.
+    :param names: list of encoded file names
+    :param samples: number of samples of every leakage
+    :param extracted_values_count: number of values extracted from every file
+    :param num_threads: number of engine threads
+    :return: leakages with shape (len(names), samples) and a list of the extracted values (bit strings) of every file
+    """
+    num = len(names)
+    leakages = np.empty((num, samples), dtype=np.int64)
+    leakages_count = np.empty(num, dtype=np.uintp)
+    extracted_values = (ctypes.c_void_p * (num * extracted_values_count))()
+    lib.ParseFilesBatch((ctypes.c_char_p * num)(*names), num, leakages, samples, leakages_count, extracted_values, num_threads)
+
+    values = [[ctypes.string_at(extracted_values[i * extracted_values_count + j]) for j in range(0, extracted_values_count)] for i in range(0, num)]
+    lib.FreeExtractedValues(extracted_values, num * extracted_values_count)
+
+    for i in range(0, num):
+        if leakages_count[i] != samples:
+            raise Exception("%s has %d samples but the first vcd file has %d" % (names[i].decode(), leakages_count[i], samples))
+    return leakages, values
+
+
 class AcquisitionSetupToggle:
     def __init__(self):
         self.number_of_traces = num_files
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+
+        # the first file is parsed on its own, it defines the variable definitions and the number of samples of all traces
+        leakage, extracted_values, extracted_values_count = parse_file(files[0])
+        self.samples = leakage.shape[0]
+        self.extracted_values_count = extracted_values_count
+        values = [extracted_values[0][i] for i in range(0, extracted_values_count)]
+        # currently loaded batch: (first index, last index + 1, leakages, extracted values)
+        self.batch = (0, 1, leakage[None, :].copy(), [values])
+
+        # the next batch is parsed in the background while the current one is consumed
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch = None
+
+    def load_batch(self, first):
+        last = min(first + self.batch_size, self.number_of_traces)
+        leakages, values = parse_files(files[first:last], self.samples, self.extracted_values_count, self.num_threads)
+        return (first, last, leakages, values)
+
+    def get_batch(self, index):
+        if not self.batch[0] <= index < self.batch[1]:
+            # batches start after the first trace
+            first = 1 + ((index - 1) // self.batch_size) * self.batch_size
+            if self.prefetch is not None and self.prefetch[0] == first:
+                self.batch = self.prefetch[1].result()
+            else:
+                self.batch = self.load_batch(first)
+            self.prefetch = None
+
+        if self.prefetch is None and self.batch[1] < self.number_of_traces:
+            self.prefetch = (self.batch[1], self.executor.submit(self.load_batch, self.batch[1]))
+
+        return self.batch
 
     def generate_trace(self, index):
         assert index < self.number_of_traces
 
-        leakage, extracted_values, extracted_values_count = parse_file(files[index])
+        (first, _, leakages, values) = self.get_batch(index)
+        leakage = leakages[index - first]
+        extracted_values = values[index - first]
+        extracted_values_count = len(extracted_values)
 
         if (window_from is not None or window_to is not None) and window is True:
             leakage = leakage[window_from:window_to]
@@ -128,10 +198,10 @@ class AcquisitionSetupToggle:
         if use_value_extract:
             assert extracted_values_count > 0
             # print(extracted_values_count)
-            max_len = max([int(np.ceil(len(extracted_values[0][i]) / 8)) for i in range(0, extracted_values_count)])
+            max_len = max([int(np.ceil(len(extracted_values[i]) / 8)) for i in range(0, extracted_values_count)])
             value = np.zeros((extracted_values_count, max_len), dtype=np.uint8)
             for i in range(0, extracted_values_count):
-                ev = extracted_values[0][i]
+                ev = extracted_values[i]
                 value[i] = np.frombuffer(int(ev, 2).to_bytes(max_len, byteorder="big"), dtype=np.uint8)
                 # print(extracted_values[0])
                 # print(binascii.hexlify(bytearray(list(value[0]))))
@@ -162,7 +232,7 @@ aqc = AcquisitionSetupToggle()
 # export traces to container
 if settings["writeTraces"]:
     if settings["format"] == "lascar":
-        helper.lascarHDF5Export(aqc, settings["traceFileName"], writeTracesBatchSize=settings["writeTracesBatchSize"], logger=logger)
+        helper.lascarHDF5Export(aqc, settings["traceFileName"], writeTracesBatchSize=settings["writeTracesBatchSize"], logger=logger, compression=settings["writeTracesCompression"])
     elif settings["format"] == "tueisec":
         tueisec.export(aqc, settings, settingsFileLocation=settings["settingsFileLocation"])
     else:
@@ -29,6 +29,7 @@ import time
 import pickle
 import helper
 import os
+import multiprocessing
 
 # loading settings from file
 parser = argparse.ArgumentParser(description="TOFU")
@@ -119,30 +120,12 @@ def identifierToNames(vcdHeader):
     return blah
 
 
-# globbing for vcd files
-vcdFiles = glob.glob(settings["vcdGlob"])
-vcdFiles = sorted(vcdFiles, key=helper.natural_sort_key)
-
-signal_properties = []
-
-###################################################################################################
-# iterate over all vcd files
-# for (simulation_trace, vcdFile) in enumerate(vcdFiles):
-
-for simulation_trace, vcdFile in helper.progressbar(vcdFiles, logger=logger):
-    logger.info("processing vcd file (%d/%d): %s" % (simulation_trace + 1, len(vcdFiles), vcdFile))
-
-    fid = open(vcdFile)
-
-    words = word_generator(fid)
-    lines = line_generator(fid)
-
+def parseHeader(words):
     # reset all header informations
     vcdHeader = {}
     vcdHeader["scope"] = {}
     currScope = []
 
-    logger.info("extracting header")
     # extract header
     while True:
         # extract header from value change dump
@@ -203,32 +186,40 @@ for simulation_trace, vcdFile in helper.progressbar(vcdFiles, logger=logger):
         else:
             raise Exception("undefined keyword: %s" % keyword)
 
-    # replace the verilog identifiers
-    # iton = identifierToName(vcdHeader)
-    itons = identifierToNames(vcdHeader)
+    return vcdHeader
 
-    if simulation_trace == 0:
-        # iddict = dict()
-        for identifier in itons:
-            for signal in itons[identifier]:
-                signal_properties.append((signal["numeric_id"], signal["name"], signal["width"], signal["scope"]))
-                # iddict[signal["scope"] + "->" + signal["name"]] = signal["numeric_id"]
 
-        # pickle that shit
-        with open(settings["signalPropertiesFile"], "wb") as f:
-            logger.info("pickling signal properties to file: %s" % (settings["signalPropertiesFile"]))
-            pickle.dump(signal_properties, f, pickle.HIGHEST_PROTOCOL)
+# identifier table of the first vcd file, every other file has to use the same one
+itonsReference = None
+
 
-        # pickle the metadata only required by tueisec format
-        if settings["format"] == "tueisec":
-            exclude_keys = {"scope"}
-            vcd_meta = {x: vcdHeader[x] for x in vcdHeader if x not in exclude_keys}
-            with open(settings["signalPropertiesFile"].rsplit(".", 1)[0] + "_meta.pickle", "wb") as f:
-                logger.info("pickling signal properties meta to file: %s" % (settings["signalPropertiesFile"].rsplit(".", 1)[0] + "_meta.pickle"))
-                pickle.dump(vcd_meta, f, pickle.HIGHEST_PROTOCOL)
+def setItonsReference(itons):
+    global itonsReference
+    itonsReference = itons
 
-    # get num id in all but the first trace
-    # fix this
+
+def parseFile(vcdFile):
+    """
+    Parses a value change dump and writes its state updates.
+    :param vcdFile: file name of the value change dump
+    :return: tuple of the vcd header and the identifier table
+    """
+    fid = open(vcdFile)
+
+    words = word_generator(fid)
+    lines = line_generator(fid)
+
+    logger.info("extracting header")
+    vcdHeader = parseHeader(words)
+
+    # replace the verilog identifiers
+    # iton = identifierToName(vcdHeader)
+    itons = identifierToNames(vcdHeader)
+
+    # numeric ids are assigned by the first trace
+    if itonsReference is not None and itons != itonsReference:
+        fid.close()
+        raise Exception("identifier table of %s differs from the first vcd file" % vcdFile)
 
     # fill signal data to traces
     simulation_time = 0
@@ -291,18 +282,81 @@ for simulation_trace, vcdFile in helper.progressbar(vcdFiles, logger=logger):
         raise Exception("unable to parse line: %s" % line)
 
     # batch insert to database
-    pickleFile = re.sub(r".vcd$", r".pickle", vcdFile)
-    logger.info("pickling updates to file: %s" % (pickleFile))
-    # pickle that shit
-    with open(pickleFile, "wb") as f:
-        pickle.dump(updates, f, pickle.HIGHEST_PROTOCOL)
+    if settings["updatesFormat"] == "npy":
+        # columnar format, values are split into as many uint64 words as the widest signal requires
+        value_words = max(1, -(-max(signal["width"] for identifier in itons for signal in itons[identifier]) // 64))
+        updatesFile = re.sub(r".vcd$", helper.UPDATES_SUFFIX, vcdFile)
+        logger.info("writing updates to file: %s" % (updatesFile))
+        helper.saveUpdates(updatesFile, helper.updatesToArray(updates, value_words))
+    else:
+        pickleFile = re.sub(r".vcd$", r".pickle", vcdFile)
+        logger.info("pickling updates to file: %s" % (pickleFile))
+        # pickle that shit
+        with open(pickleFile, "wb") as f:
+            pickle.dump(updates, f, pickle.HIGHEST_PROTOCOL)
 
     updates = []
     fid.close()
 
+    return (vcdHeader, itons)
 
-###################################################################################################
-# print(vcdHeader)
 
-time_finish = time.time()
-logger.info("conversion from vcd to pickle finished in %f seconds" % (time_finish - time_start))
+def parseFileWorker(vcdFile):
+    # only report back the file name, the identifier table is already known
+    logger.info("processing vcd file: %s" % (vcdFile))
+    parseFile(vcdFile)
+    return vcdFile
+
+
+def writeSignalProperties(vcdHeader, itons):
+    signal_properties = []
+    # iddict = dict()
+    for identifier in itons:
+        for signal in itons[identifier]:
+            signal_properties.append((signal["numeric_id"], signal["name"], signal["width"], signal["scope"]))
+            # iddict[signal["scope"] + "->" + signal["name"]] = signal["numeric_id"]
+
+    # pickle that shit
+    with open(settings["signalPropertiesFile"], "wb") as f:
+        logger.info("pickling signal properties to file: %s" % (settings["signalPropertiesFile"]))
+        pickle.dump(signal_properties, f, pickle.HIGHEST_PROTOCOL)
+
+    # pickle the metadata only required by tueisec format
+    if settings["format"] == "tueisec":
+        exclude_keys = {"scope"}
+        vcd_meta = {x: vcdHeader[x] for x in vcdHeader if x not in exclude_keys}
+        with open(settings["signalPropertiesFile"].rsplit(".", 1)[0] + "_meta.pickle", "wb") as f:
+            logger.info("pickling signal properties meta to file: %s" % (settings["signalPropertiesFile"].rsplit(".", 1)[0] + "_meta.pickle"))
+            pickle.dump(vcd_meta, f, pickle.HIGHEST_PROTOCOL)
+
+
+if __name__ == "__main__":
+    # globbing for vcd files
+    vcdFiles = glob.glob(settings["vcdGlob"])
+    vcdFiles = sorted(vcdFiles, key=helper.natural_sort_key)
+
+    ###################################################################################################
+    # the first vcd file defines the signal properties and the identifier table of all traces
+    logger.info("processing vcd file (%d/%d): %s" % (1, len(vcdFiles), vcdFiles[0]))
+    (vcdHeader, itons) = parseFile(vcdFiles[0])
+    writeSignalProperties(vcdHeader, itons)
+    setItonsReference(itons)
+
+    # iterate over all remaining vcd files
+    processes = settings["parseProcesses"]
+    if processes > 1:
+        logger.info("parsing %d vcd files with %d processes" % (len(vcdFiles) - 1, processes))
+        with multiprocessing.Pool(processes, initializer=setItonsReference, initargs=(itons,)) as pool:
+            results = pool.imap_unordered(parseFileWorker, vcdFiles[1:])
+            for _ in helper.progressbar(vcdFiles[1:], logger=logger):
+                next(results)
+    else:
+        for simulation_trace, vcdFile in helper.progressbar(vcdFiles[1:], logger=logger):
+            logger.info("processing vcd file (%d/%d): %s" % (simulation_trace + 2, len(vcdFiles), vcdFile))
+            parseFile(vcdFile)
+
+    ###################################################################################################
+    # print(vcdHeader)
+
+    time_finish = time.time()
+    logger.info("conversion from vcd to updates finished in %f seconds" % (time_finish - time_start))
@@ -24,6 +24,7 @@
 import logging
 import h5py
 import numpy as np
+import helper
 
 
 def load_hdf5_file(file_name):
@@ -78,3 +79,16 @@ logger.info("aes example traces passed")
 if not np.array_equal(tofu_values, ntofu_values):
     raise Exception("aes example values failed")
 logger.info("aes example values passed")
+
+###################################################################################################
+# traces without updates of the inspected signals do not leak
+samples = 8
+empty = helper.updatesToArray([])
+uninspected = helper.updatesToArray([(0, 5, 0x3), (2, 5, 0x1)])
+for updates in [empty, uninspected]:
+    indices = updates["time"].astype(np.int64)
+    for leakage, length in [("HammingWeight", samples), ("HammingDistance", samples - 1)]:
+        result = helper.leakageFromUpdates(updates, indices, samples, {1}, leakage)
+        if not np.array_equal(result, np.zeros((length,), dtype=np.uint32)):
+            raise Exception("empty updates %s failed" % leakage)
+logger.info("empty updates passed")
@@ -78,33 +78,6 @@ else:
     import value
 
 
-def hammingWeightFromBitString(x):
-    return x.count("1")
-
-
-def hammingDistanceFromBitString(x, y):
-    assert len(x) == len(y)
-    if len(x) == 1:
-        return x != y
-    else:
-        return sum(a != b for a, b in zip(x, y))
-
-
-if sys.version_info >= (3, 10):
-
-    def hammingWeightFromInt(x):
-        return x.bit_count()
-
-else:
-
-    def hammingWeightFromInt(x):
-        return bin(x).count("1")
-
-
-def hammingDistanceFromInt(x, y):
-    return hammingWeightFromInt(x ^ y)
-
-
 # extracting signals from database
 logger.info("extracting signals from signal properties")
 signal_properties = []
@@ -141,7 +114,7 @@ settings["numeric_ids_under_inspection"] = list(set(numeric_ids_under_inspection
 # hardcode or not ???
 settings["reloadNumericIds"] = True
 
-# globbing for pickle files
+# globbing for update files
 pickleFiles = glob.glob(settings["pickleGlob"])
 
 # extract the number of traces
@@ -197,7 +170,7 @@ class AcquisitionSetupToggle:
         # reduce signals to distinct ones
         logger.info("traces consist from %d signals" % (len(signals)))
 
-        # globbing for pickle files
+        # globbing for update files
         self.pickleGlob = settings["pickleGlob"]
         self.pickleFiles = glob.glob(self.pickleGlob)
         self.pickleFiles = sorted(self.pickleFiles, key=helper.natural_sort_key)
@@ -205,17 +178,19 @@ class AcquisitionSetupToggle:
 
         self.number_of_traces = len(self.pickleFiles)
 
-        # extract the simulation time stamps
-        with open(self.pickleFiles[0], "rb") as f:
-            self.simulation_time_steps = pickle.load(f)
-        self.simulation_time_steps = list(set([i[0] for i in self.simulation_time_steps]))
-        self.simulation_time_steps.sort()
+        self.numeric_id_to_width = {i["numeric_id"]: i["width"] for i in self.signal_properties}
+        # number of uint64 words required to hold the widest signal
+        self.value_words = max(1, -(-max(self.numeric_id_to_width.values()) // 64))
+
+        # extract the simulation time stamps, the updates are kept for the first trace to avoid loading them twice
+        self.first_updates = helper.loadUpdates(self.pickleFiles[0], self.value_words)
+        self.simulation_time_steps = np.unique(self.first_updates["time"]).tolist()
         self.simulation_time_to_index = {i[1]: i[0] for i in enumerate(self.simulation_time_steps)}
         self.simulation_index_to_time = {i[0]: i[1] for i in enumerate(self.simulation_time_steps)}
         self.simulation_time_max = self.simulation_time_steps[-1]
         logger.info("traces consist from %d sample points in time" % (len(self.simulation_time_steps)))
 
-        self.numeric_id_to_width = {i["numeric_id"]: i["width"] for i in self.signal_properties}
+        self.simulation_time_array = np.array(self.simulation_time_steps, dtype=np.uint64)
 
         self.align = settings["align"]
         self.downsample = settings["downsample"]
@@ -239,128 +214,27 @@ class AcquisitionSetupToggle:
 
         # horizontal mode assemmble state from changes and derive leakage
         # fetch all updates
-        logger.info("extracting state updates from picklefile")
-        updates = None
-        with open(self.pickleFiles[index], "rb") as f:
-            updates = pickle.load(f)
-
-        # extract value from pickle
-        self.updates = updates
-        # print(updates)
+        logger.info("extracting state updates from file: %s" % (self.pickleFiles[index]))
+        if index == 0 and self.first_updates is not None:
+            updates = self.first_updates
+            self.first_updates = None
+        else:
+            updates = helper.loadUpdates(self.pickleFiles[index], self.value_words)
+
+        # extract value from updates
+        self.updates = helper.UpdateSequence(updates)
         value = self.valueExtract(self)
 
+        # vectorized synthesis on structured arrays
+        # input  : updates                                    type: structured numpy array (memory-mapped)
+        # output : leakage                                    type: numpy array of uint32
         if self.align:
             # extract the simulation time stamps
-            self.simulation_time_steps = list(set([i[0] for i in updates]))
-            self.simulation_time_steps.sort()
+            self.simulation_time_steps = np.unique(updates["time"]).tolist()
             self.simulation_time_max = self.simulation_time_steps[-1]
             logger.info("trace consists from %d sample points in time" % (len(self.simulation_time_steps)))
 
-        ###################################################################################################################################
-        # slow slow slow remap this to something performant
-        ###################################################################################################################################
-        # input  : updates                               type: list of tuples
-        # input  : self.simulation_time_to_index              type: dictonary int to int mapping
-        # input  : self.windowFrom                            type: integer
-        # input  : self.windowTo                              tpye: integer
-        # input  : self.numeric_ids_under_inspection_set      type: set of integer
-        # output : leakage                                    type: list of integers
-
-        if self.align:
-            samples = self.simulation_time_max // self.downsample + 1
-            leakage = np.zeros((samples,), dtype=np.uint32)
-        else:
-            # extract the leakage
-            leakage = np.zeros((len(self.simulation_time_steps),), dtype=np.uint32)
-
-        # umbauen ummappen auf signale die benutzt werden
-        state = [0 for i in self.numeric_id_to_width.values()]
-
-        logger.info("iterating through all state updates")
-        logger.info("performing %d updates" % (len(updates)))
-
-        nextval_index = 0
-        nextval_index_old = 0
-        # hamming weight calculation
-        state_hamming_weight = 0
-        state_hamming_weight_change = 0
-        # hamming distance calculation
-        state_hamming_distance_change = 0
-
-        # perform updates inside the loop
-        for update in updates:
-            if self.align:
-                # binning of updates
-                nextval_index = update[0] // self.downsample
-            else:
-                nextval_index = self.simulation_time_to_index[update[0]]
-
-            numeric_id = update[1]
-            nextval = update[2]
-
-            # das bremst aus wie noch was
-            # check if signal is tracked
-            if numeric_id not in self.numeric_ids_under_inspection_set:
-                if nextval_index != nextval_index_old:
-                    if self.leakage == "HammingWeight":
-                        pass
-                    elif self.leakage == "HammingDistance":
-                        leakage[nextval_index_old] = state_hamming_distance_change
-                        state_hamming_distance_change = 0
-                        nextval_index_old = nextval_index
-                    else:
-                        raise Exception("undefined leakage model: %s" % self.leakage)
-                continue
-
-            # bottleneck
-            # logger.debug("simulation_time: %d index: %d  numeric_id: %d nextval: %s" % (update[0], nextval_index, numeric_id, nextval))
-
-            if nextval_index != nextval_index_old:
-                # this extracts the hamming weight
-                if self.leakage == "HammingWeight":
-                    # fast approach track changes
-                    if nextval_index_old == 0:
-                        # calculate sum only once
-                        state_hamming_weight_change = sum(state)
-                    state_hamming_weight += state_hamming_weight_change
-                    leakage[nextval_index_old : nextval_index + 1] = state_hamming_weight
-                    state_hamming_weight_change = 0
-                    # slow approach due to sum calculation
-                    # leakage[nextval_index_old : nextval_index + 1] = sum(state)
-                elif self.leakage == "HammingDistance":
-                    # calculate the hamming distance
-                    leakage[nextval_index_old] = state_hamming_distance_change
-                    state_hamming_distance_change = 0
-                else:
-                    raise Exception("undefined leakage model: %s" % self.leakage)
-
-                nextval_index_old = nextval_index
-
-            if self.leakage == "HammingWeight":
-                nextval_hamming_weight = hammingWeightFromInt(nextval)
-                state_hamming_weight_change += nextval_hamming_weight - state[numeric_id]
-                state[numeric_id] = nextval_hamming_weight
-            elif self.leakage == "HammingDistance":
-                state_hamming_distance_change += hammingDistanceFromInt(state[numeric_id], nextval)
-                state[numeric_id] = nextval
-            else:
-                raise Exception("undefined leakage model: %s" % self.leakage)
-
-        # perform the last update after the loop
-        if self.leakage == "HammingWeight":
-            # this extracts the hamming weight
-            leakage[nextval_index_old : nextval_index + 1] = sum(state)
-            # ignore first point
-            # leakage = leakage[1:]
-        elif self.leakage == "HammingDistance":
-            # calculate the hamming distance
-            leakage[nextval_index_old] = state_hamming_distance_change
-            # ignore first point
-            leakage = leakage[1:]
-        else:
-            raise Exception("undefined leakage model: %s" % self.leakage)
-
-        ###################################################################################################################################
+        leakage = self.synthesize(updates)
 
         if (self.windowFrom is not None or self.windowTo is not None) and self.window is True:
             logger.info("extracting window from leakage %d:%d" % (self.windowFrom, self.windowTo))
@@ -371,6 +245,24 @@ class AcquisitionSetupToggle:
 
         return (leakage, value)
 
+    def synthesize(self, updates):
+        """
+        Derives the leakage of a trace from its state updates.
+        :param updates: structured array of state updates as returned by updatesToArray
+        :return: leakage, numpy array of uint32
+        """
+        # map the simulation time of every update to its sample
+        if self.align:
+            downsample = int(self.downsample)
+            indices = (updates["time"] // np.uint64(downsample)).astype(np.int64)
+            samples = int(self.simulation_time_max) // downsample + 1
+        else:
+            samples = len(self.simulation_time_array)
+            indices = np.searchsorted(self.simulation_time_array, updates["time"])
+            if np.any(self.simulation_time_array[np.minimum(indices, samples - 1)] != updates["time"]):
+                raise Exception("simulation time not contained in the time steps of the first trace")
+        return helper.leakageFromUpdates(updates, indices, samples, self.numeric_ids_under_inspection_set, self.leakage)
+
     def __getitem__(self, key):
         return self.generate_trace(key)
 
@@ -385,7 +277,7 @@ aqc = AcquisitionSetupToggle(settings)
 # export traces to container
 if settings["writeTraces"]:
     if settings["format"] == "lascar":
-        helper.lascarHDF5Export(aqc, settings["traceFileName"], writeTracesBatchSize=settings["writeTracesBatchSize"], logger=logger)
+        helper.lascarHDF5Export(aqc, settings["traceFileName"], writeTracesBatchSize=settings["writeTracesBatchSize"], logger=logger, compression=settings["writeTracesCompression"])
     elif settings["format"] == "tueisec":
         tueisec.export(aqc, settings, settingsFileLocation=settings["settingsFileLocation"])
     else:
@@ -403,4 +295,4 @@ if settings["writeTraces"]:
 # aqc.generate_trace(0)
 
 
-logger.info("synthesize traces from pickles finished")
+logger.info("synthesize traces from updates finished")
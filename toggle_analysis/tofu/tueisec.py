@@ -26,6 +26,7 @@ import re
 import os
 import numpy as np
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
 class tueisecException(Exception):
@@ -118,8 +119,9 @@ def export(container, settings, settingsFileLocation="./"):
     # Initialize the HDF5 file
     h5filehandle = h5utils.hdf5_file_init(config, target_info="VCD dump simulation by TOFU tool.")
     n_traces = len(container)
-    # create group
-    h5utils.hdf5_add_group(h5filehandle, config, N_traces=n_traces, noSamples=num_samples)
+    batch_size = max(1, int(settings["writeTracesBatchSize"]))
+    # create group, the samples are chunked by the number of traces written at once
+    h5utils.hdf5_add_group(h5filehandle, config, N_traces=n_traces, noSamples=num_samples, chunk_traces=batch_size, compression=settings.get("writeTracesCompression", None))
 
     # specify additional datasets, e.g. with input, output and secret data/key
     try:
@@ -133,7 +135,7 @@ def export(container, settings, settingsFileLocation="./"):
         if not os.path.isabs(settings["pickleGlob"]):
             vcd_dump_path = settingsFilePath + vcd_dump_path
         vcddir = os.path.dirname(vcd_dump_path) + "/"  # same folder as VCD files
-        npyfiles = [vcddir + f for f in os.listdir(vcddir) if f.endswith(".npy")]  # get list of .npy files
+        npyfiles = [vcddir + f for f in os.listdir(vcddir) if f.endswith(".npy") and not f.endswith(".updates.npy")]  # get list of .npy files, except the state updates written by parse
         datasetname = [os.path.splitext(os.path.split(f)[1])[0] for f in npyfiles]  # use the filename of .npy files for the dataset name in the hdf5
 
     # convert relative paths to absolute paths (to ensure that relative paths are relative to the settings file)
@@ -149,14 +151,19 @@ def export(container, settings, settingsFileLocation="./"):
         if data.shape[0] != n_traces:
             logging.warning("The file %s contains data for %i trace, but %i are simulated." % (file, data.shape[0], n_traces))
 
-    # add traces (could also be done by h5utils.hdf5_add_data_multitrace?!)
-    for trace_idx in range(0, n_traces):
+    def produceBlock(first):
         # avoid synthesizing the first trace again
-        if trace_idx == 0:
-            data = first_trace[0]
-        else:
-            data = container[trace_idx][0]
-        h5utils.hdf5_add_data(h5filehandle=h5filehandle, dataset_name="samples", data=data, trace_number=trace_idx, group=0)
+        return np.stack([first_trace[0] if trace_idx == 0 else container[trace_idx][0] for trace_idx in range(first, min(first + batch_size, n_traces))])
+
+    # add traces block by block, the next block is synthesized by a background worker while the current one is written
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        nextBlock = executor.submit(produceBlock, 0)
+        for first in range(0, n_traces, batch_size):
+            data = nextBlock.result()
+            if first + batch_size < n_traces:
+                nextBlock = executor.submit(produceBlock, first + batch_size)
+            # write the hyperslab directly, hdf5_add_data_multitrace would drop the sample dimension of single-sample traces
+            h5filehandle["0000"]["samples"][first : first + data.shape[0], :, 0] = data
 
     # close HDF5 file
     h5utils.hdf5_file_close(h5filehandle)